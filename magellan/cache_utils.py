@@ -0,0 +1,752 @@
+"""
+Module containing DepCache class.
+
+Indexed SQLite store for everything Magellan caches about packages: PyPI
+package documents (split into per-package info and per-release rows),
+per-version requirements and fetch metadata. Replaces the flat directory of
+{pkg}.json and {pkg}_{ver}_req.json files.
+"""
+
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from magellan.utils import MagellanConfig, mkdir_p
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+SCHEMA_VERSION = 5
+
+# The parts of a PyPI package document Magellan reads; the rest (long
+# descriptions, per-file digests, sizes, upload times..) is not stored.
+INFO_FIELDS = ('name', 'version', 'requires_dist')
+FILE_FIELDS = ('filename', 'packagetype', 'url', 'yanked', 'core_metadata')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    package TEXT PRIMARY KEY,       -- lower case key
+    info TEXT NOT NULL,             -- JSON INFO_FIELDS of PyPI document
+    fetched_at REAL NOT NULL,
+    accessed_at REAL                -- last read, for LRU pruning
+);
+CREATE TABLE IF NOT EXISTS releases (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    yanked INTEGER NOT NULL DEFAULT 0,
+    files TEXT NOT NULL,            -- JSON list of FILE_FIELDS per file
+    PRIMARY KEY (package, version)
+);
+CREATE TABLE IF NOT EXISTS requirements (
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    body TEXT NOT NULL,             -- JSON requirements dict
+    source TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL,
+    PRIMARY KEY (package, version)
+);
+CREATE TABLE IF NOT EXISTS fetch_meta (
+    package TEXT PRIMARY KEY,
+    url TEXT,
+    status INTEGER,
+    bytes INTEGER,
+    fetched_at REAL NOT NULL,       -- last downloaded or revalidated
+    etag TEXT,                      -- HTTP validators of the download
+    last_modified TEXT
+);
+CREATE TABLE IF NOT EXISTS local_files (
+    path TEXT PRIMARY KEY,          -- file in a local index directory
+    root TEXT NOT NULL,             -- the local index directory
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    name TEXT,
+    version TEXT,
+    packagetype TEXT,
+    requires TEXT                   -- JSON list, NULL if unknown
+);
+CREATE INDEX IF NOT EXISTS local_files_root ON local_files (root);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,          -- e.g. PyPIHelper.metrics outcomes
+    value INTEGER NOT NULL
+);
+"""
+
+# (table, column, type) added since the first schema, by version.
+_ADDED_COLUMNS = (
+    ('fetch_meta', 'etag', 'TEXT'),  # v3
+    ('fetch_meta', 'last_modified', 'TEXT'),  # v3
+    ('packages', 'accessed_at', 'REAL'),  # v5
+    ('requirements', 'accessed_at', 'REAL'),  # v5
+)
+
+
+class _MemoryLRU(object):
+    """Thread safe LRU of values with a budget on their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key: (value, size); oldest first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items[key] = item
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key):
+        """Value for key, without counting or refreshing it."""
+        with self._lock:
+            item = self._items.get(key)
+            return item[0] if item is not None else None
+
+    def put(self, key, value, size):
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                self._discard(next(iter(self._items)))
+
+    def pop(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.n_bytes -= item[1]
+
+
+class DepCache(object):
+    """SQLite dependency cache; one file per cache directory.
+
+    Connections are per thread; writes take an immediate (write) lock so
+    concurrent threads and processes serialise cleanly and readers never
+    see a half written package.
+
+    Package documents read are kept in an in-process LRU (bounded by
+    MagellanConfig.memory_cache_bytes of stored JSON), so repeated lookups
+    of a package cost a dict hit; documents returned are shared and must not
+    be modified.
+    """
+
+    db_name = 'magellan.sqlite'
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_dir):
+        mkdir_p(cache_dir)
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, self.db_name)
+        self._local = threading.local()
+        self._memory = _MemoryLRU(MagellanConfig.memory_cache_bytes)
+        self._accessed = set()  # (table, key..) marked accessed this run
+        self._init_schema()
+
+    @staticmethod
+    def default(cache_dir=None):
+        """Shared DepCache for cache_dir (MagellanConfig.cache_dir if None);
+        legacy cache files found there are migrated on first use."""
+        if cache_dir is None:
+            cache_dir = MagellanConfig.cache_dir
+        with DepCache._instances_lock:
+            if cache_dir not in DepCache._instances:
+                store = DepCache(cache_dir)
+                store.migrate_from_dir(cache_dir)
+                DepCache._instances[cache_dir] = store
+            return DepCache._instances[cache_dir]
+
+    # Connection handling
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def _read(self):
+        """Read transaction: statements inside see one snapshot of the
+        store, whatever other processes commit meanwhile."""
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def _init_schema(self):
+        try:
+            self.conn.executescript(_SCHEMA)
+            self._migrate_schema()
+        except sqlite3.DatabaseError as e:
+            maglog.warn("Cache {0} unreadable ({1}); starting afresh."
+                        .format(self.path, e))
+            self.close()
+            # The WAL and shared memory files go too, or SQLite would replay
+            # the stale WAL into the new store.
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.rename(self.path + suffix,
+                              self.path + suffix + '.corrupt')
+            self.conn.executescript(_SCHEMA)
+        self.conn.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+
+    def _migrate_schema(self):
+        """Bring a store written by an older Magellan up to SCHEMA_VERSION.
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self._write() as conn:
+            for table, col, col_type in _ADDED_COLUMNS:
+                columns = [x[1] for x in conn.execute(
+                    "PRAGMA table_info({0})".format(table))]
+                if col not in columns:
+                    conn.execute("ALTER TABLE {0} ADD COLUMN {1} {2}"
+                                 .format(table, col, col_type))
+
+            if version < 4:  # slim existing documents down
+                conn.executemany(
+                    "UPDATE packages SET info = ? WHERE package = ?",
+                    [(json.dumps(slim_package_json({'info': json.loads(x)})
+                                 ['info']), key) for key, x in
+                     conn.execute("SELECT package, info FROM packages")])
+                conn.executemany(
+                    "UPDATE releases SET files = ? WHERE package = ? "
+                    "AND version = ?",
+                    [(json.dumps(slim_package_json(
+                        {'releases': {ver: json.loads(x)}})
+                        ['releases'][ver]), key, ver) for key, ver, x in
+                     conn.execute(
+                         "SELECT package, version, files FROM releases")])
+
+    def close(self):
+        """Close this thread's connection."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # PyPI package documents
+
+    def put_package(self, package, package_json, url=None, status=200,
+                    n_bytes=None, etag=None, last_modified=None):
+        """Store (the slim_package_json of) a PyPI package document,
+        replacing any previous one, with the ETag/Last-Modified validators
+        it was served with."""
+        key = package.lower()
+        now = time.time()
+        package_json = slim_package_json(package_json)
+        release_rows = [
+            (key, ver, int(bool(files) and all(
+                x.get('yanked', False) for x in files)), json.dumps(files))
+            for ver, files in package_json.get('releases', {}).items()]
+
+        with self._write() as conn:
+            conn.execute("DELETE FROM releases WHERE package = ?", (key,))
+            conn.execute("INSERT OR REPLACE INTO packages (package, info, "
+                         "fetched_at, accessed_at) VALUES (?, ?, ?, ?)",
+                         (key, json.dumps(package_json.get('info') or {}),
+                          now, now))
+            conn.executemany("INSERT INTO releases VALUES (?, ?, ?, ?)",
+                             release_rows)
+            conn.execute(
+                "INSERT OR REPLACE INTO fetch_meta (package, url, status, "
+                "bytes, fetched_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, status, n_bytes, now, etag, last_modified))
+        self._memory.pop(key)
+
+    def touch_package(self, package, status=304):
+        """Mark the cached document for package as just revalidated."""
+        key = package.lower()
+        now = time.time()
+        with self._write() as conn:
+            conn.execute("UPDATE packages SET fetched_at = ? "
+                         "WHERE package = ?", (now, key))
+            conn.execute("UPDATE fetch_meta SET fetched_at = ?, status = ? "
+                         "WHERE package = ?", (now, status, key))
+        entry = self._memory.peek(key)
+        if entry is not None:
+            entry['fetched_at'] = now
+
+    def put_miss(self, package, url=None, status=None):
+        """Record that package could not be fetched: status is the HTTP
+        status (e.g. 404), or None if no response was received."""
+        with self._write() as conn:
+            # Keep the validators of a cached package, so a transient failure
+            # doesn't turn the next revalidation into a full fetch.
+            conn.execute(
+                "UPDATE fetch_meta SET status = ?, fetched_at = ? "
+                "WHERE package = ?", (status, time.time(), package.lower()))
+            conn.execute(
+                "INSERT OR IGNORE INTO fetch_meta (package, url, status, "
+                "fetched_at) VALUES (?, ?, ?, ?)",
+                (package.lower(), url, status, time.time()))
+
+    def is_known_missing(self, package, ttl):
+        """True if package is not cached and a fetch of it failed less than
+        ttl seconds ago."""
+        key = package.lower()
+        row = self.conn.execute(
+            "SELECT status, fetched_at FROM fetch_meta WHERE package = ? "
+            "AND package NOT IN (SELECT package FROM packages)",
+            (key,)).fetchone()
+        if row is None or row[0] in (200, 304):
+            return False
+        return time.time() - row[1] < ttl
+
+    def get_validators(self, package):
+        """(etag, last_modified) stored for package; either may be None."""
+        row = self.conn.execute(
+            "SELECT etag, last_modified FROM fetch_meta WHERE package = ?",
+            (package.lower(),)).fetchone()
+        return tuple(row) if row is not None else (None, None)
+
+    def package_ages_bulk(self, packages):
+        """{package: seconds since fetched or revalidated} for those of
+        packages in the cache."""
+        keys = {p.lower(): p for p in packages}
+        now = time.time()
+        out = {}
+        to_query = []
+        for key in keys:
+            entry = self._memory.peek(key)
+            if entry is not None:
+                out[keys[key]] = now - entry['fetched_at']
+            else:
+                to_query.append(key)
+
+        for chunk in _chunks(to_query):
+            for key, fetched_at in self.conn.execute(
+                    "SELECT package, fetched_at FROM packages WHERE package "
+                    "IN ({0})".format(','.join('?' * len(chunk))), chunk):
+                out[keys[key]] = now - fetched_at
+        return out
+
+    def is_fresh(self, package, ttl):
+        """
+        True if package is cached and younger than ttl seconds; a ttl of
+        None or below zero never expires.
+        """
+        age = self.package_ages_bulk([package]).get(package)
+        if age is None:
+            return False
+        return ttl is None or ttl < 0 or age < ttl
+
+    def get_package(self, package):
+        """PyPI package document as {'info':.., 'releases':..} or None."""
+        return self.get_packages_bulk([package]).get(package)
+
+    def get_packages_bulk(self, packages):
+        """{package: document} for those of packages in the cache."""
+        keys = {p.lower(): p for p in packages}
+        out = {}
+        to_query = []
+        for key in keys:
+            entry = self._memory.get(key)
+            if entry is not None:
+                out[keys[key]] = entry['doc']
+            else:
+                to_query.append(key)
+
+        for chunk in _chunks(to_query):
+            marks = ','.join('?' * len(chunk))
+            loaded = {}
+            with self._read() as conn:
+                for key, info, fetched_at in conn.execute(
+                        "SELECT package, info, fetched_at FROM packages "
+                        "WHERE package IN ({0})".format(marks), chunk):
+                    loaded[key] = {'doc': {'info': json.loads(info),
+                                           'releases': {}},
+                                   'fetched_at': fetched_at,
+                                   'size': len(info)}
+                release_rows = conn.execute(
+                    "SELECT package, version, files FROM releases WHERE "
+                    "package IN ({0})".format(marks), chunk).fetchall()
+            for key, ver, files in release_rows:
+                if key not in loaded:
+                    continue
+                loaded[key]['doc']['releases'][ver] = json.loads(files)
+                loaded[key]['size'] += len(files)
+
+            for key, entry in loaded.items():
+                self._memory.put(key, entry, entry.pop('size'))
+                out[keys[key]] = entry['doc']
+            self._mark_accessed('packages', [(x,) for x in loaded])
+        return out
+
+    def release_versions(self, package):
+        """List of release versions of package, or None if not cached."""
+        key = package.lower()
+        entry = self._memory.peek(key)
+        if entry is not None:
+            return list(entry['doc']['releases'])
+        cur = self.conn.execute(
+            "SELECT 1 FROM packages WHERE package = ?", (key,))
+        if cur.fetchone() is None:
+            return None
+        return [x[0] for x in self.conn.execute(
+            "SELECT version FROM releases WHERE package = ?", (key,))]
+
+    def has_release(self, package, version):
+        """True/False if package/version is (not) a release, None if the
+        package is not cached."""
+        key = package.lower()
+        entry = self._memory.peek(key)
+        if entry is not None:
+            return version in entry['doc']['releases']
+        cur = self.conn.execute(
+            "SELECT 1 FROM releases WHERE package = ? AND version = ?",
+            (key, version))
+        if cur.fetchone() is not None:
+            return True
+        cur = self.conn.execute(
+            "SELECT 1 FROM packages WHERE package = ?", (key,))
+        return False if cur.fetchone() is not None else None
+
+    # Per-version requirements
+
+    def put_requirements(self, package, version, requirements, source=None):
+        with self._write() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO requirements (package, version, body, "
+                "source, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (package.lower(), version, json.dumps(requirements), source,
+                 time.time(), time.time()))
+
+    def get_requirements(self, package, version):
+        """Cached requirements dict for package/version or None."""
+        return self.get_requirements_bulk(
+            [(package, version)]).get((package, version))
+
+    def get_requirements_bulk(self, package_versions):
+        """{(package, version): requirements} for cached pairs."""
+        wanted = {(p.lower(), v): (p, v) for p, v in package_versions}
+        out = {}
+        found = []
+        for chunk in _chunks(sorted(set(x[0] for x in wanted))):
+            marks = ','.join('?' * len(chunk))
+            for key, ver, body in self.conn.execute(
+                    "SELECT package, version, body FROM requirements WHERE "
+                    "package IN ({0})".format(marks), chunk):
+                if (key, ver) in wanted:
+                    out[wanted[(key, ver)]] = json.loads(body)
+                    found.append((key, ver))
+        self._mark_accessed('requirements', found)
+        return out
+
+    def _mark_accessed(self, table, keys):
+        """
+        Set accessed_at of rows of table (packages or requirements) by key
+        tuple; each row at most once per process, so reads stay cheap.
+        """
+        keys = [x for x in keys if (table,) + x not in self._accessed]
+        if not keys:
+            return
+        self._accessed.update((table,) + x for x in keys)
+        where = ("package = ?" if table == 'packages'
+                 else "package = ? AND version = ?")
+        now = time.time()
+        with self._write() as conn:
+            conn.executemany(
+                "UPDATE {0} SET accessed_at = ? WHERE {1}".format(table, where),
+                [(now,) + x for x in keys])
+
+    # Local (offline) index files
+
+    def get_local_files(self, root):
+        """{path: row dict} of indexed files under local index root."""
+        cols = ('path', 'mtime', 'size', 'name', 'version', 'packagetype',
+                'requires')
+        out = {}
+        for row in self.conn.execute(
+                "SELECT {0} FROM local_files WHERE root = ?"
+                .format(', '.join(cols)), (root,)):
+            row = dict(zip(cols, row))
+            if row['requires'] is not None:
+                row['requires'] = json.loads(row['requires'])
+            out[row['path']] = row
+        return out
+
+    def put_local_files(self, root, rows, removed_paths=()):
+        """Upsert indexed file rows for root and drop removed_paths."""
+        with self._write() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO local_files VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?)",
+                [(x['path'], root, x['mtime'], x['size'], x['name'],
+                  x['version'], x['packagetype'],
+                  None if x['requires'] is None
+                  else json.dumps(x['requires'])) for x in rows])
+            conn.executemany("DELETE FROM local_files WHERE path = ?",
+                             [(x,) for x in removed_paths])
+
+    # Housekeeping
+
+    def stats(self):
+        """Entry counts and stored bytes per table, plus file size."""
+        out = {}
+        for table, cols in (('packages', 'info'), ('releases', 'files'),
+                            ('requirements', 'body'),
+                            ('fetch_meta', 'url'),
+                            ('local_files', 'requires')):
+            count, n_bytes = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH({0})), 0) FROM {1}"
+                .format(cols, table)).fetchone()
+            out[table] = {'entries': count, 'bytes': n_bytes}
+        out['memory'] = {'entries': len(self._memory),
+                         'bytes': self._memory.n_bytes,
+                         'hits': self._memory.hits,
+                         'misses': self._memory.misses}
+        out['file_bytes'] = self._store_bytes()
+        # pip's download cache, sdists being read..
+        out['other_bytes'] = sum(st.st_size for _, st in self._other_files())
+        out['counters'] = self.get_counters()
+        return out
+
+    def _store_bytes(self):
+        return sum(os.path.getsize(x) for x in glob.glob(self.path + '*')
+                   if not x.endswith('.corrupt'))
+
+    def _other_files(self):
+        """(path, stat) of files under cache_dir other than the store."""
+        store_files = set(x for x in glob.glob(self.path + '*')
+                          if not x.endswith('.corrupt'))
+        for dir_path, _, file_names in os.walk(self.cache_dir):
+            for fn in file_names:
+                path = os.path.join(dir_path, fn)
+                if path in store_files:
+                    continue
+                try:
+                    yield path, os.stat(path)
+                except OSError:  # removed meanwhile
+                    continue
+
+    def add_counters(self, counts):
+        """Add counts ({name: n}, e.g. PyPIHelper.metrics) to the totals
+        kept across runs."""
+        with self._write() as conn:
+            for name, n in counts.items():
+                conn.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)",
+                             (name,))
+                conn.execute("UPDATE counters SET value = value + ? "
+                             "WHERE name = ?", (n, name))
+
+    def get_counters(self):
+        return dict(self.conn.execute("SELECT name, value FROM counters"))
+
+    def prune(self, max_bytes, files=True):
+        """
+        Evict the least recently accessed package documents, requirements
+        and other files under cache_dir until the cache fits in max_bytes.
+
+        :param bool files: False to leave other files (pip's download
+        cache, sdists) alone and fit only the store in max_bytes; safe
+        while other Magellan processes use the cache.
+        :rtype: dict
+        :return: {'entries': rows evicted, 'files': files removed,
+                  'bytes': approximate bytes freed}
+        """
+        if not files and self._store_bytes() <= max_bytes:
+            return {'entries': 0, 'files': 0, 'bytes': 0}
+
+        conn = self.conn
+        candidates = [
+            (accessed, 'packages', (key,), size) for key, accessed, size in
+            conn.execute(
+                "SELECT p.package, COALESCE(p.accessed_at, p.fetched_at), "
+                "LENGTH(p.info) + COALESCE((SELECT SUM(LENGTH(r.files)) "
+                "FROM releases r WHERE r.package = p.package), 0) "
+                "FROM packages p")]
+        candidates.extend(
+            (accessed, 'requirements', (key, ver), size)
+            for key, ver, accessed, size in conn.execute(
+                "SELECT package, version, COALESCE(accessed_at, fetched_at), "
+                "LENGTH(body) FROM requirements"))
+        if files:
+            candidates.extend(
+                (max(st.st_atime, st.st_mtime), 'file', (path,), st.st_size)
+                for path, st in self._other_files())
+
+        # SQLite pages hold more than the JSON itself; count the overhead as
+        # fixed so evicting rows frees roughly their own size.
+        content = sum(x[3] for x in candidates if x[1] != 'file')
+        overhead = max(0, self._store_bytes() - content)
+        total = overhead + sum(x[3] for x in candidates)
+
+        evicted = {'packages': [], 'requirements': [], 'file': []}
+        freed = freed_rows = 0
+        for accessed, kind, key, size in sorted(candidates):
+            if total - freed <= max_bytes:
+                break
+            evicted[kind].append(key)
+            freed += size
+            if kind != 'file':
+                freed_rows += size
+
+        for (path,) in evicted['file']:
+            try:
+                os.remove(path)
+            except OSError as e:
+                maglog.info("Unable to remove {0}: {1}".format(path, e))
+        if evicted['packages'] or evicted['requirements']:
+            with self._write() as conn:
+                for table in ('packages', 'releases', 'fetch_meta'):
+                    conn.executemany(
+                        "DELETE FROM {0} WHERE package = ?".format(table),
+                        evicted['packages'])
+                conn.executemany("DELETE FROM requirements WHERE package = ? "
+                                 "AND version = ?", evicted['requirements'])
+            for (key,) in evicted['packages']:
+                self._memory.pop(key)
+            # Rewriting the whole file only pays off for a bulk eviction (a
+            # quarter of the stored content); otherwise SQLite reuses the
+            # free pages.
+            if freed_rows * 4 >= content:
+                self._compact()
+
+        n_rows = len(evicted['packages']) + len(evicted['requirements'])
+        if n_rows or evicted['file']:
+            maglog.info("Pruned {0} entries and {1} files ({2} bytes) from "
+                        "{3}".format(n_rows, len(evicted['file']), freed,
+                                     self.cache_dir))
+        return {'entries': n_rows, 'files': len(evicted['file']),
+                'bytes': freed}
+
+    def _compact(self):
+        """Return free pages to the file system."""
+        self.conn.execute("VACUUM")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def check_integrity(self):
+        """True if SQLite reports the store as intact."""
+        res = self.conn.execute("PRAGMA integrity_check").fetchall()
+        return res == [('ok',)]
+
+    def clear(self, files=False):
+        """Empty the store; with files, also delete everything else under
+        cache_dir (pip's download cache, ..)."""
+        self._memory.clear()
+        with self._write() as conn:
+            for table in ('packages', 'releases', 'requirements',
+                          'fetch_meta', 'local_files', 'counters'):
+                conn.execute("DELETE FROM {0}".format(table))
+        if files:
+            for path, _ in list(self._other_files()):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    maglog.info("Unable to remove {0}: {1}".format(path, e))
+            for dir_path, dir_names, _ in os.walk(self.cache_dir,
+                                                  topdown=False):
+                for d in dir_names:
+                    try:
+                        os.rmdir(os.path.join(dir_path, d))
+                    except OSError:  # not empty
+                        pass
+            self._compact()
+
+    def migrate_from_dir(self, cache_dir):
+        """
+        Import legacy {pkg}.json and {pkg}_{ver}_req.json files from
+        cache_dir into the store, removing each once imported.
+
+        :rtype: int
+        :return: number of files migrated
+        """
+        migrated = 0
+        for f in glob.glob(os.path.join(cache_dir, '*.json')):
+            try:
+                with open(f, 'r') as ff:
+                    content = json.load(ff)
+            except (IOError, ValueError) as e:
+                maglog.info("Skipping unreadable cache file {0}: {1}"
+                            .format(f, e))
+                continue
+
+            if f.endswith('_req.json'):
+                if 'project_name' not in content or 'version' not in content:
+                    continue
+                self.put_requirements(content['project_name'],
+                                      content['version'], content)
+            elif 'releases' in content:
+                package = os.path.basename(f)[:-len('.json')]
+                self.put_package(package, content)
+            else:
+                continue
+
+            os.remove(f)
+            migrated += 1
+
+        if migrated:
+            maglog.info("Migrated {0} cache files into {1}"
+                        .format(migrated, self.path))
+        return migrated
+
+
+def slim_package_json(package_json):
+    """
+    Projection of a PyPI package document onto INFO_FIELDS of "info" and
+    FILE_FIELDS of each release file; what the cache stores.
+
+    :rtype: dict
+    :return: {'info': {..}, 'releases': {version: [{..}, ..]}}
+    """
+    info = package_json.get('info') or {}
+    releases = package_json.get('releases') or {}
+    return {
+        'info': {x: info[x] for x in INFO_FIELDS if x in info},
+        'releases': {ver: [{x: f[x] for x in FILE_FIELDS if x in f}
+                           for f in files or []]
+                     for ver, files in releases.items()},
+    }
+
+
+def _chunks(items, size=500):
+    """Split items to stay below SQLite's bound parameter limit."""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -12,6 +12,32 @@ from magellan.utils import MagellanConfig
 
 maglog = logging.getLogger('magellan_logger')
 
+def cache_cmds(argv):
+    """Commands for "magellan cache", which manages the cache directory."""
+
+    parser = argparse.ArgumentParser(
+        prog="Magellan cache",
+        description="Report on or clean up Magellan's cache.",
+    )
+    parser.add_argument(
+        'action', choices=['stats', 'prune', 'clear'],
+        help="stats: entries, bytes and hit ratios; prune: evict least "
+             "recently used entries down to --cache-max-mb; clear: remove "
+             "everything.")
+    parser.add_argument(
+        '--cache-dir', type=str, default=MagellanConfig.cache_dir,
+        metavar="<cache-dir>", help="Cache directory.")
+    parser.add_argument(
+        '--cache-max-mb', type=int,
+        default=MagellanConfig.cache_max_bytes // (1024 * 1024),
+        metavar="<megabytes>", help="Size budget used by prune.")
+    parser.add_argument(
+        '--colour', '--color', action='store_true', default=False,
+        help="Prints output to console with pretty colours.")
+
+    return vars(parser.parse_args(argv))
+
+
 def cmds():
     """Commands for magellan."""
 
@@ -27,14 +53,32 @@ def cmds():
         '-f', '--package-file', type=str, metavar="<package_file>",
         help="File with list of packages")
     parser.add_argument(
-        '-r', '--requirements-file', type=str, metavar="<requirements_file>",
-        help="requirements file (e.g. requirements.txt) to check.")
+        '-r', '--requirements-file', type=str, action='append',
+        metavar="<requirements_file>",
+        help="requirements file (e.g. requirements.txt) to check; a glob "
+             "(quoted, e.g. 'requirements*.txt') selects several. NB Can be "
+             "used multiple times.")
 
     # Optional Arguments
     parser.add_argument(
         '-n', '--venv-name', default=None, metavar="<venv_name>",
         help=("Specify name of virtual environment, "
               "if nothing Magellan will use current environment."))
+    parser.add_argument(
+        '--from-requirements', type=str, default=None,
+        metavar="<requirements_file>",
+        help="Analyse the environment that installing this requirements "
+             "file would give, resolved from package metadata without "
+             "installing anything, instead of an existing environment.")
+    parser.add_argument(
+        '--from-freeze', type=str, default=None, metavar="<freeze_file>",
+        help="Analyse the environment recorded in a \"pip freeze\" "
+             "snapshot instead of an existing environment; requirements "
+             "come from package metadata, so no virtual env is needed.")
+    parser.add_argument(
+        '--lock-file', type=str, default=None, metavar="<lock_file>",
+        help="With --from-requirements, write the resolved, fully pinned "
+             "package set to this file.")
 
     parser.add_argument(
         '-A', '--get-ancestors', action='append', nargs=1,
@@ -74,6 +118,35 @@ def cmds():
         help="Compare a requirements file to an environment."
     )
 
+    parser.add_argument(
+        '--compare-env', action='append', default=None,
+        metavar="<venv_name>",
+        help="With -R, compare every requirements file (-r) against each "
+             "of these environments (and -n, if given) and print a single "
+             "matrix; each environment is interrogated once. A pip freeze "
+             "file or a directory of env files kept with --keep-env-files "
+             "is read as a snapshot. NB Can be used multiple times.")
+
+    parser.add_argument(
+        '--diff-env', nargs=2, default=None,
+        metavar=("<old_env>", "<new_env>"),
+        help="Report packages and requirement edges added, removed or "
+             "changed between two environments and exit. Each is a virtual "
+             "env name, a pip freeze file, or a directory of env files kept "
+             "with --keep-env-files.")
+
+    parser.add_argument(
+        '--allowed-versions', action='append', nargs=1, metavar="<package>",
+        help="Show the versions of package on PyPI that every package "
+             "depending on it in the environment accepts. NB Can be used "
+             "multiple times.")
+
+    parser.add_argument(
+        '--prefetch', action='store_true', default=False,
+        help="Fetch PyPI documents and dependency records for the packages "
+             "in a requirements file (-r) or environment, and their "
+             "candidate versions, into the cache concurrently and exit.")
+
     parser.add_argument(
         '-l', '--list-all-versions', action='append', nargs=1, type=str,
         metavar="<package>",
@@ -102,6 +175,43 @@ def cmds():
         '--cache-dir', type=str, default=MagellanConfig.cache_dir,
         metavar="<cache-dir>",
         help="Cache directory - used for pip installs.")
+    parser.add_argument(
+        '--cache-max-mb', type=int,
+        default=MagellanConfig.cache_max_bytes // (1024 * 1024),
+        metavar="<megabytes>",
+        help="Size budget of the cache. After a successful run, least "
+             "recently used PyPI documents and requirements are evicted to "
+             "keep the store within it; other files (pip's download cache, "
+             "sdists) only by 'magellan cache prune'.")
+    parser.add_argument(
+        '--cache-ttl', type=int, default=MagellanConfig.cache_ttl,
+        metavar="<seconds>",
+        help="Age after which cached PyPI documents are revalidated with "
+             "PyPI (a cheap conditional request if unchanged). Negative "
+             "never revalidates.")
+    parser.add_argument(
+        '--negative-cache-ttl', type=int,
+        default=MagellanConfig.negative_cache_ttl, metavar="<seconds>",
+        help="How long packages not found on (or not fetched from) PyPI "
+             "are remembered as missing before being looked up again.")
+    parser.add_argument(
+        '--index-url', type=str, default=MagellanConfig.index_url,
+        metavar="<index-url>",
+        help="Base URL of a simple API (PEP 503/691) package index, e.g. "
+             "https://pypi.org/simple/ or a private mirror, to use instead "
+             "of the PyPI JSON API.")
+    parser.add_argument(
+        '--local-index', action='append', default=None,
+        metavar="<wheelhouse-dir>",
+        help="Directory of wheels and sdists (e.g. a wheelhouse or pip "
+             "cache) to use as the package source instead of PyPI; no "
+             "network calls or temporary installs are made. NB Can be used "
+             "multiple times.")
+    parser.add_argument(
+        '--workers', type=int, default=MagellanConfig.workers,
+        metavar="<workers>",
+        help="Number of packages to acquire dependencies for concurrently "
+             "(-D, -P).")
     parser.add_argument(
         '--keep-env-files', action='store_true', default=False,
         help="Don't delete the nodes, edges, package_requirements env files.")
@@ -118,6 +228,12 @@ def cmds():
     parser.add_argument(
         '--colour', '--color', action='store_true', default=False,
         help="Prints output to console with pretty colours.")
+    parser.add_argument(
+        '--format', choices=['text', 'jsonl'],
+        default=MagellanConfig.output_format,
+        help="Output format of -O, -C and -P. jsonl writes one JSON record "
+             "per package or conflict to stdout as soon as it is computed; "
+             "other messages go to stderr.")
 
     mag_ver = [x for x in pkg_resources.working_set
                if x.key == 'magellan'][0].version
@@ -1,11 +1,20 @@
+from __future__ import print_function
+
 import os
 import operator
+import threading
+from collections import Counter
+from multiprocessing.pool import ThreadPool
 from pkg_resources import parse_version
 from pkg_resources import resource_filename as pkg_res_resource_filename
 from pprint import pformat
 import requests
 import json
 import logging
+try:
+    from Queue import Queue
+except ImportError:  # Python 3
+    from queue import Queue
 
 # from terminaltables import AsciiTable as OutputTableType
 from terminaltables import SingleTable as OutputTableType
@@ -13,15 +22,28 @@ from terminaltables import SingleTable as OutputTableType
 
 from magellan.package_utils import Package
 from magellan.env_utils import Environment
-from magellan.utils import MagellanConfig, run_in_subprocess, print_col
+from magellan.cache_utils import DepCache
+from magellan.fetch_utils import FetchEngine
+from magellan.index_utils import LocalIndex
+from magellan.metadata_utils import SdistMetadata, requirements_from_strings
+from magellan.pypi_utils import PyPIHelper
+from magellan.simple_utils import SimpleIndex
+from magellan.utils import (MagellanConfig, run_in_subprocess, print_col,
+                            mkdir_p, jsonl_output, print_record, text_stream)
 
 # Logging:
 maglog = logging.getLogger("magellan_logger")
 
+_provider_counts_lock = threading.Lock()
+
 
 class DepTools(object):
     """Tools for conflict detection."""
 
+    # Count of requirement lookups answered by each METADATA_PROVIDERS
+    # source (or 'install').
+    provider_counts = Counter()
+
     @staticmethod
     def check_changes_in_requirements_vs_env(requirements, descendants):
         """
@@ -152,11 +174,63 @@ class DepTools(object):
                                  requirement_ver, requirement_met)
 
     @staticmethod
-    def get_deps_for_package_version(package, version, vex_options=None):
+    def get_deps_for_package_version(package, version, vex_options=None,
+                                     tmp_env_name=None):
         """Gets dependencies for a specific version of a package.
 
+        Runs through METADATA_PROVIDERS (cache, local index, index metadata
+        files, PyPI JSON requires_dist, sdist metadata) and only if none of
+        them can answer falls back to installing the package into a
+        temporary env; see
+        install_and_get_deps_for_package_version.
+
+        The provider that answered is recorded under 'source' in the
+        returned requirements and in DepTools.provider_counts.
+
+        :param str tmp_env_name: name of the temporary virtual env to install
+        into; defaults to MagellanConfig.tmp_env_dir. Concurrent callers must
+        each use their own.
+        """
+        requirements = DepTools.get_deps_without_install(package, version)
+        if requirements is not None:
+            return requirements
+
+        if LocalIndex.default() is not None:
+            maglog.info("No requirements for {0} {1} in local index; not "
+                        "installing in offline mode.".format(package, version))
+            return {}
+
+        requirements = DepTools.install_and_get_deps_for_package_version(
+            package, version, vex_options, tmp_env_name)
+        return _record_source(package, version, requirements, 'install')
+
+    @staticmethod
+    def get_deps_without_install(package, version):
+        """
+        Ask each of METADATA_PROVIDERS in turn for the requirements of
+        package/version; new answers are written to the cache.
+
+        :rtype: dict
+        :return: requirements, or None if installation is required.
+        """
+        for source, method_name in METADATA_PROVIDERS:
+            requirements = getattr(DepTools, method_name)(package, version)
+            if requirements is None:
+                continue
+
+            if source != 'cache':
+                DepCache.default().put_requirements(
+                    package, version, requirements, source)
+            return _record_source(package, version, requirements, source)
+        return None
+
+    @staticmethod
+    def install_and_get_deps_for_package_version(
+            package, version, vex_options=None, tmp_env_name=None):
+        """Gets dependencies for a specific version of a package by
+        installing it; the slow path.
+
         Specifically:
-        0. Check if this has already been done and cached & return that.
             1. Set up temporary virtualenv
             2. installs package/version into there using pip
             3. Write file to interrogate through virtual env using
@@ -170,20 +244,13 @@ class DepTools(object):
 
         if vex_options is None:
             vex_options = ''
+        if tmp_env_name is None:
+            tmp_env_name = MagellanConfig.tmp_env_dir
 
-        req_out_file = ("{0}_{1}_req.json"
-                        .format(package.lower(), version.replace(".", "_")))
-
-        # 0. Check if this has already been done and cached & return that.
-        cached_file = os.path.join(MagellanConfig.cache_dir, req_out_file)
-
-        if os.path.exists(cached_file):
-            maglog.info("Using previously cached result at {0}"
-                        .format(cached_file))
-            return json.load(open(cached_file, 'r'))
+        cached_file = _req_cache_file(package, version)
 
         # 1. Set up temporary virtualenv
-        tmp_env = Environment(name=MagellanConfig.tmp_env_dir)
+        tmp_env = Environment(name=tmp_env_name)
         tmp_env.create_vex_new_virtual_env(vex_options)  # NB: delete if extant!!
 
         # todo (aj); by default?
@@ -208,17 +275,214 @@ class DepTools(object):
             vex_options, tmp_env.name, interrogation_file, package,
             MagellanConfig.cache_dir))
 
-        # 5. reads that file from current program
+        # 5. reads that file from current program, into the cache
         try:
             result = json.load(open(cached_file, 'r'))
         except IOError:
-            result = {}
+            return {}
 
+        DepCache.default().put_requirements(
+            package, version, result, 'install')
+        os.remove(cached_file)
         return result
 
+    @staticmethod
+    def get_cached_deps_for_package_version(package, version):
+        """
+        Return previously cached dependencies for package/version, or None
+        if there is nothing in the cache.
+        """
+        return DepCache.default().get_requirements(package, version)
+
+    @staticmethod
+    def get_deps_from_local_index(package, version):
+        """Requirements from the local (offline) index, if one is in use."""
+        local_index = LocalIndex.default()
+        if local_index is None:
+            return None
+        return local_index.get_requirements(package, version)
+
+    @staticmethod
+    def get_deps_from_index_metadata(package, version):
+        """
+        Requirements from the PEP 658 metadata file of a release on the
+        --index-url simple index.
+
+        :rtype: dict
+        :return: requirements, or None if no index is set or it publishes no
+        metadata file for the release.
+        """
+        index = SimpleIndex.default()
+        if index is None:
+            return None
+        package_json = PyPIHelper.acquire_package_json_info(package)
+        files = package_json.get('releases', {}).get(version) or []
+        return index.get_requirements(package, version, files)
+
+    @staticmethod
+    def get_deps_from_pypi_json(package, version):
+        """
+        Requirements from the requires_dist of the PyPI JSON; the cached
+        package document covers the latest version, other versions use the
+        per-version document.
+
+        NB: PyPI reports requires_dist as null both for packages with no
+        requirements and for those whose metadata it could not read (e.g.
+        setup.py-only sdists), so null falls through to the next provider.
+
+        :rtype: dict
+        :return: requirements, or None if PyPI does not say.
+        """
+        if SimpleIndex.default() is not None:  # no JSON API
+            return None
+
+        package_json = PyPIHelper.acquire_package_json_info(package)
+        info = package_json.get('info') or {}
+        if not info.get('version') or \
+                parse_version(info['version']) != parse_version(version):
+            package_json = PyPIHelper.acquire_package_version_json_info(
+                package, version)
+            info = package_json.get('info') or {}
+
+        requires_dist = info.get('requires_dist')
+        if requires_dist is None:
+            return None
+
+        return requirements_from_strings(
+            info.get('name') or package, version, requires_dist)
+
+    @staticmethod
+    def get_deps_from_sdist(package, version):
+        """
+        For releases that only ship an sdist, download it and read the
+        requirements from its metadata (see metadata_utils.SdistMetadata)
+        instead of running a full setup.py build in a temporary env.
+
+        :rtype: dict
+        :return: requirements, or None if not sdist-only or undetermined.
+        """
+        package_json = PyPIHelper.acquire_package_json_info(package)
+        files = package_json.get('releases', {}).get(version) or []
+
+        sdists = [x for x in files if x.get('packagetype') == 'sdist']
+        if not sdists or len(sdists) != len(files):
+            return None
+
+        if sdists[0]['url'].startswith('file://'):  # local index
+            return SdistMetadata.get_requirements(
+                sdists[0]['url'][len('file://'):], package, version)
+
+        sdist_dir = os.path.join(MagellanConfig.cache_dir, 'sdists')
+        mkdir_p(sdist_dir)
+        archive_path = os.path.join(sdist_dir, sdists[0]['filename'])
+
+        try:
+            r = FetchEngine.default().get(sdists[0]['url'], stream=True)
+            if r.status_code != 200:
+                maglog.info("failed to download {0}".format(sdists[0]['url']))
+                return None
+            with open(archive_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    f.write(chunk)
+
+            requirements = SdistMetadata.get_requirements(
+                archive_path, package, version)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            maglog.warn("Connection to PyPI failed: {}".format(e))
+            return None
+        finally:
+            if os.path.exists(archive_path):
+                os.remove(archive_path)
+
+        return requirements
+
+    @staticmethod
+    def acquire_deps_for_package_versions(package_version_list, workers=None,
+                                          vex_options=None):
+        """
+        Acquire dependencies for many (package, version) targets
+        concurrently.
+
+        Each worker installs into its own temporary virtual env, named after
+        this process and the worker slot, so neither workers nor other
+        Magellan processes clobber each other. The temporary envs are removed
+        once all targets are done.
+
+        Yields ((package, version), requirements) as each target completes,
+        NOT in input order. requirements is None if the package/version is
+        not on PyPI and {} if the install failed.
+
+        :param list package_version_list: list of (package, version)'s
+        :param int workers: max concurrent acquisitions, defaults to
+        MagellanConfig.workers
+        """
+        if workers is None:
+            workers = MagellanConfig.workers
+        if vex_options is None:
+            vex_options = MagellanConfig.vex_options
+
+        targets = []
+        for p in package_version_list:
+            if tuple(p) not in targets:
+                targets.append(tuple(p))
+
+        # Answer everything already cached in one query, before any workers.
+        cached = DepCache.default().get_requirements_bulk(targets)
+        for target in targets:
+            if target in cached:
+                yield target, _record_source(
+                    target[0], target[1], cached[target], 'cache')
+        targets = [x for x in targets if x not in cached]
+        if not targets:
+            return
+
+        workers = max(1, min(workers, len(targets)))
+
+        env_names = Queue()
+        for i in range(workers):
+            env_names.put("{0}_{1}_{2}".format(
+                MagellanConfig.tmp_env_dir, os.getpid(), i))
+        used_env_names = set()
+
+        def _acquire(target):
+            package, version = target
+            if not PyPIHelper.check_package_version_on_pypi(package, version):
+                return target, None
+
+            requirements = DepTools.get_deps_without_install(
+                package, version)
+            if requirements is not None:
+                return target, requirements
+            if LocalIndex.default() is not None:  # offline; never install
+                return target, {}
+
+            # The providers have been asked already; go straight to the
+            # install rather than through get_deps_for_package_version.
+            tmp_env_name = env_names.get()
+            used_env_names.add(tmp_env_name)
+            try:
+                requirements = \
+                    DepTools.install_and_get_deps_for_package_version(
+                        package, version, vex_options, tmp_env_name)
+                return target, _record_source(package, version, requirements,
+                                              'install')
+            finally:
+                env_names.put(tmp_env_name)
+
+        pool = ThreadPool(workers)
+        try:
+            for result in pool.imap_unordered(_acquire, targets):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+            for tmp_env_name in used_env_names:
+                Environment.vex_remove_virtual_env(tmp_env_name, vex_options)
+
     @staticmethod
     def check_if_ancestors_still_satisfied(
-            package, new_version, ancestors, package_requirements):
+            package, new_version, ancestors, package_requirements,
+            allowed=None):
         """
         Makes sure you haven't offended any of your forefathers...
 
@@ -229,6 +493,9 @@ class DepTools(object):
         :param str new_version:
         :param list ancestors:
         :param dict package_requirements: from virtual env
+        :param VersionIntervals allowed: versions of package all ancestors
+        accept, from Environment.allowed_versions; if new_version is one of
+        them the specs aren't checked one by one.
         :rtype dict{dict, dict}
         :return: checks, conflicts
 
@@ -241,6 +508,7 @@ class DepTools(object):
         package_key = package.lower()
 
         to_check = [x[0][0] for x in ancestors if x[0][0] != 'root']
+        satisfied = allowed is not None and new_version in allowed
         checks = {}
         conflicts = {}
         for anc in to_check:
@@ -248,6 +516,8 @@ class DepTools(object):
             anc_specs = \
                 package_requirements[anc_key]['requires'][package_key]['specs']
             checks[anc_key] = anc_specs
+            if satisfied:
+                continue
             # print(anc_specs)
             for s in anc_specs:
                 is_ok, dets = DepTools.check_requirement_satisfied(
@@ -290,6 +560,7 @@ class DepTools(object):
 
         uc_deps = {}
         conflicts = {}
+        to_acquire = []
         for u in packages:
             package = u[0]
             version = u[1]
@@ -307,12 +578,21 @@ class DepTools(object):
 
                 continue
 
-            if not PyPIHelper.check_package_version_on_pypi(package, version):
+            to_acquire.append((package, version))
+
+        acquired = {}
+        for target, requirements in \
+                DepTools.acquire_deps_for_package_versions(to_acquire):
+            maglog.info("Acquired requirements for {0} {1}".format(*target))
+            acquired[target] = requirements
+
+        for package, version in to_acquire:
+            p_v = "{0}_{1}".format(package, version.replace('.', '_'))
+
+            if acquired.get((package, version)) is None:  # not on PyPI
                 continue
 
-            uc_deps[p_v]['requirements'] = \
-                DepTools.get_deps_for_package_version(
-                    package, version, vex_options=MagellanConfig.vex_options)
+            uc_deps[p_v]['requirements'] = acquired[(package, version)]
 
             ancestors, descendants = Package.get_direct_links_to_any_package(
                 package, venv.edges)
@@ -330,7 +610,8 @@ class DepTools(object):
             # 3. ANCESTOR DEPENDENCIES - check_if_ancestors_still_satisfied
             uc_deps[p_v]['ancestor_dependencies'] = \
                 DepTools.check_if_ancestors_still_satisfied(
-                    package, version, ancestors, venv.package_requirements)
+                    package, version, ancestors, venv.package_requirements,
+                    venv.allowed_versions().get(package.lower()))
 
             conflicts[p_v] = {}
             try:
@@ -359,9 +640,13 @@ class DepTools(object):
         :return: current_env_conflicts
         """
         if not nodes or not package_requirements:
-            print("venv missing required data: nodes or package_requirements.")
+            print("venv missing required data: nodes or package_requirements.",
+                  file=text_stream())
             return []
 
+        # JSON Lines records are written as each conflict is found; the
+        # table can only be drawn once they all are.
+        stream_records = jsonl_output()
         current_env_conflicts = []
 
         ver_info = {n[0].lower(): n[1] for n in nodes}
@@ -373,11 +658,13 @@ class DepTools(object):
             n_key = n[0].lower()
 
             if n_key not in package_requirements:
-                print ("{} missing from package_requirements".format(n))
+                print("{} missing from package_requirements".format(n),
+                      file=text_stream())
                 continue
 
             if 'requires' not in package_requirements[n_key]:
-                print("{} does not have key 'requires'".format(n_key))
+                print("{} does not have key 'requires'".format(n_key),
+                      file=text_stream())
                 continue
 
             node_requirements = package_requirements[n_key]['requires']
@@ -391,11 +678,16 @@ class DepTools(object):
                     req_met, req_details = \
                         DepTools.check_requirement_satisfied(cur_ver, s)
                     if not req_met:
-                        current_env_conflicts.append(
-                            (n, node_requirements[r]['project_name'],
-                             req_details))
-
-        DepTools.table_print_cur_env_conflicts(current_env_conflicts, pretty)
+                        conflict = (n, node_requirements[r]['project_name'],
+                                    req_details)
+                        current_env_conflicts.append(conflict)
+                        if stream_records:
+                            print_record('env_conflict',
+                                         _env_conflict_record(conflict))
+
+        if not stream_records:
+            DepTools.table_print_cur_env_conflicts(
+                current_env_conflicts, pretty)
         return current_env_conflicts
 
     @staticmethod
@@ -418,6 +710,7 @@ class DepTools(object):
         ver_info = {x[0].lower(): x[1] for x in venv.nodes}
 
         deps = {}
+        to_acquire = []
         for p in packages:
             package = p[0]
             version = p[1]
@@ -427,7 +720,7 @@ class DepTools(object):
 
             if not PyPIHelper.check_package_version_on_pypi(package, version):
                 print("Cannot get package info for {} {} on PyPI"
-                      .format(package, version))
+                      .format(package, version), file=text_stream())
                 deps[p_v]['status'] = "No package info on PyPI."
                 continue
 
@@ -440,9 +733,18 @@ class DepTools(object):
                     "Package currently exists - use  upgrade -U.")
                 continue
 
-            # Get requirements if it's actually a new package & on PyPI.
-            requirements = DepTools.get_deps_for_package_version(
-                package, version, vex_options=MagellanConfig.vex_options)
+            to_acquire.append((package, version))
+
+        # Get requirements if it's actually a new package & on PyPI.
+        acquired = {}
+        for target, requirements in \
+                DepTools.acquire_deps_for_package_versions(to_acquire):
+            maglog.info("Acquired requirements for {0} {1}".format(*target))
+            acquired[target] = requirements
+
+        for package, version in to_acquire:
+            p_v = "{0}_{1}".format(package, version.replace('.', '_'))
+            requirements = acquired.get((package, version))
 
             deps[p_v]['requirements'] = requirements
             deps[p_v]['new_packages'] = []
@@ -530,8 +832,12 @@ class DepTools(object):
             upgrade_conflicts, uc_deps = DepTools.detect_upgrade_conflicts(
                 upgrade_conflicts, venv, pretty)
 
-            DepTools.table_print_upgrade_conflicts(
-                upgrade_conflicts, uc_deps, venv, pretty)
+            if jsonl_output():
+                DepTools.record_upgrade_conflicts(
+                    upgrade_conflicts, uc_deps, venv)
+            else:
+                DepTools.table_print_upgrade_conflicts(
+                    upgrade_conflicts, uc_deps, venv, pretty)
             maglog.info(pformat(upgrade_conflicts))
             maglog.debug(pformat(uc_deps))
 
@@ -540,8 +846,11 @@ class DepTools(object):
             addition_conflicts = DepTools.detect_package_addition_conflicts(
                 addition_conflicts, venv)
 
-            DepTools.table_print_additional_package_conflicts(
-                addition_conflicts, pretty)
+            if jsonl_output():
+                DepTools.record_addition_conflicts(addition_conflicts)
+            else:
+                DepTools.table_print_additional_package_conflicts(
+                    addition_conflicts, pretty)
             maglog.info(pformat(addition_conflicts))
 
         return addition_conflicts, upgrade_conflicts
@@ -648,6 +957,71 @@ class DepTools(object):
 
             print("\n")
 
+    @staticmethod
+    def record_upgrade_conflicts(conflicts, dep_info, venv):
+        """
+        Writes the upgrade conflicts as JSON Lines records, one
+        "upgrade_conflict" per package; see table_print_upgrade_conflicts.
+
+        :param dict conflicts: dict of upgrade conflicts
+        :param dict dep_info: dependency information
+        :param Environment venv: virtual environment
+        """
+        for p_k, p in conflicts.items():
+            requirements = dep_info.get(p_k).get('requirements')
+            if not requirements:
+                print_record('upgrade_conflict', {
+                    'id': p_k, 'status': 'requirements_not_found'})
+                continue
+
+            p_name = requirements['project_name']
+            ver = requirements['version']
+            cur_ver = venv.all_packages[p_name.lower()].version
+            direction = ("upgrade" if parse_version(cur_ver) <
+                         parse_version(ver) else "downgrade")
+
+            print_record('upgrade_conflict', {
+                'package': p_name,
+                'version': ver,
+                'current_version': cur_ver,
+                'direction': direction,
+                'missing_packages': p['missing_packages'],
+                'new_dependencies': p['dep_set']['new_deps'],
+                'removed_dependencies': p['dep_set']['removed_deps'],
+                'broken_requirements': p['anc_dep'],
+                'conflicts': bool(
+                    p['missing_packages'] or p['dep_set']['new_deps']
+                    or p['dep_set']['removed_deps'] or p['anc_dep']),
+            })
+
+    @staticmethod
+    def record_addition_conflicts(conflicts):
+        """
+        Writes the package addition conflicts as JSON Lines records, one
+        "addition_conflict" per package; see
+        table_print_additional_package_conflicts.
+
+        :param dict conflicts: dict of addition conflicts
+        """
+        for p_k, p in conflicts.items():
+            requirements = p.get('requirements')
+            if not requirements:
+                print_record('addition_conflict', {
+                    'id': p_k,
+                    'status': p.get('status', 'requirements_not_found')})
+                continue
+
+            print_record('addition_conflict', {
+                'package': requirements.get('project_name'),
+                'version': requirements.get('version'),
+                'may_be_okay': [_requirement_check_record(x)
+                                for x in p['may_be_okay']],
+                'may_try_upgrade': [_requirement_check_record(x)
+                                    for x in p['may_try_upgrade']],
+                'new_packages': p['new_packages'],
+                'conflicts': bool(p['may_try_upgrade'] or p['new_packages']),
+            })
+
     @staticmethod
     def table_print_cur_env_conflicts(conflicts, pretty=False):
         """
@@ -687,23 +1061,143 @@ class DepTools(object):
     def acquire_and_display_dependencies(package_version_list, pretty=False):
         """
         Gets the dependencies information by installing the package and
-        version from PyPI
+        version from PyPI; printed as each one completes.
         """
-        for p in package_version_list:
-            package = p[0]
-            version = p[1]
+        for target, requirements in \
+                DepTools.acquire_deps_for_package_versions(
+                    package_version_list):
+            package, version = target
 
-            if not PyPIHelper.check_package_version_on_pypi(package, version):
+            if requirements is None:
                 print_col("{} {} not found on PyPI.".format(package, version),
                           pretty=pretty, header=True)
                 continue
 
-            requirements = DepTools.get_deps_for_package_version(
-                package, version, vex_options=MagellanConfig.vex_options)
-
             maglog.debug(pformat(requirements))
             _table_print_requirements(requirements, pretty)
 
+    @staticmethod
+    def prefetch(package_version_list, pretty=False, workers=None):
+        """
+        Warm the PyPI document and dependency caches for packages and their
+        candidate versions (see _candidate_versions), fetching concurrently
+        (documents on the shared FetchEngine pool, dependencies with
+        `workers` acquisitions at once), and print hit/miss counts.
+
+        :param list package_version_list: (package, version)'s; version may
+        be None if unknown, e.g. unpinned in a requirements file.
+        :rtype: dict
+        :return: hit/miss counts for 'documents' and 'dependencies'.
+        """
+        store = DepCache.default()
+
+        packages = []
+        for package, _ in package_version_list:
+            if package not in packages:
+                packages.append(package)
+
+        # 1. PyPI documents.
+        if LocalIndex.default() is None:
+            doc_hits = store.get_packages_bulk(packages)
+        else:
+            doc_hits = packages
+        doc_misses = [x for x in packages if x not in doc_hits]
+        fetched = PyPIHelper.acquire_package_json_info_bulk(doc_misses)
+        not_found = [x for x in doc_misses if not fetched.get(x)]
+
+        # 2. Dependency records for candidate versions.
+        targets = []
+        for package, version in package_version_list:
+            if package in not_found:
+                continue
+            index = PyPIHelper.version_index(package)
+            for v in _candidate_versions(version, index):
+                if (package, v) not in targets:
+                    targets.append((package, v))
+
+        dep_hits = store.get_requirements_bulk(targets)
+        failed = []
+        for target, requirements in \
+                DepTools.acquire_deps_for_package_versions(targets, workers):
+            if not requirements:
+                failed.append(target)
+
+        summary = {
+            'documents': {'hits': len(packages) - len(doc_misses),
+                          'misses': len(doc_misses),
+                          'not_found': sorted(not_found)},
+            'dependencies': {'hits': len(dep_hits),
+                             'misses': len(targets) - len(dep_hits),
+                             'failed': sorted(failed)},
+        }
+
+        print_col("Prefetch complete:", pretty=pretty, header=True)
+        for kind, label in (('documents', 'PyPI documents'),
+                            ('dependencies', 'Dependency records')):
+            counts = summary[kind]
+            print_col("  {0}: {1} hits, {2} misses".format(
+                label, counts['hits'], counts['misses']), pretty=pretty)
+        _print_if(summary['documents']['not_found'],
+                  "Not found on PyPI:", pretty=pretty)
+        _print_if(["{0} {1}".format(*x)
+                   for x in summary['dependencies']['failed']],
+                  "Dependencies could not be acquired for:", pretty=pretty)
+        return summary
+
+    @staticmethod
+    def show_allowed_versions(package_list, venv, pretty=False):
+        """
+        Prints the published versions of each package that every package
+        depending on it in venv accepts, i.e. the versions it could be
+        moved to without breaking an ancestor.
+
+        :param package_list: list of names of package to query
+        :param venv: magellan.env_utils.Environment
+        :rtype dict:
+        :returns: {package key: [versions]}, None for packages not in venv
+        """
+        env_name = "the current environment" if not venv.name else venv.name
+        allowed = venv.allowed_versions()
+
+        found = {}
+        for p in package_list:
+            p_key = p[0].lower()  # [0] as list of lists from argparse
+            if p_key not in venv.all_packages:
+                found[p_key] = None
+                maglog.info("{} not found in env".format(p_key))
+                continue
+            package = venv.all_packages[p_key]
+            required_by = {
+                a[0][0]: venv.package_requirements[a[0][0].lower()]
+                ['requires'][p_key]['specs']
+                for a in package.ancestors(venv.edges) if a[0][0] != 'root'}
+            index = PyPIHelper.version_index(package.name)
+            if p_key in allowed:
+                found[p_key] = index.satisfying(allowed[p_key])
+            else:
+                found[p_key] = index.versions
+
+            if jsonl_output():
+                print_record('allowed_versions', {
+                    'package': package.name, 'env': venv.name,
+                    'version': package.version,
+                    'required_by': {k: [list(s) for s in v]
+                                    for k, v in required_by.items()},
+                    'allowed': found[p_key]})
+                continue
+
+            print_col("Versions of {0} that all its dependents in {1} "
+                      "accept:".format(package.name, env_name),
+                      pretty=pretty, header=True)
+            for anc in sorted(required_by):
+                print_col("  {0} requires {1}".format(
+                    anc, ",".join("".join(s) for s in required_by[anc])
+                    or "any version"), pretty=pretty)
+            print_col("  {0}".format(", ".join(found[p_key]) or "None"),
+                      pretty=pretty)
+
+        return found
+
     @staticmethod
     def get_ancestors_of_packages(package_list, venv, pretty=False):
         """
@@ -800,6 +1294,63 @@ class DepTools(object):
                         maglog.exception(e)
 
 
+def _req_cache_file(package, version):
+    """Path of the requirements file written by package_interrogation.py
+    for package/version."""
+    req_out_file = ("{0}_{1}_req.json"
+                    .format(package.lower(), version.replace(".", "_")))
+    return os.path.join(MagellanConfig.cache_dir, req_out_file)
+
+
+# Requirement lookups tried before installing, fastest first:
+# (source, DepTools method).
+METADATA_PROVIDERS = (
+    ('cache', 'get_cached_deps_for_package_version'),
+    ('local-index', 'get_deps_from_local_index'),
+    ('index-metadata', 'get_deps_from_index_metadata'),
+    ('pypi-json', 'get_deps_from_pypi_json'),
+    ('sdist', 'get_deps_from_sdist'),
+)
+
+
+def _candidate_versions(version, index):
+    """
+    Versions of a package worth prefetching: version itself, the latest
+    release and the latest release with the same major.minor as version.
+    Pre-releases are only candidates if version is one.
+
+    :param str version: current/pinned version, or None
+    :param index: magellan.version_utils.VersionIndex of the package
+    :rtype: list
+    """
+    if not index:
+        return []
+
+    candidates = [index.latest()]
+    if version is not None and version in index.versions:
+        candidates.append(version)
+        same_minor = index.latest_in_series(version)
+        if same_minor is not None:
+            candidates.append(same_minor)
+
+    out = []
+    for x in candidates:
+        if x not in out:
+            out.append(x)
+    return out
+
+
+def _record_source(package, version, requirements, source):
+    """Note which provider answered for package/version."""
+    with _provider_counts_lock:
+        DepTools.provider_counts[source] += 1
+    maglog.info("Requirements for {0} {1} from {2}"
+                .format(package, version, source))
+    if requirements:
+        requirements['source'] = source
+    return requirements
+
+
 def _table_print_requirements(requirements, pretty=False):
     """
     Table print requirements to stdout for human consumption.
@@ -809,14 +1360,17 @@ def _table_print_requirements(requirements, pretty=False):
 
     package = requirements.get('project_name')
     version = requirements.get('version')
+    source = requirements.get('source')
+    from_source = " (from {})".format(source) if source else ""
 
     reqs = requirements.get('requires', {})
 
     if not reqs:
-        s = "{} {} appears to have no dependencies.".format(package, version)
+        s = "{} {} appears to have no dependencies{}.".format(
+            package, version, from_source)
         print_col(s, pretty=pretty, header=True)
     else:
-        s = "Dependencies of {} {}:".format(package, version)
+        s = "Dependencies of {} {}{}:".format(package, version, from_source)
         print_col(s, pretty=pretty, header=True)
 
         table_data = [['PACKAGE', 'SPECS']]
@@ -857,6 +1411,27 @@ def _print_if(list_in, lead_in_text=None, tab_space=2, pretty=False):
             print_col("  "*tab_space + "".join(_item), pretty=pretty)
 
 
+def _spec_check_record(dets):
+    """DepTools.check_requirement_satisfied details as a dict."""
+    return {'current_version': dets[0], 'op': dets[1], 'required': dets[2],
+            'satisfied': dets[3]}
+
+
+def _requirement_check_record(item):
+    """Entry of may_be_okay/may_try_upgrade (a name, or a (name, details)
+    tuple) as a dict."""
+    if type(item) == tuple:
+        return dict(_spec_check_record(item[1]), package=item[0])
+    return {'package': item}
+
+
+def _env_conflict_record(conflict):
+    """Conflict from DepTools.highlight_conflicts_in_current_env as a dict."""
+    node, dependency, dets = conflict
+    return dict(_spec_check_record(dets), package=node[0], version=node[1],
+                dependency=dependency)
+
+
 def _string_requirement_details(dets):
     """
     Converts details from DepTools.check_requirement_satisfied into an
@@ -910,84 +1485,3 @@ for r in p.requires():
 
     nl = '\n'
     return head + nl + mid + nl + conv + nl + out + nl + end + nl
-
-
-class PyPIHelper(object):
-    """Collection of static methods to assist in interrogating PyPI"""
-
-    @staticmethod
-    def check_package_version_on_pypi(package, version):
-        """
-        Queries PyPI to see if the specific version of "package" exists.
-
-        :param str package: package name
-        :param str version: package version
-        :rtype bool:
-        :return: True if package-version on PyPI
-        """
-
-        package_json = PyPIHelper.acquire_package_json_info(package)
-
-        if not package_json:
-            return False
-        else:
-            # print("JSON acquired")
-            return version in package_json['releases'].keys()
-
-    @staticmethod
-    def acquire_package_json_info(package, localcache=None):
-        """
-        Perform lookup on packages and versions. Currently just uses PyPI.
-        Returns JSON
-
-        p is package name
-        localCacheDir is a location of local cache
-        """
-        package = str(package)
-        p_json = package + '.json'
-
-        if not localcache:
-            f = os.path.join(MagellanConfig.cache_dir, p_json)
-        else:
-            f = os.path.join(localcache, p_json)
-
-        if os.path.exists(f):
-            maglog.info("retrieving file {0} from local cache".format(f))
-            with open(f, 'r') as ff:
-                return json.load(ff)
-
-        pypi_template = 'https://pypi.python.org/pypi/{0}/json'
-
-        try:
-            r = requests.get(pypi_template.format(package))
-            if r.status_code == 200:  # if successfully retrieved:
-                maglog.info("{0} JSON successfully retrieved from PyPI"
-                            .format(package))
-
-                # Save to local cache...
-                with open(f, 'w') as outf:
-                    json.dump(r.json(), outf)
-                # ... and return to caller:
-                return r.json()
-
-            else:  # retrieval failed
-                maglog.info("failed to download {0}".format(package))
-                return {}
-        except requests.ConnectionError as e:
-            maglog.warn("Connection to PyPI failed: {}".format(e))
-            return {}
-
-    @staticmethod
-    def all_package_versions_on_pypi(package):
-        """Return a list of all released packages on PyPI.
-
-        :param str package: input package name
-        :rtype: list
-        :return: list of all package versions
-        """
-
-        all_package_info = PyPIHelper.acquire_package_json_info(package)
-        out = []
-        if 'releases' in all_package_info:
-            out = list(all_package_info['releases'].keys())
-        return out
@@ -0,0 +1,162 @@
+"""
+Module containing EnvDiff class.
+
+Differences between two environments' packages and requirement edges,
+e.g. staging against production.
+"""
+
+import logging
+
+from magellan.utils import jsonl_output, print_col, print_record
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class EnvDiff(object):
+    """Node and edge differences between two Environments.
+
+    Both sides are indexed by key (package key for nodes, (package key,
+    dependency key) for edges) and joined on it, so a diff is linear in the
+    size of the environments.
+    """
+
+    @staticmethod
+    def node_index(venv):
+        """{package key: (project_name, version)} of venv's nodes."""
+        return {x[0].lower(): (x[0], x[1]) for x in venv.nodes}
+
+    @staticmethod
+    def edge_index(venv):
+        """
+        {(package key, dependency key): specs} of venv's requirement edges;
+        edges from root are left out as they mirror the nodes.
+        """
+        index = {}
+        for edge in venv.edges:
+            parent, child = edge[0][0].lower(), edge[1][0].lower()
+            if parent == 'root':
+                continue
+            specs = edge[2] if len(edge) > 2 else []
+            index[(parent, child)] = sorted(tuple(x) for x in specs)
+        return index
+
+    @staticmethod
+    def diff(old, new):
+        """
+        Compare environments old and new.
+
+        :param Environment old: e.g. production
+        :param Environment new: e.g. staging
+        :rtype: dict
+        :return: {'added', 'removed': [(name, version)],
+                  'changed': [(name, old version, new version)],
+                  'edges_added', 'edges_removed': [(package, dependency,
+                                                    specs)],
+                  'edges_changed': [(package, dependency, old specs,
+                                     new specs)]}
+                 each sorted by package key.
+        """
+        old_nodes = EnvDiff.node_index(old)
+        new_nodes = EnvDiff.node_index(new)
+        old_edges = EnvDiff.edge_index(old)
+        new_edges = EnvDiff.edge_index(new)
+
+        out = {
+            'added': [new_nodes[k] for k in sorted(new_nodes)
+                      if k not in old_nodes],
+            'removed': [old_nodes[k] for k in sorted(old_nodes)
+                        if k not in new_nodes],
+            'changed': [(new_nodes[k][0], old_nodes[k][1], new_nodes[k][1])
+                        for k in sorted(old_nodes)
+                        if k in new_nodes
+                        and old_nodes[k][1] != new_nodes[k][1]],
+            'edges_added': [k + (new_edges[k],) for k in sorted(new_edges)
+                            if k not in old_edges],
+            'edges_removed': [k + (old_edges[k],) for k in sorted(old_edges)
+                              if k not in new_edges],
+            'edges_changed': [k + (old_edges[k], new_edges[k])
+                              for k in sorted(old_edges)
+                              if k in new_edges
+                              and old_edges[k] != new_edges[k]],
+        }
+        maglog.info("Environment diff: " + ", ".join(
+            "{0} {1}".format(len(out[x]), x) for x in sorted(out)))
+        return out
+
+    @staticmethod
+    def print_diff(diff, old_name, new_name, pretty=False):
+        """
+        Print the result of EnvDiff.diff; with --format jsonl, one
+        "env_diff" record per difference.
+        """
+        if jsonl_output():
+            EnvDiff._record_diff(diff, old_name, new_name)
+            return
+
+        sections = [
+            ('removed', 'Only in {0}:'.format(old_name), _fmt_node),
+            ('added', 'Only in {0}:'.format(new_name), _fmt_node),
+            ('changed', 'Versions differ ({0} -> {1}):'.format(
+                old_name, new_name), _fmt_change),
+            ('edges_removed', 'Requirements only in {0}:'.format(old_name),
+             _fmt_edge),
+            ('edges_added', 'Requirements only in {0}:'.format(new_name),
+             _fmt_edge),
+            ('edges_changed', 'Requirement specs differ ({0} -> {1}):'
+             .format(old_name, new_name), _fmt_edge_change),
+        ]
+        for key, header, fmt in sections:
+            print_col(header, pretty=pretty, header=True)
+            for item in diff[key]:
+                print_col("  " + fmt(item), pretty=pretty)
+            if not diff[key]:
+                print_col("  None", pretty=pretty)
+
+    @staticmethod
+    def _record_diff(diff, old_name, new_name):
+        envs = {'old': old_name, 'new': new_name}
+        for name, version in diff['removed']:
+            print_record('env_diff', dict(envs, change='removed',
+                                          package=name, old_version=version))
+        for name, version in diff['added']:
+            print_record('env_diff', dict(envs, change='added',
+                                          package=name, new_version=version))
+        for name, old_version, new_version in diff['changed']:
+            print_record('env_diff', dict(
+                envs, change='changed', package=name,
+                old_version=old_version, new_version=new_version))
+        for change, side in (('edge_removed', 'old_specs'),
+                             ('edge_added', 'new_specs')):
+            for package, dependency, specs in diff[change.replace(
+                    'edge_', 'edges_')]:
+                print_record('env_diff', dict(
+                    envs, change=change, package=package,
+                    dependency=dependency, **{side: specs}))
+        for package, dependency, old_specs, new_specs in \
+                diff['edges_changed']:
+            print_record('env_diff', dict(
+                envs, change='edge_changed', package=package,
+                dependency=dependency, old_specs=old_specs,
+                new_specs=new_specs))
+
+
+def _fmt_specs(specs):
+    return ",".join("".join(x) for x in specs) or "any"
+
+
+def _fmt_node(item):
+    return "{0} {1}".format(*item)
+
+
+def _fmt_change(item):
+    return "{0} {1} -> {2}".format(*item)
+
+
+def _fmt_edge(item):
+    return "{0} -> {1} {2}".format(item[0], item[1], _fmt_specs(item[2]))
+
+
+def _fmt_edge_change(item):
+    return "{0} -> {1}: {2} -> {3}".format(
+        item[0], item[1], _fmt_specs(item[2]), _fmt_specs(item[3]))
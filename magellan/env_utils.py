@@ -13,6 +13,7 @@ from magellan.utils import (run_in_subprocess,
                             run_in_subp_ret_stdout,
                             MagellanConfig,)
 from magellan.package_utils import Package
+from magellan.version_utils import VersionIntervals
 
 # Logging:
 maglog = logging.getLogger("magellan_logger")
@@ -31,6 +32,7 @@ class Environment(object):
         self.package_requirements = {}
         self.all_packages = {}
         self.extant_env_files = []
+        self._allowed_versions = None
 
         maglog.info("logging setup in Environment")
 
@@ -45,14 +47,93 @@ class Environment(object):
         if not kwargs['keep_env_files']:
             self.remove_extant_env_files_from_disk()
 
-        self.all_packages = {p[0].lower(): Package(p[0], p[1]) 
+        self.load_graph(self.nodes, self.edges, self.package_requirements)
+        self.show_all_packages_if_requested(kwargs)
+
+    def load_graph(self, nodes, edges, package_requirements):
+        """
+        Set nodes, edges and package_requirements (as recorded by
+        env_interrogation.py) and all_packages from them.
+        """
+        self.nodes = nodes
+        self.edges = edges
+        self.package_requirements = package_requirements
+        self.all_packages = {p[0].lower(): Package(p[0], p[1])
                              for p in self.nodes}
+        self._allowed_versions = None
+
+    def allowed_versions(self):
+        """
+        {package key: VersionIntervals} of the versions of each package that
+        all its dependents in the environment accept, i.e. the intersection
+        of the specs on its incoming requirement edges. Compiled on first
+        use and kept until the graph is reloaded.
 
+        Packages nothing depends on are absent (any version is allowed).
+
+        :rtype: dict
+        """
+        if self._allowed_versions is None:
+            allowed = {}
+            for parent_key, p in self.package_requirements.items():
+                for dep_key, r in (p.get('requires') or {}).items():
+                    intervals = VersionIntervals.from_specs(r['specs'])
+                    if dep_key in allowed:
+                        intervals = allowed[dep_key].intersect(intervals)
+                    allowed[dep_key] = intervals
+            maglog.debug("Compiled allowed versions of {0} packages"
+                         .format(len(allowed)))
+            self._allowed_versions = allowed
+        return self._allowed_versions
+
+    def show_all_packages_if_requested(self, kwargs):
+        """-s / -p: print the packages and exit."""
         if (kwargs['show_all_packages'] or
                 kwargs['show_all_packages_and_versions']):
             self.show_all_packages_and_exit(
                 kwargs['show_all_packages_and_versions'])
 
+    @staticmethod
+    def snapshot(venv_name=None, path_to_env_bin=None, keep_env_files=False):
+        """
+        Environment with nodes, edges, package_requirements and
+        all_packages read from venv_name (None: current environment); the
+        environment is interrogated once, here.
+
+        :rtype: Environment
+        """
+        venv = Environment(venv_name)
+        venv.magellan_setup_go_env({
+            'path_to_env_bin': path_to_env_bin,
+            'keep_env_files': keep_env_files,
+            'show_all_packages': False,
+            'show_all_packages_and_versions': False,
+        })
+        return venv
+
+    @staticmethod
+    def from_env_files(directory):
+        """
+        Environment from the nodes.json, edges.json and
+        package_requirements.json an earlier run left in directory
+        (see --keep-env-files); nothing is interrogated.
+
+        :rtype: Environment
+        """
+        loaded = []
+        for fn in ('nodes.json', 'edges.json', 'package_requirements.json'):
+            with open(os.path.join(directory, fn), 'r') as f:
+                loaded.append(json.load(f))
+        venv = Environment(directory)
+        venv.load_graph(*loaded)
+        return venv
+
+    @staticmethod
+    def has_env_files(directory):
+        """True if directory holds the files from_env_files reads."""
+        return all(os.path.isfile(os.path.join(directory, x)) for x in
+                   ('nodes.json', 'edges.json', 'package_requirements.json'))
+
     def create_vex_new_virtual_env(self, vex_options=None):
         """Create a virtual env in which to install packages
         :returns : venv_name - name of virtual environment.
@@ -0,0 +1,116 @@
+"""
+Module containing FetchEngine class.
+
+One keep-alive HTTP session and a bounded thread pool shared by everything
+Magellan fetches, with concurrent requests for the same thing merged into a
+single fetch.
+"""
+
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from magellan.utils import MagellanConfig
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class _Flight(object):
+    """One in-progress call that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FetchEngine(object):
+    """Shared requests.Session plus a bounded pool for concurrent fetches.
+
+    NB: the pool is only for fanning out from the calling thread; do not
+    submit work to it from inside work already running on it.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, workers=None, timeout=None):
+        if workers is None:
+            workers = MagellanConfig.workers
+        self.workers = max(1, workers)
+        self.timeout = timeout or MagellanConfig.http_timeout
+
+        self.session = requests.Session()
+        # Keep enough pooled connections for every worker (and some threads
+        # outside the pool, e.g. the dependency scheduler) to reuse one.
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=max(10, self.workers * 2))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @staticmethod
+    def default():
+        """Process wide FetchEngine."""
+        with FetchEngine._default_lock:
+            if FetchEngine._default is None:
+                FetchEngine._default = FetchEngine()
+            return FetchEngine._default
+
+    def single_flight(self, key, fn):
+        """
+        Call fn(), unless a call for key is already in progress in
+        another thread, in which case wait for and share its result.
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            maglog.debug("Waiting on in-flight fetch {0}".format(key))
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def get(self, url, **kwargs):
+        """GET url on the shared session; concurrent GETs of the same url
+        and headers (without stream=True) are merged."""
+        kwargs.setdefault('timeout', self.timeout)
+        if kwargs.get('stream'):
+            return self.session.get(url, **kwargs)
+        headers = kwargs.get('headers') or {}
+        key = ('GET', url, tuple(sorted(headers.items())))
+        return self.single_flight(key,
+                                  lambda: self.session.get(url, **kwargs))
+
+    def imap(self, fn, items):
+        """fn over items on the bounded pool, results in input order."""
+        items = list(items)
+        if len(items) <= 1:
+            return [fn(x) for x in items]
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+        return self._pool.imap(fn, items)
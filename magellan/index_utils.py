@@ -0,0 +1,165 @@
+"""
+Module containing LocalIndex class.
+
+Serves package versions and requirements from local directories of wheels
+and sdists (a wheelhouse, pip's cache) so Magellan can run with no network
+access and no temporary installs.
+"""
+
+import logging
+import os
+import re
+import threading
+
+from pkg_resources import parse_version
+
+from magellan.cache_utils import DepCache
+from magellan.metadata_utils import (SdistMetadata, read_wheel_metadata,
+                                     requirements_from_strings)
+from magellan.utils import MagellanConfig
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+SDIST_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.zip')
+
+
+def canonical_name(name):
+    """PEP 503 normalised project name."""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+class LocalIndex(object):
+    """Index of the wheels and sdists found under one or more directories.
+
+    Each file's name, version and requirements are read once and kept in
+    the DepCache; later runs only re-read files whose mtime or size changed.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, roots, store=None):
+        self.roots = [os.path.abspath(x) for x in roots]
+        self.store = store or DepCache.default()
+        self.projects = {}
+        for root in self.roots:
+            self._index_root(root)
+
+    @staticmethod
+    def default():
+        """LocalIndex of MagellanConfig.local_index, or None if unset."""
+        if not MagellanConfig.local_index:
+            return None
+        with LocalIndex._default_lock:
+            idx = LocalIndex._default
+            if idx is None or idx.roots != [
+                    os.path.abspath(x) for x in MagellanConfig.local_index]:
+                idx = LocalIndex(MagellanConfig.local_index)
+                LocalIndex._default = idx
+            return idx
+
+    def _index_root(self, root):
+        known = self.store.get_local_files(root)
+        seen = set()
+        updated = []
+        for dir_path, _, file_names in os.walk(root):
+            for fn in file_names:
+                if not (fn.endswith('.whl') or fn.endswith(SDIST_EXTENSIONS)):
+                    continue
+                path = os.path.join(dir_path, fn)
+                seen.add(path)
+                st = os.stat(path)
+                row = known.get(path)
+                if row is None or row['mtime'] != st.st_mtime \
+                        or row['size'] != st.st_size:
+                    row = _index_file(path)
+                    row.update({'path': path, 'mtime': st.st_mtime,
+                                'size': st.st_size})
+                    updated.append(row)
+                self._add(row)
+
+        removed = [x for x in known if x not in seen]
+        if updated or removed:
+            maglog.info("Local index {0}: {1} files (re)indexed, {2} removed"
+                        .format(root, len(updated), len(removed)))
+            self.store.put_local_files(root, updated, removed)
+
+    def _add(self, row):
+        if not row['name'] or not row['version']:
+            return
+        project = self.projects.setdefault(canonical_name(row['name']), {
+            'name': row['name'], 'releases': {}, 'requires': {}})
+        project['releases'].setdefault(row['version'], []).append({
+            'filename': os.path.basename(row['path']),
+            'packagetype': row['packagetype'],
+            'url': 'file://' + row['path'],
+            'yanked': False,
+        })
+        # Wheel metadata is authoritative, so prefer it over an sdist's.
+        if row['requires'] is not None and (
+                row['packagetype'] == 'bdist_wheel'
+                or project['requires'].get(row['version']) is None):
+            project['requires'][row['version']] = row['requires']
+
+    def _project(self, package):
+        return self.projects.get(canonical_name(package))
+
+    def versions(self, package):
+        """List of versions of package in the index, or None if absent."""
+        project = self._project(package)
+        if project is None:
+            return None
+        return list(project['releases'])
+
+    def package_json(self, package, version=None):
+        """
+        PyPI JSON shaped document for package ({} if absent); "info"
+        describes version, or the latest version if None.
+        """
+        project = self._project(package)
+        if project is None:
+            return {}
+        if version is None:
+            version = max(project['releases'], key=parse_version)
+        elif version not in project['releases']:
+            return {}
+        return {
+            'info': {'name': project['name'], 'version': version,
+                     'requires_dist': project['requires'].get(version)},
+            'releases': project['releases'],
+        }
+
+    def get_requirements(self, package, version):
+        """Requirements dict for package/version, or None if unknown."""
+        project = self._project(package)
+        if project is None or project['requires'].get(version) is None:
+            return None
+        return requirements_from_strings(
+            project['name'], version, project['requires'][version])
+
+
+def _index_file(path):
+    """Name, version, type and requirement strings of a wheel or sdist."""
+    fn = os.path.basename(path)
+    if fn.endswith('.whl'):
+        row = {'packagetype': 'bdist_wheel', 'requires': None}
+        # {name}-{version}(-{build})?-{python}-{abi}-{platform}.whl
+        parts = fn[:-len('.whl')].split('-')
+        row['name'] = parts[0]
+        row['version'] = parts[1] if len(parts) > 1 else None
+        metadata = read_wheel_metadata(path)
+        if metadata is not None:
+            row['name'] = metadata[0] or row['name']
+            row['version'] = metadata[1] or row['version']
+            row['requires'] = metadata[2]
+        return row
+
+    row = {'packagetype': 'sdist', 'requires': None}
+    stem = [fn[:-len(x)] for x in SDIST_EXTENSIONS if fn.endswith(x)][0]
+    row['name'], _, row['version'] = stem.rpartition('-')
+    found = SdistMetadata.read_archive_requirements(path)
+    if found is not None:
+        row['name'] = found[0] or row['name']
+        row['requires'] = found[1]
+    return row
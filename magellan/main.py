@@ -8,13 +8,14 @@ import os
 import sys
 from pprint import pprint
 
-from natsort import natsorted
-
-from magellan.utils import MagellanConfig
+from magellan.utils import MagellanConfig, print_col, text_stream
+from magellan.cache_utils import DepCache
 from magellan.env_utils import Environment
 from magellan.package_utils import Package, Requirements
 from magellan.deps_utils import DepTools, PyPIHelper
-from magellan.cmd import cmds
+from magellan.diff_utils import EnvDiff
+from magellan.resolve_utils import Resolver, environment_from_freeze
+from magellan.cmd import cmds, cache_cmds
 
 maglog = logging.getLogger('magellan_logger')
 
@@ -31,6 +32,23 @@ def _go(venv_name, **kwargs):
 
     print_col = kwargs.get('colour')  # print in colour
 
+    if kwargs.get('cache_dir'):
+        MagellanConfig.cache_dir = kwargs['cache_dir']
+    if kwargs.get('cache_max_mb') is not None:
+        MagellanConfig.cache_max_bytes = kwargs['cache_max_mb'] * 1024 * 1024
+    if kwargs.get('workers'):
+        MagellanConfig.workers = max(1, kwargs['workers'])
+    if kwargs.get('local_index'):
+        MagellanConfig.local_index = kwargs['local_index']
+    if kwargs.get('index_url'):
+        MagellanConfig.index_url = kwargs['index_url']
+    if kwargs.get('cache_ttl') is not None:
+        MagellanConfig.cache_ttl = kwargs['cache_ttl']
+    if kwargs.get('negative_cache_ttl') is not None:
+        MagellanConfig.negative_cache_ttl = kwargs['negative_cache_ttl']
+    if kwargs.get('format'):
+        MagellanConfig.output_format = kwargs['format']
+
     # Environment Setup
     if not os.path.exists(MagellanConfig.cache_dir) and MagellanConfig.caching:
         MagellanConfig.setup_cache()
@@ -38,26 +56,62 @@ def _go(venv_name, **kwargs):
     if kwargs['list_all_versions']:
         for p in kwargs['list_all_versions']:
             print(p[0])
-            all_package_versions = PyPIHelper.all_package_versions_on_pypi(
-                p[0])
-            pprint(natsorted(all_package_versions))
+            pprint(PyPIHelper.version_index(p[0]).versions)
         sys.exit()
 
-    venv = Environment(venv_name)
-    venv.magellan_setup_go_env(kwargs)
+    requirements_files = Requirements.expand_req_files(
+        kwargs.get('requirements_file'))
+
+    if kwargs['compare_env_to_req_file'] and kwargs.get('compare_env'):
+        # -R matrix: every requirements file against every environment.
+        env_names = [venv_name] if venv_name else []
+        env_names += [x for x in kwargs['compare_env'] if x not in env_names]
+        envs = [(name, _load_env(name, kwargs)) for name in env_names]
+        Requirements.print_req_env_matrix(
+            Requirements.compare_req_files_to_envs(requirements_files, envs),
+            print_col)
+        sys.exit()
 
-    requirements_file = kwargs.get('requirements_file')
+    if kwargs.get('diff_env'):
+        old_name, new_name = kwargs['diff_env']
+        EnvDiff.print_diff(
+            EnvDiff.diff(_load_env(old_name, kwargs),
+                         _load_env(new_name, kwargs)),
+            old_name, new_name, print_col)
+        sys.exit()
+
+    if kwargs.get('from_requirements'):
+        venv = _resolved_env(kwargs['from_requirements'], kwargs)
+    elif kwargs.get('from_freeze'):
+        venv = environment_from_freeze(kwargs['from_freeze'])
+        venv.show_all_packages_if_requested(kwargs)
+    else:
+        venv = Environment(venv_name)
+        venv.magellan_setup_go_env(kwargs)
 
     package_list = Package.resolve_package_list(venv, kwargs)
     packages = {p.lower(): venv.all_packages[p.lower()] for p in package_list}
 
+    if kwargs['prefetch']:
+        if requirements_files:
+            to_fetch = []
+            for req_file in requirements_files:
+                to_fetch.extend(
+                    Requirements.package_versions_from_req_file(req_file))
+        else:
+            to_fetch = [(p.name, p.version) for p in
+                        (packages or venv.all_packages).values()]
+        DepTools.prefetch(to_fetch, print_col)
+        sys.exit()
+
     if kwargs['outdated']:
         if package_list:
             Package.check_outdated_packages(packages, print_col)
-        elif requirements_file:
-            print("Analysing requirements file for outdated packages.")
-            Requirements.check_outdated_requirements_file(
-                requirements_file, pretty=print_col)
+        elif requirements_files:
+            print("Analysing requirements file for outdated packages.",
+                  file=text_stream())
+            Requirements.check_outdated_requirements_files(
+                requirements_files, pretty=print_col)
         else:  # if nothing passed in then check local env.
             Package.check_outdated_packages(venv.all_packages, print_col)
 
@@ -72,6 +126,10 @@ def _go(venv_name, **kwargs):
             DepTools.get_ancestors_of_packages(
                 kwargs['get_ancestors'], venv, print_col)
 
+    if kwargs.get('allowed_versions'):
+        DepTools.show_allowed_versions(
+            kwargs['allowed_versions'], venv, print_col)
+
     if kwargs['get_descendants']:  # -Z
         descendants_dictionary = \
             DepTools.get_descendants_of_packages(
@@ -87,20 +145,109 @@ def _go(venv_name, **kwargs):
             venv.nodes, venv.package_requirements, print_col)
 
     if kwargs['compare_env_to_req_file']:  # -R
-        if not requirements_file:
+        if not requirements_files:
             print("Please specify a requirements file with -r <file>")
         else:
-            same, verdiff, req_only, env_only = \
-                Requirements.compare_req_file_to_env(requirements_file, venv)
-            Requirements.print_req_env_comp_lists(
-                same, verdiff, req_only, env_only, print_col)
+            Requirements.compare_req_files_to_env(
+                requirements_files, venv, print_col)
 
 
 
 
+def _load_env(name, kwargs):
+    """
+    Environment named by name: a directory of env files kept by an earlier
+    run (--keep-env-files), a pip freeze file, or a virtual env (-n's
+    --path-to-env-bin applies if it is the -n env).
+    """
+    if os.path.isdir(name) and Environment.has_env_files(name):
+        return Environment.from_env_files(name)
+    if os.path.isfile(name):
+        return environment_from_freeze(name)
+    return Environment.snapshot(
+        name,
+        kwargs['path_to_env_bin'] if name == kwargs['venv_name'] else None,
+        kwargs['keep_env_files'])
+
+
+def _resolved_env(req_file, kwargs):
+    """Synthetic Environment for --from-requirements (and --lock-file)."""
+    parsed = Requirements.parse_req_file(req_file, constraints=True)
+    if not parsed:
+        sys.exit("No requirements found in {0}".format(req_file))
+
+    resolver = Resolver().resolve(parsed)
+    for key, version, req, required_by in resolver.conflicts:
+        maglog.warn("{0} {1} does not satisfy {2} required by {3}"
+                    .format(key, version, req, required_by))
+    if kwargs.get('lock_file'):
+        resolver.write_lock_file(kwargs['lock_file'], req_file)
+
+    venv = resolver.environment(req_file)
+    venv.show_all_packages_if_requested(kwargs)
+    return venv
+
+
+def _cache(action, cache_dir, cache_max_mb, colour):
+    """magellan cache stats|prune|clear"""
+    store = DepCache.default(cache_dir)
+
+    if action == 'clear':
+        store.clear(files=True)
+        print_col("Cleared {0}".format(cache_dir), pretty=colour)
+        return
+
+    if action == 'prune':
+        pruned = store.prune(cache_max_mb * 1024 * 1024)
+        print_col("Pruned {0} entries and {1} files ({2} bytes) from {3}"
+                  .format(pruned['entries'], pruned['files'],
+                          pruned['bytes'], cache_dir), pretty=colour)
+        return
+
+    stats = store.stats()
+    print_col("Cache {0}:".format(cache_dir), pretty=colour, header=True)
+    for table in ('packages', 'releases', 'requirements', 'fetch_meta',
+                  'local_files'):
+        print_col("  {0}: {1} entries, {2} bytes".format(
+            table, stats[table]['entries'], stats[table]['bytes']),
+            pretty=colour)
+    print_col("  store file: {0} bytes; other files: {1} bytes; budget: "
+              "{2} bytes".format(stats['file_bytes'], stats['other_bytes'],
+                                 cache_max_mb * 1024 * 1024), pretty=colour)
+
+    counters = stats['counters']
+    ratio = PyPIHelper.hit_ratio(counters)
+    print_col("  PyPI lookups: {0}".format(", ".join(
+        "{0}: {1}".format(k, v) for k, v in sorted(counters.items()))
+        or "none"), pretty=colour)
+    if ratio is not None:
+        print_col("  hit ratio: {0:.0%}".format(ratio), pretty=colour)
+
+
 def main():
+    if sys.argv[1:2] == ['cache']:
+        _cache(**cache_cmds(sys.argv[2:]))
+        return
+
     kwargs = cmds()
-    _go(**kwargs)
+    succeeded = False
+    try:
+        _go(**kwargs)
+        succeeded = True
+    except SystemExit as e:
+        succeeded = e.code in (None, 0)
+        raise
+    finally:
+        maglog.info("PyPI lookups: {0}".format(
+            PyPIHelper.metrics_summary() or "none"))
+        if MagellanConfig.caching and os.path.exists(
+                MagellanConfig.cache_dir):
+            store = DepCache.default()
+            store.add_counters(PyPIHelper.metrics)
+            if succeeded:
+                # Rows only: files under cache_dir may be in use by another
+                # run; "magellan cache prune" evicts those.
+                store.prune(MagellanConfig.cache_max_bytes, files=False)
 
 
 if __name__ == "__main__":
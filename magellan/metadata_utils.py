@@ -0,0 +1,287 @@
+"""
+Module containing SdistMetadata class.
+
+Collection of methods for reading package requirements out of source
+distributions without installing them.
+"""
+
+import email.parser
+import fnmatch
+import logging
+import tarfile
+import zipfile
+
+import pkg_resources
+
+try:
+    from ConfigParser import RawConfigParser, Error as ConfigParserError
+except ImportError:  # Python 3
+    from configparser import RawConfigParser, Error as ConfigParserError
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+def requirements_from_strings(project_name, version, req_strings):
+    """
+    Convert requirement strings (e.g. Requires-Dist values) into the
+    requirements dict produced by package_interrogation.py:
+
+    {'project_name': .., 'version': .., 'requires': {key: {
+        'project_name': .., 'key': .., 'specs': [(op, ver), ..]}}}
+
+    Requirements only pulled in by an extra are dropped and any other
+    environment markers are evaluated against the running interpreter, as
+    pkg_resources does for installed distributions.
+
+    :param str project_name: name of package
+    :param str version: version of package
+    :param list req_strings: PEP 508 requirement strings
+    :rtype: dict
+    """
+    req_dic = {'project_name': project_name, 'version': version,
+               'requires': {}}
+
+    for req_string in req_strings:
+        req_string, _, marker = req_string.partition(';')
+        marker = marker.strip()
+        if marker:
+            if 'extra' in marker:
+                continue
+            try:
+                if not pkg_resources.evaluate_marker(marker):
+                    continue
+            except Exception as e:
+                maglog.debug("Unable to evaluate marker {0}: {1}"
+                             .format(marker, e))
+
+        req_string = req_string.strip()
+        if not req_string:
+            continue
+        try:
+            r = pkg_resources.Requirement.parse(req_string)
+        except ValueError as e:
+            maglog.debug("Unable to parse requirement {0}: {1}"
+                         .format(req_string, e))
+            continue
+
+        req_dic['requires'][r.key] = {'project_name': r.project_name,
+                                      'key': r.key,
+                                      'specs': r.specs}
+    return req_dic
+
+
+def requirements_from_requires_txt(text):
+    """
+    Requirement strings from an egg-info requires.txt; the unnamed section
+    and ":<marker>" sections apply, "<extra>" sections do not.
+    """
+    req_strings = []
+    for section, lines in pkg_resources.split_sections(text):
+        if section is None:
+            marker = ''
+        elif section.startswith(':'):
+            marker = section[1:]
+        else:
+            continue
+        for line in lines:
+            req_strings.append(line + ('; ' + marker if marker else ''))
+    return req_strings
+
+
+class _Archive(object):
+    """Minimal read-only view over a tar or zip sdist."""
+
+    def __init__(self, path):
+        self.path = path
+        if zipfile.is_zipfile(path):
+            self._zip = zipfile.ZipFile(path)
+            self._tar = None
+            self.names = self._zip.namelist()
+        else:
+            self._zip = None
+            self._tar = tarfile.open(path)
+            self.names = self._tar.getnames()
+
+        roots = set(x.split('/')[0] for x in self.names if x)
+        self.root = roots.pop() if len(roots) == 1 else ''
+
+    def member(self, *parts):
+        return '/'.join(x for x in (self.root,) + parts if x)
+
+    def read(self, name):
+        """Contents of member name as text, or None if absent."""
+        if name not in self.names:
+            return None
+        if self._zip is not None:
+            data = self._zip.read(name)
+        else:
+            f = self._tar.extractfile(name)
+            if f is None:
+                return None
+            data = f.read()
+        return data.decode('utf-8', 'replace')
+
+    def glob(self, pattern):
+        """Members matching pattern, with "*" not crossing directories."""
+        depth = pattern.count('/')
+        return [x for x in self.names if x.count('/') == depth
+                and fnmatch.fnmatch(x, pattern)]
+
+    def close(self):
+        (self._zip or self._tar).close()
+
+
+def read_wheel_metadata(wheel_path):
+    """
+    Name, version and Requires-Dist from a wheel's .dist-info/METADATA.
+
+    :rtype: (str, str, list)
+    :return: (name, version, requirement strings) or None if unreadable.
+    """
+    try:
+        with zipfile.ZipFile(wheel_path) as whl:
+            metadata = [x for x in whl.namelist() if x.count('/') == 1
+                        and x.endswith('.dist-info/METADATA')]
+            if not metadata:
+                return None
+            text = whl.read(metadata[0]).decode('utf-8', 'replace')
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        maglog.info("Unable to read wheel {0}: {1}".format(wheel_path, e))
+        return None
+
+    meta = email.parser.Parser().parsestr(text)
+    return (meta.get('Name'), meta.get('Version'),
+            meta.get_all('Requires-Dist') or [])
+
+
+class SdistMetadata(object):
+    """Read requirements from an sdist without installing it."""
+
+    @staticmethod
+    def read_archive_requirements(archive_path):
+        """
+        Static requirements of the sdist at archive_path only; never runs
+        any of its code.
+
+        :rtype: (str, list)
+        :return: (project_name, requirement strings) or None
+        """
+        try:
+            archive = _Archive(archive_path)
+        except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile) as e:
+            maglog.info("Unable to open sdist {0}: {1}"
+                        .format(archive_path, e))
+            return None
+        try:
+            return SdistMetadata.read_static_requirements(archive)
+        finally:
+            archive.close()
+
+    @staticmethod
+    def get_requirements(archive_path, package, version):
+        """
+        Requirements dict for the sdist at archive_path, from the static
+        metadata in the archive. None of its code is run: sdists whose
+        requirements are only known to setup.py are left to the install
+        in a temporary env.
+
+        :rtype: dict
+        :return: requirements dict, or None if they could not be determined.
+        """
+        found = SdistMetadata.read_archive_requirements(archive_path)
+        if found is None:
+            return None
+
+        project_name, req_strings = found
+        return requirements_from_strings(
+            project_name or package, version, req_strings)
+
+    @staticmethod
+    def read_static_requirements(archive):
+        """
+        Requirement strings declared statically in the archive, from (in
+        order) PKG-INFO, *.egg-info/requires.txt, setup.cfg or
+        pyproject.toml.
+
+        :rtype: (str, list)
+        :return: (project_name, requirement strings) or None
+        """
+        project_name = None
+        pkg_info = archive.read(archive.member('PKG-INFO'))
+        if pkg_info is not None:
+            meta = email.parser.Parser().parsestr(pkg_info)
+            project_name = meta.get('Name')
+            requires_dist = meta.get_all('Requires-Dist') or []
+            dynamic = [x.lower() for x in meta.get_all('Dynamic') or []]
+
+            # Metadata 2.2+ is only allowed to omit Requires-Dist if the
+            # field is static, i.e. there are genuinely no requirements.
+            metadata_version = meta.get('Metadata-Version', '1.0')
+            is_static = (pkg_resources.parse_version(metadata_version)
+                         >= pkg_resources.parse_version('2.2')
+                         and 'requires-dist' not in dynamic)
+            if requires_dist or is_static:
+                maglog.info("Requirements read from PKG-INFO in {0}"
+                            .format(archive.path))
+                return project_name, requires_dist
+
+        for pattern in ('*.egg-info/PKG-INFO', 'src/*.egg-info/PKG-INFO'):
+            egg_info = archive.glob(archive.member(pattern))
+            if egg_info:
+                requires_txt = archive.read(
+                    egg_info[0].rsplit('/', 1)[0] + '/requires.txt')
+                maglog.info("Requirements read from egg-info in {0}"
+                            .format(archive.path))
+                return project_name, requirements_from_requires_txt(
+                    requires_txt or '')
+
+        setup_cfg = archive.read(archive.member('setup.cfg'))
+        setup_py = archive.read(archive.member('setup.py')) or ''
+        if setup_cfg is not None and 'install_requires' not in setup_py:
+            parser = RawConfigParser()
+            try:
+                if hasattr(parser, 'read_string'):
+                    parser.read_string(setup_cfg)
+                else:
+                    from StringIO import StringIO
+                    parser.readfp(StringIO(setup_cfg))
+                install_requires = parser.get('options', 'install_requires')
+            except ConfigParserError:
+                install_requires = None
+
+            if install_requires is not None and \
+                    not install_requires.strip().startswith(('file:',
+                                                             'attr:')):
+                maglog.info("Requirements read from setup.cfg in {0}"
+                            .format(archive.path))
+                return project_name, [x.strip() for x in
+                                      install_requires.splitlines()
+                                      if x.strip()]
+
+        pyproject = archive.read(archive.member('pyproject.toml'))
+        if pyproject is not None:
+            project = _load_toml(pyproject).get('project', {})
+            if project and 'dependencies' not in project.get('dynamic', []):
+                maglog.info("Requirements read from pyproject.toml in {0}"
+                            .format(archive.path))
+                return (project_name or project.get('name'),
+                        project.get('dependencies', []))
+
+        return None
+
+
+def _load_toml(text):
+    """Parse TOML if a parser is available (tomllib, tomli or toml)."""
+    for mod_name in ('tomllib', 'tomli', 'toml'):
+        try:
+            mod = __import__(mod_name)
+        except ImportError:
+            continue
+        try:
+            return mod.loads(text)
+        except Exception as e:
+            maglog.debug("Unable to parse pyproject.toml: {0}".format(e))
+            return {}
+    maglog.debug("No TOML parser available to read pyproject.toml")
+    return {}
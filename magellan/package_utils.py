@@ -6,13 +6,19 @@ This is a collection of methods concerning packages and their analysis.
 
 from __future__ import print_function
 
+import glob
 import logging
 import re
+from collections import OrderedDict
 
-from natsort import natsorted
-import yarg
+from pkg_resources import parse_version
+from terminaltables import SingleTable as OutputTableType
 
-from magellan.utils import print_col
+from magellan.fetch_utils import FetchEngine
+from magellan.pypi_utils import PyPIHelper
+from magellan.requirements_utils import (RequirementsFileError,
+                                         parse_requirements_file)
+from magellan.utils import jsonl_output, print_col, print_record
 
 # Logging:
 maglog = logging.getLogger("magellan_logger")
@@ -31,6 +37,14 @@ class InvalidNodes(PackageException):
     pass
 
 
+# Requirements version for packages not "==" pinned in a requirements file:
+REQ_NO_VERSION = '-1'
+
+# Package.check_latest_major_minor_versions status codes:
+_VERSION_STATUS = {-1: 'error', 0: 'up_to_date', 1: 'outdated',
+                   999: 'beyond_latest'}
+
+
 class Package(object):
     """ Package type to hold analysis of packages."""
 
@@ -198,42 +212,63 @@ class Package(object):
     @staticmethod
     def get_package_versions_from_pypi(package):
         """
-        Query PyPI for latest versions of package, return in order.
+        Query PyPI (or the local index or --index-url) for latest versions of
+        package, return in PEP 440 order. Goes through PyPIHelper, so shares
+        its cache and session.
 
         return list: version info
         """
-
-        try:
-            yp = yarg.get(package)
-            rels = yp.release_ids
-        except Exception as e:
-            maglog.debug("Unable to obtain {0} from PyPI; {1}."
-                         .format(package, e))
-            # log e
+        index = Package.get_version_index(package)
+        if index is None:
             return None
+        return index.versions
 
-        rels = natsorted(rels)
-        if not rels:
+    @staticmethod
+    def get_version_index(package):
+        """
+        Shared VersionIndex of package's releases (see
+        PyPIHelper.version_index), or None if none are available.
+
+        :rtype: magellan.version_utils.VersionIndex
+        """
+        index = PyPIHelper.version_index(package)
+        if not index:
             maglog.info('No version info available for "{}" '
                         'at CheeseShop (PyPI)'.format(package))
             return None
-
-        return rels
+        return index
 
     @staticmethod
-    def check_outdated_packages(package_list, pretty=False):
+    def check_outdated_packages(package_list, pretty=False, source=None):
         """
         Convenience function to print major/minor versions based on filtered
         input.
 
+        PyPI is queried for up to MagellanConfig.workers packages at once;
+        each report is printed, in order, as soon as it is ready.
+
         :param package_list: dict of magellan.package_utils.Package objects
+        :param str source: where the packages came from (e.g. requirements
+        file), added to JSON Lines records.
         """
 
-        for p_k, p in package_list.items():
-            version_info = p.check_versions()
+        packages = list(package_list.values())
+        all_version_info = FetchEngine.default().imap(
+            Package._check_versions, packages)
+
+        for p, version_info in zip(packages, all_version_info):
             maglog.debug(version_info)
-            Package.detail_version_info(
-                version_info, p.name, p.version, pretty)
+            if jsonl_output():
+                print_record('outdated', Package.version_info_record(
+                    version_info, p.name, p.version, source))
+            else:
+                Package.detail_version_info(
+                    version_info, p.name, p.version, pretty)
+
+    @staticmethod
+    def _check_versions(package):
+        """Package.check_versions, for mapping over a pool."""
+        return package.check_versions()
 
     @staticmethod
     def detail_version_info(version_info, package, version, pretty=False):
@@ -268,6 +303,28 @@ class Package(object):
                     version_info.get("minor_version").get("latest"),
                     version), pretty=pretty)
 
+    @staticmethod
+    def version_info_record(version_info, package, version, source=None):
+        """
+        Flat, JSON serialisable form of the result of
+        Package.check_latest_major_minor_versions, for JSON Lines output.
+
+        :rtype: dict
+        """
+        record = {
+            'package': package,
+            'version': version,
+            'status': _VERSION_STATUS.get(version_info.get("code"), 'error'),
+            'code': version_info.get("code"),
+            'latest': version_info["major_version"]["latest"],
+            'major_outdated': version_info["major_version"]["outdated"],
+            'latest_minor': version_info["minor_version"]["latest"],
+            'minor_outdated': version_info["minor_version"]["outdated"],
+        }
+        if source is not None:
+            record['source'] = source
+        return record
+
     @staticmethod
     def check_latest_major_minor_versions(package, version=None):
         """
@@ -279,8 +336,6 @@ class Package(object):
         1 : minor or major outdated
         999: beyond latest version
         """
-        from pkg_resources import parse_version
-
         return_info = {"major_version": {"outdated": None,
                                          'latest': None},
                        "minor_version": {"outdated": None,
@@ -288,12 +343,12 @@ class Package(object):
                        "code": -1,
                        }
 
-        versions = Package.get_package_versions_from_pypi(package)
-        if versions is None:
+        index = Package.get_version_index(package)
+        if index is None:
             maglog.debug("Something went wrong when looking for versions.")
             return return_info
 
-        latest_major_version = versions[-1]
+        latest_major_version = index.latest()
 
         if version is None:
             # If not given a version, cannot do comparison; return latest.
@@ -303,9 +358,7 @@ class Package(object):
                 "outdated": True, "latest": latest_major_version}
             return return_info
 
-        beyond_up_to_date = (parse_version(version) >
-                             parse_version(latest_major_version))
-        if beyond_up_to_date:
+        if index.is_beyond_latest(version):
             maglog.info("{0} version {1} is beyond latest PyPI version {2}"
                         .format(package, version, latest_major_version))
             # If beyond up to date then latest version is not the PyPI ver.
@@ -319,41 +372,35 @@ class Package(object):
         # Now normal checks:
         return_info['code'] = 0
         minor_outdated = None
-        major_outdated = (parse_version(version)
-                          < parse_version(latest_major_version))
+        parsed_version = parse_version(version)
+        major_outdated = parsed_version < parse_version(latest_major_version)
 
         if major_outdated:
             return_info['code'] = 1
             maglog.info("{0} Major Outdated: {1} > {2}"
-                        .format(package, versions[-1], version))
-            major_v = version.split('.')[0]
-            minor_v = version.split('.')[1]
-
-            minor_versions = [x for x in versions
-                              if x.split('.')[0] == major_v
-                              and x.split('.')[1] == minor_v]
+                        .format(package, latest_major_version, version))
 
-            if not minor_versions:
+            latest_minor_version = index.latest_in_series(version)
+            if latest_minor_version is None:
                 maglog.info("Unable to check minor_versions for {0}"
                             .format(package))
-                latest_minor_version = None
             else:
-                latest_minor_version = minor_versions[-1]
-                minor_outdated = (parse_version(version)
-                                  < parse_version(latest_minor_version))
+                minor_outdated = (parsed_version <
+                                  parse_version(latest_minor_version))
                 if minor_outdated:
                     return_info['code'] = 1
                     maglog.info("{0} Minor Outdated: {1} > {2}"
-                                .format(package, minor_versions[-1], version))
-                    minor_outdated = True
+                                .format(package, latest_minor_version,
+                                        version))
                 else:
                     maglog.info("{0} Minor up to date: {1} <= {2}"
-                                .format(package, minor_versions[-1], version))
+                                .format(package, latest_minor_version,
+                                        version))
         else:
             minor_outdated = False
             latest_minor_version = latest_major_version
             maglog.info("{0} up to date, current: {1}, latest: {2}"
-                        .format(package, version, versions[-1]))
+                        .format(package, version, latest_major_version))
 
         return_info['major_version'] = {
             "outdated": major_outdated, "latest": latest_major_version}
@@ -365,53 +412,165 @@ class Package(object):
 class Requirements(object):
 
     @staticmethod
-    def parse_req_file(req_file=None):
+    def parse_req_file(req_file=None, constraints=False):
         """
-        We're import pip to parse the requirements files; but as pip in a
-        CL tool this is perhaps not guaranteed to be future proof.
+        Requirements in req_file, including those of files it includes
+        with -r. Parsed by magellan.requirements_utils rather than pip.
+
+        Requirements whose environment markers don't apply to this
+        interpreter are left out, as pip would.
 
-        :param req_file:
-        :return: generator object of parsed requiremnets.
+        :param req_file: path to requirements file
+        :param bool constraints: also return the entries of -c constraints
+        files (ParsedRequirement.constraint is True for those)
+        :rtype: list
+        :return: magellan.requirements_utils.ParsedRequirement's
         """
-        if req_file:
-            from pip.req import parse_requirements
-            from pip.download import PipSession
-            return parse_requirements(req_file, session=PipSession())
-        return []
+        if not req_file:
+            return []
+        try:
+            parsed = list(parse_requirements_file(req_file))
+        except RequirementsFileError as e:
+            maglog.error(e)
+            return []
+
+        out = []
+        for p in parsed:
+            if p.constraint and not constraints:
+                continue
+            if not p.markers_apply():
+                maglog.debug("Skipping {0}: markers do not apply"
+                             .format(p))
+                continue
+            out.append(p)
+        return out
 
     @staticmethod
-    def check_outdated_requirements_file(req_file=None, pretty=None):
+    def package_versions_from_req_file(req_file):
         """
-        Reads a requirements file and prints whether the major or minor
-        versions are outdated.
+        (package, version) for each requirement in req_file; version is the
+        "==" pinned version, or None.
+
+        :rtype: list
         """
+        out = []
+        for p in Requirements.parse_req_file(req_file):
+            pinned = [x[1] for x in p.specs if x[0] == '==']
+            out.append((p.name, pinned[0] if pinned else None))
+        return out
 
-        parsed_req = Requirements.parse_req_file(req_file)
-        if not parsed_req:
-            return None
+    @staticmethod
+    def expand_req_files(patterns):
+        """
+        Requirements files named by patterns (paths or globs, e.g.
+        "services/*/requirements*.txt"), sorted per pattern and without
+        duplicates. Patterns matching nothing are kept as given so that
+        the missing file is reported when it is read.
+
+        :param list patterns: str or list of str
+        :rtype: list
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        req_files = []
+        for pattern in patterns or []:
+            for f in sorted(glob.glob(pattern)) or [pattern]:
+                if f not in req_files:
+                    req_files.append(f)
+        return req_files
 
+    @staticmethod
+    def _outdated_check_list(req_file):
+        """
+        Packages to check from req_file, as (key, version) pairs, and the
+        packages without version info.
+        """
+        to_check = []
         no_version_info = []
-        for p in parsed_req:
-            package = p.req.key
+        for p in Requirements.parse_req_file(req_file):
+            package = p.key
 
             try:
-                version = p.req.specs[-1][-1]
-            except IndexError as e:
+                version = p.specs[-1][-1]
+            except IndexError:
                 maglog.debug("No version info for {} in requirements file."
                              .format(package))
                 no_version_info.append(package)
                 continue
 
-            ver_info = Package.check_latest_major_minor_versions(
-                package, version)
-            Package.detail_version_info(
-                ver_info, package, version, pretty)
+            to_check.append((package, version))
+        return to_check, no_version_info
 
-        if no_version_info:
-            header = ('No version info in file "{}" for the '
-                     'following packages'.format(req_file))
-            Requirements._print_req_env_comp_list(
-                header, no_version_info, pretty=pretty)
+    @staticmethod
+    def check_outdated_requirements_file(req_file=None, pretty=None):
+        """
+        Reads a requirements file and prints whether the major or minor
+        versions are outdated.
+        """
+        if req_file:
+            Requirements.check_outdated_requirements_files(
+                [req_file], pretty)
+
+    @staticmethod
+    def check_outdated_requirements_files(req_files, pretty=None):
+        """
+        Reads requirements files and prints, per file, whether the major or
+        minor versions are outdated.
+
+        Each distinct (package, version) across all the files is checked
+        once, concurrently; a file's report is printed as soon as the
+        checks it needs are done.
+
+        :param list req_files: requirements files
+        :rtype: dict
+        :return: {(package, version): version info} for every pair checked
+        """
+        parsed = []
+        unique = OrderedDict()
+        for req_file in req_files:
+            to_check, no_version_info = \
+                Requirements._outdated_check_list(req_file)
+            parsed.append((req_file, to_check, no_version_info))
+            for pair in to_check:
+                unique.setdefault(pair, Package(*pair))
+
+        maglog.info("{0} distinct package versions in {1} requirements files"
+                    .format(len(unique), len(req_files)))
+        results = FetchEngine.default().imap(
+            Package._check_versions, list(unique.values()))
+        pending = iter(zip(unique, results))
+        checked = {}
+
+        for req_file, to_check, no_version_info in parsed:
+            if len(req_files) > 1 and not jsonl_output():
+                print_col('Requirements file "{}":'.format(req_file),
+                          pretty=pretty, header=True)
+            for package, version in to_check:
+                # results arrive in first-seen order, so this only waits on
+                # pairs this file needs.
+                while (package, version) not in checked:
+                    pair, version_info = next(pending)
+                    checked[pair] = version_info
+                version_info = checked[(package, version)]
+                maglog.debug(version_info)
+                if jsonl_output():
+                    print_record('outdated', Package.version_info_record(
+                        version_info, package, version, req_file))
+                else:
+                    Package.detail_version_info(
+                        version_info, package, version, pretty)
+
+            if jsonl_output():
+                for package in no_version_info:
+                    print_record('no_version_info',
+                                 {'package': package, 'source': req_file})
+            elif no_version_info:
+                header = ('No version info in file "{}" for the '
+                          'following packages'.format(req_file))
+                Requirements._print_req_env_comp_list(
+                    header, no_version_info, pretty=pretty)
+
+        return checked
 
     @staticmethod
     def compare_req_file_to_env(req_file, venv):
@@ -435,37 +594,50 @@ class Requirements(object):
         :return: 4 x lists.
         """
 
-        parsed_req = Requirements.parse_req_file(req_file)
-        if not parsed_req:
+        req_versions = Requirements.req_file_versions(req_file)
+        if not req_versions:
             return None
 
-        all_reqs = {x.req.key: {'project_name': x.req.project_name,
-                                'specs': x.req.specs}
-                    for x in parsed_req}
+        return Requirements._compare_versions(
+            req_versions, Requirements.env_versions(venv))
 
-        req_only = [x for x in all_reqs if x not in venv.all_packages]
-        env_only = [x for x in venv.all_packages if x not in all_reqs]
+    @staticmethod
+    def req_file_versions(req_file):
+        """
+        {package key: "==" pinned version, or REQ_NO_VERSION} for req_file,
+        in file order.
 
-        # Version comparison:
-        REQ_NO_VERSION = '-1'  # value for when no requirements
-        verdiff = []
-        same = []
-        ver_check = [x for x in all_reqs if x not in req_only]
-        for package in ver_check:
-            env_ver = venv.all_packages[package].version
+        :rtype: OrderedDict
+        """
+        req_versions = OrderedDict()
+        for p in Requirements.parse_req_file(req_file):
+            pinned = [x[1] for x in p.specs if x[0] == '=='] or [None]
+            req_versions[p.key] = pinned[0] or REQ_NO_VERSION
+        return req_versions
 
-            specs = all_reqs[package].get('specs')
-            if not specs:
-                req_ver = REQ_NO_VERSION
-            else:
-                try:
-                    req_ver = [x[1] for x in specs if x[0] == '=='][0]
-                except IndexError:  # assume no index info
-                    req_ver = REQ_NO_VERSION
+    @staticmethod
+    def env_versions(venv):
+        """{package key: version} of the packages in venv."""
+        return {k: p.version for k, p in venv.all_packages.items()}
+
+    @staticmethod
+    def _compare_versions(req_versions, env_versions):
+        """same, verdiff, req_only, env_only (see compare_req_file_to_env)
+        from req_file_versions and env_versions dicts."""
+        req_keys = set(req_versions)
+        env_keys = set(env_versions)
+        in_both = req_keys & env_keys
 
-                if not req_ver:
-                    req_ver = REQ_NO_VERSION
+        req_only = [x for x in req_versions if x not in in_both]
+        env_only = [x for x in env_versions if x not in in_both]
 
+        same = []
+        verdiff = []
+        for package in req_versions:
+            if package not in in_both:
+                continue
+            req_ver = req_versions[package]
+            env_ver = env_versions[package]
             if req_ver == env_ver:
                 same.append((package, env_ver))
             else:
@@ -473,6 +645,86 @@ class Requirements(object):
 
         return same, verdiff, req_only, env_only
 
+    @staticmethod
+    def compare_req_files_to_envs(req_files, envs):
+        """
+        compare_req_file_to_env for every (requirements file, environment)
+        pair, parsing each file and reading each environment once.
+
+        :param list req_files: requirements files
+        :param list envs: (label, Environment) pairs
+        :rtype: OrderedDict
+        :return: {(req_file, label): (same, verdiff, req_only, env_only)};
+        files with no requirements are left out.
+        """
+        all_req_versions = [(f, Requirements.req_file_versions(f))
+                            for f in req_files]
+        all_env_versions = [(label, Requirements.env_versions(venv))
+                            for label, venv in envs]
+
+        matrix = OrderedDict()
+        for req_file, req_versions in all_req_versions:
+            if not req_versions:
+                maglog.info("No requirements in {0}".format(req_file))
+                continue
+            for label, env_versions in all_env_versions:
+                matrix[(req_file, label)] = Requirements._compare_versions(
+                    req_versions, env_versions)
+        return matrix
+
+    @staticmethod
+    def print_req_env_matrix(matrix, pretty=False):
+        """
+        Prints the result of compare_req_files_to_envs as a table of
+        requirements files by environments; each cell counts the packages
+        that are the same / differ in version / only in the requirements
+        file / only in the environment. With --format jsonl, writes one
+        "req_env_comparison" record, with the package lists, per pair.
+        """
+        if jsonl_output():
+            for (req_file, label), compared in matrix.items():
+                same, verdiff, req_only, env_only = compared
+                print_record('req_env_comparison', {
+                    'source': req_file, 'environment': label,
+                    'same': same, 'verdiff': verdiff,
+                    'req_only': req_only, 'env_only': env_only})
+            return
+
+        labels = []
+        rows = OrderedDict()
+        for (req_file, label), compared in matrix.items():
+            if label not in labels:
+                labels.append(label)
+            rows.setdefault(req_file, {})[label] = \
+                "/".join(str(len(x)) for x in compared)
+
+        print_col("Requirements files vs environments "
+                  "(same/verdiff/req_only/env_only):",
+                  pretty=pretty, header=True)
+        if not rows:
+            print_col("None", pretty=pretty)
+            return
+        table_data = [['REQUIREMENTS'] + labels]
+        for req_file, cells in rows.items():
+            table_data.append([req_file] + [cells.get(x, '')
+                                            for x in labels])
+        print_col(OutputTableType(table_data).table, pretty=pretty)
+
+    @staticmethod
+    def compare_req_files_to_env(req_files, venv, pretty=False):
+        """
+        compare_req_file_to_env and print_req_env_comp_lists for each of
+        req_files, headed by the file name if there are several.
+        """
+        for req_file in req_files:
+            if len(req_files) > 1:
+                print_col('Requirements file "{}":'.format(req_file),
+                          pretty=pretty, header=True)
+            compared = Requirements.compare_req_file_to_env(req_file, venv)
+            if compared is not None:
+                Requirements.print_req_env_comp_lists(*compared,
+                                                      pretty=pretty)
+
     @staticmethod
     def print_req_env_comp_lists(
             same, verdiff, req_only, env_only, pretty=False):
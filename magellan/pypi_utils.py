@@ -0,0 +1,307 @@
+"""
+Module containing PyPIHelper class.
+
+The one metadata service all package version and dependency lookups go
+through: PyPI (or the --index-url / --local-index stand ins) behind the
+DepCache store and the shared FetchEngine session, with one set of metrics.
+"""
+
+import logging
+import threading
+from collections import Counter
+
+import requests
+
+from magellan.cache_utils import DepCache, slim_package_json
+from magellan.fetch_utils import FetchEngine
+from magellan.index_utils import LocalIndex
+from magellan.simple_utils import SimpleIndex
+from magellan.utils import MagellanConfig
+from magellan.version_utils import VersionIndex
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+_metrics_lock = threading.Lock()
+_version_indexes_lock = threading.Lock()
+
+
+class PyPIHelper(object):
+    """Collection of static methods to assist in interrogating PyPI"""
+
+    # Counts of package document lookups by outcome ('cache', 'missing',
+    # 'downloaded', 'not_modified', 'failed') and 'bytes' downloaded.
+    metrics = Counter()
+
+    # {package key: VersionIndex}, built once per fetched document.
+    _version_indexes = {}
+
+    @staticmethod
+    def _count(outcome, n=1):
+        with _metrics_lock:
+            PyPIHelper.metrics[outcome] += n
+
+    @staticmethod
+    def hit_ratio(counts=None):
+        """
+        Fraction of package document lookups in counts (default
+        PyPIHelper.metrics) answered without a download; None if none.
+        """
+        counts = PyPIHelper.metrics if counts is None else counts
+        hits = counts.get('cache', 0) + counts.get('missing', 0)
+        lookups = hits + sum(counts.get(x, 0) for x in
+                             ('downloaded', 'not_modified', 'failed'))
+        return float(hits) / lookups if lookups else None
+
+    @staticmethod
+    def metrics_summary():
+        """One line summary of PyPIHelper.metrics."""
+        return ", ".join("{0}: {1}".format(k, v)
+                         for k, v in sorted(PyPIHelper.metrics.items()))
+
+    @staticmethod
+    def check_package_version_on_pypi(package, version):
+        """
+        Queries PyPI to see if the specific version of "package" exists.
+
+        :param str package: package name
+        :param str version: package version
+        :rtype bool:
+        :return: True if package-version on PyPI
+        """
+
+        local_index = LocalIndex.default()
+        if local_index is not None:
+            return version in (local_index.versions(package) or [])
+
+        store = DepCache.default()
+        on_pypi = store.has_release(package, version)
+        # Releases don't disappear, but may have appeared since caching.
+        if on_pypi or (on_pypi is False and
+                       store.is_fresh(package, MagellanConfig.cache_ttl)):
+            PyPIHelper._count('cache')
+            return on_pypi
+
+        package_json = PyPIHelper.acquire_package_json_info(package)
+
+        if not package_json:
+            return False
+        else:
+            # print("JSON acquired")
+            return version in package_json['releases'].keys()
+
+    @staticmethod
+    def acquire_package_json_info(package, localcache=None):
+        """
+        Perform lookup on packages and versions. Uses PyPI, or the local
+        index if MagellanConfig.local_index is set. Returns JSON
+
+        p is package name
+        localCacheDir is a location of local cache
+        """
+        package = str(package)
+
+        local_index = LocalIndex.default()
+        if local_index is not None:
+            return local_index.package_json(package)
+
+        store = DepCache.default(localcache)
+
+        if store.is_fresh(package, MagellanConfig.cache_ttl):
+            package_json = store.get_package(package)
+            if package_json is not None:
+                maglog.info("retrieving {0} from local cache {1}"
+                            .format(package, store.path))
+                PyPIHelper._count('cache')
+                return package_json
+        elif store.is_known_missing(package,
+                                    MagellanConfig.negative_cache_ttl):
+            maglog.info("{0} recently not found; not retrying".format(package))
+            PyPIHelper._count('missing')
+            return {}
+
+        # Threads missing on the same package share one download.
+        return FetchEngine.default().single_flight(
+            ('pypi-json', store.path, package.lower()),
+            lambda: PyPIHelper._fetch_package_json_info(package, store))
+
+    @staticmethod
+    def _fetch_package_json_info(package, store):
+        """
+        Download package JSON from PyPI into store. An expired cached copy
+        is revalidated with a conditional request and returned if PyPI is
+        unreachable; {} on failure otherwise, which is then remembered for
+        MagellanConfig.negative_cache_ttl.
+        """
+        cached = store.get_package(package)
+        if cached is not None and store.is_fresh(
+                package, MagellanConfig.cache_ttl):  # fetched while we waited
+            return cached
+        if store.is_known_missing(package, MagellanConfig.negative_cache_ttl):
+            return {}
+
+        index = SimpleIndex.default()
+        if index is not None:
+            url = index.project_url(package)
+        else:
+            pypi_template = 'https://pypi.python.org/pypi/{0}/json'
+            url = pypi_template.format(package)
+
+        headers = {}
+        if cached is not None:
+            etag, last_modified = store.get_validators(package)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        try:
+            if index is not None:
+                r = index.get_project_page(package, headers=headers)
+            else:
+                r = FetchEngine.default().get(url, headers=headers)
+            if r.status_code == 304 and cached is not None:
+                maglog.info("{0} JSON unchanged on PyPI".format(package))
+                store.touch_package(package)
+                PyPIHelper._count('not_modified')
+                return cached
+
+            elif r.status_code == 200:  # if successfully retrieved:
+                maglog.info("{0} successfully retrieved from {1}"
+                            .format(package, url))
+
+                # Save to local cache...
+                package_json = slim_package_json(
+                    index.parse_project_page(package, r) if index is not None
+                    else r.json())
+                with _version_indexes_lock:
+                    PyPIHelper._version_indexes.pop(package.lower(), None)
+                store.put_package(package, package_json, url=url,
+                                  n_bytes=len(r.content),
+                                  etag=r.headers.get('ETag'),
+                                  last_modified=r.headers.get('Last-Modified'))
+                PyPIHelper._count('downloaded')
+                PyPIHelper._count('bytes', len(r.content))
+                # ... and return to caller:
+                return package_json
+
+            else:  # retrieval failed
+                maglog.info("failed to download {0}".format(package))
+                status = r.status_code
+        except (requests.ConnectionError, requests.Timeout) as e:
+            maglog.warn("Connection to PyPI failed: {}".format(e))
+            status = None
+
+        PyPIHelper._count('failed')
+        if cached is not None:
+            return cached
+        # Remember the miss so it isn't retried for negative_cache_ttl.
+        store.put_miss(package, url=url, status=status)
+        return {}
+
+    @staticmethod
+    def acquire_package_json_info_bulk(packages):
+        """
+        acquire_package_json_info for many packages at once; cached ones in
+        one query, the rest fetched concurrently on the shared FetchEngine.
+
+        :param list packages: package names
+        :rtype: dict
+        :return: {package: JSON}, JSON being {} if not found.
+        """
+        packages = list(packages)
+        if LocalIndex.default() is not None:
+            return {p: PyPIHelper.acquire_package_json_info(p)
+                    for p in packages}
+
+        store = DepCache.default()
+        ttl = MagellanConfig.cache_ttl
+        ages = store.package_ages_bulk(packages)
+        out = store.get_packages_bulk(
+            [x for x in ages if ttl is None or ttl < 0 or ages[x] < ttl])
+        PyPIHelper._count('cache', len(out))
+        to_fetch = [x for x in packages if x not in out]
+        for package, package_json in zip(to_fetch, FetchEngine.default().imap(
+                PyPIHelper.acquire_package_json_info, to_fetch)):
+            out[package] = package_json
+        return out
+
+    @staticmethod
+    def acquire_package_version_json_info(package, version):
+        """
+        Perform lookup of a specific version of a package on PyPI. Returns
+        JSON; not cached, see DepTools.get_deps_from_pypi_json. {} when
+        using a simple API --index-url, which has no per-version documents.
+
+        :param str package: package name
+        :param str version: package version
+        :rtype: dict
+        """
+        local_index = LocalIndex.default()
+        if local_index is not None:
+            return local_index.package_json(package, version)
+        if SimpleIndex.default() is not None:
+            return {}
+
+        pypi_template = 'https://pypi.python.org/pypi/{0}/{1}/json'
+
+        try:
+            r = FetchEngine.default().get(
+                pypi_template.format(package, version))
+            if r.status_code == 200:
+                maglog.info("{0} {1} JSON successfully retrieved from PyPI"
+                            .format(package, version))
+                return r.json()
+            else:
+                maglog.info("failed to download {0} {1}"
+                            .format(package, version))
+                return {}
+        except (requests.ConnectionError, requests.Timeout) as e:
+            maglog.warn("Connection to PyPI failed: {}".format(e))
+            return {}
+
+    @staticmethod
+    def all_package_versions_on_pypi(package):
+        """Return a list of all released packages on PyPI.
+
+        :param str package: input package name
+        :rtype: list
+        :return: list of all package versions
+        """
+
+        local_index = LocalIndex.default()
+        if local_index is not None:
+            return local_index.versions(package) or []
+
+        store = DepCache.default()
+        if store.is_fresh(package, MagellanConfig.cache_ttl):
+            versions = store.release_versions(package)
+            if versions is not None:
+                PyPIHelper._count('cache')
+                return versions
+
+        all_package_info = PyPIHelper.acquire_package_json_info(package)
+        out = []
+        if 'releases' in all_package_info:
+            out = list(all_package_info['releases'].keys())
+        return out
+
+    @staticmethod
+    def version_index(package):
+        """
+        VersionIndex of all released versions of package; built once and
+        shared by -O, -l and the upgrade checks.
+
+        :param str package: input package name
+        :rtype: magellan.version_utils.VersionIndex
+        """
+        key = package.lower()
+        with _version_indexes_lock:
+            index = PyPIHelper._version_indexes.get(key)
+        if index is None:
+            index = VersionIndex(
+                PyPIHelper.all_package_versions_on_pypi(package))
+            if index:  # don't remember failed lookups
+                with _version_indexes_lock:
+                    PyPIHelper._version_indexes[key] = index
+        return index
@@ -0,0 +1,279 @@
+"""
+Module containing the requirements file parser.
+
+Reads pip requirements files without importing pip: "-r"/"-c" includes,
+environment markers, extras, "--hash" options, line continuations and
+comments, yielding lightweight ParsedRequirement records.
+
+Includes are followed depth first with cycle detection, and each file's
+parse is kept for the rest of the process and reused while its contents,
+the path it is read through and the environment variables it uses are
+unchanged, so base files shared by many requirements files are parsed once.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+
+from pkg_resources import Requirement
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+_COMMENT_RE = re.compile(r'(^|\s+)#.*$')
+_ENV_VAR_RE = re.compile(r'\$\{([A-Z0-9_]+)\}')
+_EGG_RE = re.compile(r'[#&]egg=([^&]+)')
+_INCLUDE_RE = re.compile(
+    r'^(-r|--requirement|-c|--constraint)(?:\s*=\s*|\s+|(?<=^-[rc]))(\S+)$')
+_HASH_RE = re.compile(r'\s--hash[=\s]\s*(\S+)')
+
+# realpath: ((path as given, constraint, sha1 of contents, values of the
+#             ${VARS} used), parsed items)
+_parsed_files = {}
+_parsed_files_lock = threading.Lock()
+
+# Option lines that only affect how pip installs; nothing to record.
+_GLOBAL_OPTIONS = ('-i', '--index-url', '--extra-index-url', '--no-index',
+                   '-f', '--find-links', '--no-binary', '--only-binary',
+                   '--prefer-binary', '--pre', '--trusted-host',
+                   '--require-hashes', '--use-feature', '-Z',
+                   '--always-unzip', '--allow-external', '--allow-unverified',
+                   '--allow-all-external', '--process-dependency-links')
+
+
+class RequirementsFileError(Exception):
+    pass
+
+
+class ParsedRequirement(object):
+    """One requirement of a requirements file.
+
+    req is a pkg_resources.Requirement, so req.key, req.project_name and
+    req.specs are available as with pip's InstallRequirement.
+    """
+
+    __slots__ = ('req', 'extras', 'markers', 'hashes', 'editable', 'link',
+                 'constraint', 'comes_from')
+
+    def __init__(self, req, hashes=None, editable=False, link=None,
+                 constraint=False, comes_from=None):
+        self.req = req
+        self.extras = tuple(sorted(req.extras))
+        self.markers = str(req.marker) if getattr(req, 'marker', None) \
+            else None
+        self.hashes = hashes or []
+        self.editable = editable
+        self.link = link
+        self.constraint = constraint
+        self.comes_from = comes_from  # "file:line"
+
+    @property
+    def name(self):
+        return self.req.project_name
+
+    @property
+    def key(self):
+        return self.req.key
+
+    @property
+    def specs(self):
+        return self.req.specs
+
+    def markers_apply(self, environment=None):
+        """True if there are no markers, or they hold for environment
+        (default: the running interpreter)."""
+        marker = getattr(self.req, 'marker', None)
+        return marker is None or marker.evaluate(environment)
+
+    def __repr__(self):
+        return "<ParsedRequirement {0} from {1}>".format(
+            self.req, self.comes_from)
+
+
+def logical_lines(text):
+    """
+    (line number, line) for each logical line of a requirements file:
+    continuations joined, comments and blank lines dropped.
+    """
+    start, parts = None, []
+    for number, line in enumerate(text.splitlines(), 1):
+        if start is None:
+            start = number
+        line = _COMMENT_RE.sub('', line)
+        if line.endswith('\\'):
+            parts.append(line[:-1])
+            continue
+        parts.append(line)
+        joined = ''.join(parts).strip()
+        if joined:
+            yield start, joined
+        start, parts = None, []
+    joined = ''.join(parts).strip()
+    if joined:  # file ended with a continuation
+        yield start, joined
+
+
+def parse_requirements_text(text, req_file='<string>', constraint=False):
+    """
+    Parse requirements file contents.
+
+    :param str text: file contents
+    :param str req_file: path of the file, for relative includes and
+    comes_from
+    :param bool constraint: whether the file was included with -c
+    :return: generator of ParsedRequirement and ("-r"|"-c", path) include
+    tuples, in file order
+    """
+    for number, line in logical_lines(text):
+        line = _ENV_VAR_RE.sub(
+            lambda m: os.environ.get(m.group(1), m.group(0)), line)
+        comes_from = "{0}:{1}".format(req_file, number)
+
+        include = _INCLUDE_RE.match(line)
+        if include:
+            kind = '-c' if include.group(1) in ('-c', '--constraint') \
+                else '-r'
+            yield kind, _include_path(req_file, include.group(2))
+            continue
+
+        if line.startswith('-') and not line.startswith(('-e', '--editable')):
+            if not line.split('=')[0].split()[0] in _GLOBAL_OPTIONS:
+                maglog.info("Ignoring unknown option in {0}: {1}"
+                            .format(comes_from, line))
+            continue
+
+        parsed = _parse_requirement_line(line, comes_from, constraint)
+        if parsed is not None:
+            yield parsed
+
+
+def parse_requirements_file(req_file, constraint=False):
+    """
+    Parse req_file and the files it includes with -r/-c.
+
+    Each file is expanded once, where it is first included; an include
+    that leads back to a file being expanded (a cycle) is logged and
+    skipped.
+
+    :param str req_file: path of a requirements file
+    :param bool constraint: whether req_file was included with -c
+    :return: generator of ParsedRequirement, in file order with includes
+    expanded in place
+    :raises RequirementsFileError: if req_file or an include can't be read
+    """
+    return _expand(req_file, constraint, [], set())
+
+
+def read_requirements_file(req_file, constraint=False):
+    """
+    Items of req_file as parse_requirements_text returns them (includes
+    not followed), reusing the previous parse if nothing it depends on has
+    changed: the file's contents, the path it was read through (includes
+    are relative to it) and the environment variables it refers to.
+
+    :rtype: list
+    :raises RequirementsFileError: if req_file can't be read
+    """
+    try:
+        with open(req_file, 'rb') as f:
+            data = f.read()
+    except (IOError, OSError) as e:
+        raise RequirementsFileError(
+            "Could not read requirements file {0}: {1}".format(req_file, e))
+
+    text = data.decode('utf-8', 'replace')
+    key = os.path.realpath(req_file)
+    inputs = (req_file, constraint, hashlib.sha1(data).hexdigest(),
+              tuple((x, os.environ.get(x))
+                    for x in sorted(set(_ENV_VAR_RE.findall(text)))))
+    with _parsed_files_lock:
+        cached = _parsed_files.get(key)
+    if cached is not None and cached[0] == inputs:
+        maglog.debug("Requirements file {0} unchanged; not re-parsed"
+                     .format(req_file))
+        return cached[1]
+
+    items = list(parse_requirements_text(text, req_file, constraint))
+    with _parsed_files_lock:
+        _parsed_files[key] = (inputs, items)
+    return items
+
+
+def _expand(req_file, constraint, stack, done):
+    """parse_requirements_file, tracking the chain of files being expanded
+    (stack) and those already expanded (done)."""
+    real = os.path.realpath(req_file)
+    if real in stack:
+        chain = stack[stack.index(real):] + [real]
+        maglog.warn("Requirements include cycle, skipping: {0}"
+                    .format(" -> ".join(chain)))
+        return
+    if (real, constraint) in done:
+        maglog.debug("{0} already included".format(req_file))
+        return
+
+    items = read_requirements_file(req_file, constraint)
+    stack.append(real)
+    for item in items:
+        if isinstance(item, tuple):
+            kind, path = item
+            if path is None:
+                continue
+            for included in _expand(path, constraint or kind == '-c',
+                                    stack, done):
+                yield included
+        else:
+            yield item
+    stack.pop()
+    done.add((real, constraint))
+
+
+def _include_path(req_file, target):
+    """Path of a -r/-c target, relative to the including file; None (and
+    logged) for URLs, which are not fetched."""
+    if re.match(r'^[a-z][a-z0-9+.-]*://', target, re.I) \
+            and not target.startswith('file://'):
+        maglog.warn("Not following remote include {0} in {1}"
+                    .format(target, req_file))
+        return None
+    if target.startswith('file://'):
+        target = target[len('file://'):]
+    return os.path.join(os.path.dirname(req_file), target)
+
+
+def _parse_requirement_line(line, comes_from, constraint):
+    """ParsedRequirement for one logical requirement line, or None if it
+    names no project (e.g. a bare path or URL)."""
+    hashes = _HASH_RE.findall(' ' + line)
+    line = _HASH_RE.sub('', ' ' + line).strip()
+    # Per-requirement options other than --hash (e.g. --install-option)
+    line = re.split(r'\s+--?[a-z]', line, 1)[0].strip()
+
+    editable = False
+    link = None
+    if line.startswith(('-e', '--editable')):
+        editable = True
+        line = re.sub(r'^(-e|--editable)(\s*=\s*|\s+)?', '', line).strip()
+
+    if editable or re.match(r'^[a-z][a-z0-9+.-]*://', line, re.I) \
+            or line.startswith(('.', '/')):
+        link = line
+        egg = _EGG_RE.search(line)
+        if egg is None:
+            maglog.info("Skipping requirement without project name at "
+                        "{0}: {1}".format(comes_from, line))
+            return None
+        line = egg.group(1)
+
+    try:
+        req = Requirement.parse(line)
+    except ValueError as e:
+        maglog.warn("Invalid requirement at {0}: {1} ({2})"
+                    .format(comes_from, line, e))
+        return None
+
+    return ParsedRequirement(req, hashes=hashes, editable=editable,
+                             link=link or getattr(req, 'url', None),
+                             constraint=constraint, comes_from=comes_from)
@@ -0,0 +1,230 @@
+"""
+Module containing Resolver class.
+
+Builds Environments without installing or interrogating anything: for a
+requirements file the transitive closure of its requirements is resolved,
+and for a "pip freeze" snapshot the listed versions are taken as they are.
+Either way requirements come from package metadata (cache, local index,
+index metadata files, PyPI JSON, sdists) and are turned into the nodes,
+edges and package_requirements that interrogating a real environment
+would give.
+"""
+
+import logging
+from collections import OrderedDict
+
+from pkg_resources import Requirement
+
+from magellan.cache_utils import DepCache
+from magellan.deps_utils import DepTools
+from magellan.env_utils import Environment
+from magellan.fetch_utils import FetchEngine
+from magellan.package_utils import Requirements
+from magellan.pypi_utils import PyPIHelper
+from magellan.version_utils import VersionIntervals
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+
+class Resolver(object):
+    """Picks one version of every package a set of requirements needs.
+
+    Resolution is breadth first, one level of the dependency graph at a
+    time, taking the latest release allowed by every requirement seen so
+    far for a package (finals before pre-releases). Like pip's legacy
+    resolver it does not backtrack: a requirement that arrives after its
+    package was pinned, and that the pin does not satisfy, is recorded in
+    conflicts; -C then reports it against the resulting environment.
+    """
+
+    def __init__(self):
+        self.pins = OrderedDict()  # key: (project_name, version)
+        self.requirements = {}  # key: requirements dict of the pin
+        self.specs = {}  # key: [Requirement, ..] the pin must satisfy
+        self.unresolved = OrderedDict()  # key: [Requirement, ..]
+        self.conflicts = []  # (key, pinned version, requirement, required_by)
+
+    def resolve(self, parsed_requirements):
+        """
+        Resolve the transitive closure of parsed_requirements.
+
+        :param list parsed_requirements:
+        magellan.requirements_utils.ParsedRequirement's; constraint entries
+        restrict versions without adding packages.
+        :return: self
+        """
+        pending = OrderedDict()
+        for p in parsed_requirements:
+            if p.constraint:
+                self.specs.setdefault(p.key, []).append(p.req)
+            else:
+                pending.setdefault(p.key, []).append((p.req, 'root'))
+
+        while pending:
+            new_pins = []
+            for key, reqs in pending.items():
+                if key in self.pins or key in self.unresolved:
+                    self._check_pinned(key, reqs)
+                    continue
+                self.specs.setdefault(key, []).extend(r for r, _ in reqs)
+                version = self._best_version(reqs[0][0].project_name,
+                                             self.specs[key])
+                if version is None:
+                    maglog.warn("No version of {0} satisfies {1}".format(
+                        reqs[0][0].project_name,
+                        ", ".join(str(x) for x in self.specs[key])))
+                    self.unresolved[key] = self.specs[key]
+                    continue
+                self.pins[key] = (reqs[0][0].project_name, version)
+                new_pins.append(key)
+
+            # Requirements of this level's pins, concurrently.
+            found = FetchEngine.default().imap(
+                Resolver._requirements_of, [self.pins[x] for x in new_pins])
+
+            pending = OrderedDict()
+            for key, requirements in zip(new_pins, found):
+                self.requirements[key] = requirements
+                for dep_key, r in \
+                        (requirements.get('requires') or {}).items():
+                    pending.setdefault(dep_key, []).append(
+                        (_as_requirement(r), key))
+
+        maglog.info("Resolved {0} packages; {1} unresolved, {2} conflicts"
+                    .format(len(self.pins), len(self.unresolved),
+                            len(self.conflicts)))
+        return self
+
+    def _check_pinned(self, key, reqs):
+        """Record requirements that an existing pin doesn't satisfy."""
+        if key not in self.pins:
+            return
+        version = self.pins[key][1]
+        for req, required_by in reqs:
+            if version not in req:
+                maglog.info("{0} {1} does not satisfy {2} (required by {3})"
+                            .format(self.pins[key][0], version, req,
+                                    required_by))
+                self.conflicts.append((key, version, str(req), required_by))
+
+    @staticmethod
+    def _best_version(package, reqs):
+        """Latest release of package allowed by all of reqs, or None."""
+        allowed = VersionIntervals.from_specs(
+            [spec for r in reqs for spec in r.specs])
+        versions = PyPIHelper.version_index(package).satisfying(allowed)
+        return versions[-1] if versions else None
+
+    @staticmethod
+    def _requirements_of(pin):
+        """Requirements dict of a (project_name, version) pin, from metadata
+        only; none if they can't be had without installing."""
+        package, version = pin
+        requirements = DepTools.get_deps_without_install(package, version)
+        if requirements is None:
+            maglog.warn("Requirements of {0} {1} are not available without "
+                        "installing it; treating it as having none."
+                        .format(package, version))
+            requirements = {'project_name': package, 'version': version,
+                            'requires': {}}
+        return requirements
+
+    def environment(self, name=None):
+        """Environment of the resolved pins."""
+        return environment_from_pins(name, self.pins, self.requirements)
+
+    def write_lock_file(self, path, source=None):
+        """
+        Write the pins, one "name==version" line each, in name order, as a
+        requirements file that reproduces the resolved environment.
+        """
+        lines = ["# Pinned by magellan{0}".format(
+            " from {0}".format(source) if source else "")]
+        for key in sorted(self.pins):
+            lines.append("{0}=={1}".format(*self.pins[key]))
+        for key, reqs in self.unresolved.items():
+            lines.append("# unresolved: {0}".format(
+                ", ".join(str(x) for x in reqs)))
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        maglog.info("Wrote {0} pins to {1}".format(len(self.pins), path))
+
+
+def environment_from_freeze(freeze_file):
+    """
+    Environment of the packages in a "pip freeze" snapshot, e.g. from a
+    production host, with their requirements read from package metadata;
+    no virtual env is needed.
+
+    Packages without a "==" version (e.g. "name @ url" entries) are left
+    out, as their metadata can't be looked up by version.
+
+    :param str freeze_file: path to pip freeze output
+    :rtype: Environment
+    """
+    pins = OrderedDict()
+    for p in Requirements.parse_req_file(freeze_file):
+        version = [x[1] for x in p.specs if x[0] == '==']
+        if not version:
+            maglog.warn("No version for {0} in {1}; leaving it out"
+                        .format(p.name, freeze_file))
+            continue
+        pins[p.key] = (p.name, version[0])
+
+    # Cached requirements in one query, the rest concurrently.
+    cached = DepCache.default().get_requirements_bulk(list(pins.values()))
+    requirements = {}
+    to_fetch = []
+    for key, pin in pins.items():
+        if pin in cached:
+            requirements[key] = cached[pin]
+        else:
+            to_fetch.append(key)
+    found = FetchEngine.default().imap(
+        Resolver._requirements_of, [pins[x] for x in to_fetch])
+    for key, r in zip(to_fetch, found):
+        requirements[key] = r
+
+    maglog.info("{0}: {1} packages, {2} from cache".format(
+        freeze_file, len(pins), len(pins) - len(to_fetch)))
+    return environment_from_pins(freeze_file, pins, requirements)
+
+
+def environment_from_pins(name, pins, requirements):
+    """
+    Environment whose nodes, edges and package_requirements are those of
+    the given packages, as env_interrogation.py would record them had they
+    been installed.
+
+    :param dict pins: {key: (project_name, version)}
+    :param dict requirements: {key: requirements dict}; packages missing
+    from it are taken to have no requirements.
+    :rtype: Environment
+    """
+    nodes = []
+    edges = []
+    package_requirements = {}
+    for key, (project_name, version) in pins.items():
+        p_tup = (project_name, version)
+        nodes.append(p_tup)
+        edges.append([('root', '0.0.0'), p_tup])
+
+        requires = (requirements.get(key) or {}).get('requires') or {}
+        package_requirements[key] = {'project_name': project_name,
+                                     'version': version, 'requires': {}}
+        for dep_key, r in requires.items():
+            dep_version = pins[dep_key][1] if dep_key in pins else ''
+            edges.append([p_tup, (dep_key, dep_version), r['specs']])
+            package_requirements[key]['requires'][dep_key] = {
+                'project_name': r['project_name'], 'specs': r['specs']}
+
+    venv = Environment(name)
+    venv.load_graph(nodes, edges, package_requirements)
+    return venv
+
+
+def _as_requirement(r):
+    """pkg_resources.Requirement from a requirements dict entry."""
+    return Requirement.parse(r['project_name'] + ",".join(
+        op + ver for op, ver in r['specs']))
@@ -0,0 +1,227 @@
+"""
+Module containing SimpleIndex class.
+
+Client for the "simple" API every package index and mirror serves: project
+pages as PEP 503 HTML or PEP 691 JSON, plus the PEP 658 ".metadata" files
+published next to distributions, which carry a release's requirements for a
+few kilobytes instead of a download of the distribution itself.
+"""
+
+import email.parser
+import hashlib
+import logging
+import threading
+
+try:
+    from HTMLParser import HTMLParser
+    from urlparse import urldefrag, urljoin
+except ImportError:  # Python 3
+    from html.parser import HTMLParser
+    from urllib.parse import urldefrag, urljoin
+
+import requests
+from pkg_resources import parse_version
+
+from magellan.fetch_utils import FetchEngine
+from magellan.index_utils import SDIST_EXTENSIONS, canonical_name
+from magellan.metadata_utils import requirements_from_strings
+from magellan.utils import MagellanConfig
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+SIMPLE_JSON = 'application/vnd.pypi.simple.v1+json'
+# Prefer PEP 691 JSON; indexes that only know PEP 503 send HTML.
+SIMPLE_ACCEPT = '{0}, text/html;q=0.1'.format(SIMPLE_JSON)
+
+
+class _AnchorParser(HTMLParser):
+    """Collects the attributes of every <a> in a PEP 503 page."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.anchors = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self.anchors.append(dict(attrs))
+
+
+class SimpleIndex(object):
+    """A PEP 503/691 package index, e.g. https://pypi.org/simple/ or a
+    private mirror."""
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, index_url):
+        self.index_url = index_url.rstrip('/') + '/'
+
+    @staticmethod
+    def default():
+        """SimpleIndex of MagellanConfig.index_url, or None if unset."""
+        if not MagellanConfig.index_url:
+            return None
+        with SimpleIndex._default_lock:
+            idx = SimpleIndex._default
+            if idx is None or idx.index_url != \
+                    MagellanConfig.index_url.rstrip('/') + '/':
+                idx = SimpleIndex(MagellanConfig.index_url)
+                SimpleIndex._default = idx
+            return idx
+
+    def project_url(self, package):
+        return self.index_url + canonical_name(package) + '/'
+
+    def get_project_page(self, package, headers=None):
+        """GET the project page of package, asking for PEP 691 JSON."""
+        headers = dict(headers or {})
+        headers['Accept'] = SIMPLE_ACCEPT
+        return FetchEngine.default().get(self.project_url(package),
+                                         headers=headers)
+
+    @staticmethod
+    def parse_project_page(package, response):
+        """
+        Convert a project page response into a PyPI JSON shaped document:
+        {'info': {'name':.., 'version': latest, 'requires_dist': None},
+         'releases': {version: [{'filename', 'url', 'packagetype', 'yanked',
+                                 'core_metadata'}, ..]}}
+
+        core_metadata is False, True or a {hash name: digest} dict if a
+        PEP 658 metadata file is available for the file.
+        """
+        name = package
+        base_url = response.url
+        content_type = response.headers.get('Content-Type', '')
+        if content_type.split(';')[0].strip() == SIMPLE_JSON:
+            page = response.json()
+            name = page.get('name', package)
+            files = [_file_entry(x['filename'], urljoin(base_url, x['url']),
+                                 x.get('yanked'),
+                                 x.get('core-metadata',
+                                       x.get('dist-info-metadata')))
+                     for x in page.get('files', [])]
+        else:
+            parser = _AnchorParser()
+            parser.feed(response.text)
+            files = []
+            for a in parser.anchors:
+                if not a.get('href'):
+                    continue
+                url = urljoin(base_url, a['href'])
+                files.append(_file_entry(
+                    urldefrag(url)[0].rsplit('/', 1)[-1], url,
+                    'data-yanked' in a,
+                    a.get('data-core-metadata',
+                          a.get('data-dist-info-metadata'))))
+
+        releases = {}
+        for f in files:
+            version = _version_from_filename(f['filename'], name)
+            if version is not None:
+                releases.setdefault(version, []).append(f)
+
+        latest = None
+        if releases:
+            final = [x for x in releases
+                     if not parse_version(x).is_prerelease]
+            latest = max(final or releases, key=parse_version)
+        return {'info': {'name': name, 'version': latest,
+                         'requires_dist': None},
+                'releases': releases}
+
+    @staticmethod
+    def get_requirements(package, version, files):
+        """
+        Requirements dict of package/version read from the PEP 658 metadata
+        file of one of its release files (wheels preferred).
+
+        :param list files: release files, as in parse_project_page
+        :rtype: dict
+        :return: requirements, or None if no metadata file is available.
+        """
+        with_metadata = sorted(
+            [x for x in files if x.get('core_metadata')],
+            key=lambda x: x.get('packagetype') != 'bdist_wheel')
+        for f in with_metadata:
+            url = f['url'] + '.metadata'
+            try:
+                r = FetchEngine.default().get(url)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                maglog.warn("Connection to {0} failed: {1}".format(url, e))
+                return None
+            if r.status_code != 200:
+                maglog.info("failed to download {0}".format(url))
+                continue
+
+            if not _hashes_match(r.content, f['core_metadata']):
+                maglog.warn("Hash mismatch for {0}; ignoring".format(url))
+                continue
+
+            meta = email.parser.Parser().parsestr(
+                r.content.decode('utf-8', 'replace'))
+            maglog.info("Requirements read from {0}".format(url))
+            return requirements_from_strings(
+                meta.get('Name') or package, version,
+                meta.get_all('Requires-Dist') or [])
+        return None
+
+
+def _file_entry(filename, url, yanked, core_metadata):
+    """Release file dict in the shape the PyPI JSON API uses."""
+    if filename.endswith('.whl'):
+        packagetype = 'bdist_wheel'
+    elif filename.endswith(SDIST_EXTENSIONS):
+        packagetype = 'sdist'
+    elif filename.endswith('.egg'):
+        packagetype = 'bdist_egg'
+    else:
+        packagetype = None
+
+    if isinstance(core_metadata, dict) or core_metadata in (None, False,
+                                                           True):
+        core_metadata = core_metadata or False
+    elif '=' in core_metadata:
+        # PEP 503 attribute: "true" or "<hash name>=<digest>"
+        hash_name, _, digest = core_metadata.partition('=')
+        core_metadata = {hash_name: digest}
+    else:
+        core_metadata = core_metadata.lower() == 'true'
+
+    return {'filename': filename, 'url': urldefrag(url)[0],
+            'packagetype': packagetype, 'yanked': bool(yanked),
+            'core_metadata': core_metadata}
+
+
+def _hashes_match(content, hashes):
+    """False if any hash in hashes that hashlib knows disagrees."""
+    if not isinstance(hashes, dict):
+        return True
+    for hash_name, digest in hashes.items():
+        try:
+            if hashlib.new(hash_name, content).hexdigest() != digest:
+                return False
+        except ValueError:  # unknown hash
+            continue
+    return True
+
+
+def _version_from_filename(filename, project_name):
+    """Version of a wheel, egg or sdist of project_name, or None."""
+    if filename.endswith(('.whl', '.egg')):
+        # {name}-{version}-...; name has no "-" in either format
+        parts = filename.rsplit('.', 1)[0].split('-')
+        return parts[1] if len(parts) > 1 else None
+
+    stems = [filename[:-len(x)] for x in SDIST_EXTENSIONS
+             if filename.endswith(x)]
+    if not stems:
+        return None
+    # {name}-{version}, where name itself may contain "-"
+    stem = stems[0]
+    wanted = canonical_name(project_name)
+    for i, c in enumerate(stem):
+        if c == '-' and canonical_name(stem[:i]) == wanted:
+            return stem[i + 1:] or None
+    return None
@@ -1,5 +1,10 @@
+from __future__ import print_function
+
 import os
 import errno
+import json
+import sys
+import shutil
 import subprocess
 import shlex
 from pkg_resources import resource_filename as pkg_res_resource_filename
@@ -10,6 +15,15 @@ class MagellanConfig(object):
     caching = True
     cache_dir = os.path.join(tmp_dir, 'cache')
     tmp_env_dir = "MagellanTmp"
+    workers = 4
+    http_timeout = 30  # seconds
+    cache_ttl = 24 * 60 * 60  # seconds before revalidating; < 0 never
+    negative_cache_ttl = 15 * 60  # seconds to remember failed lookups
+    memory_cache_bytes = 64 * 1024 * 1024  # in-process LRU over DepCache
+    cache_max_bytes = 512 * 1024 * 1024  # the store is pruned down to this
+    local_index = None  # list of wheelhouse dirs to use instead of PyPI
+    index_url = None  # simple API (PEP 503/691) index instead of PyPI JSON
+    output_format = 'text'  # or 'jsonl': one JSON record per line on stdout
     vexrc = pkg_res_resource_filename('magellan', 'data/tmpVexRC')
     vex_options = '--config {}'.format(vexrc)
 
@@ -22,9 +36,8 @@ class MagellanConfig(object):
     @staticmethod
     def tear_down_cache():
         """remove cache dir"""
-        # NB: mainly useful for debugging
-        cmd_to_run = "rm -r {0}".format(MagellanConfig.tmp_dir)
-        run_in_subprocess(cmd_to_run)
+        # NB: mainly useful for debugging; see "magellan cache clear"
+        shutil.rmtree(MagellanConfig.tmp_dir, ignore_errors=True)
 
 
 def run_in_subprocess(cmds):
@@ -55,6 +68,31 @@ def mkdir_p(path):
             raise
 
 
+def jsonl_output():
+    """True if reports should be written as JSON Lines records."""
+    return MagellanConfig.output_format == 'jsonl'
+
+
+def text_stream():
+    """Where human readable text goes: stderr when stdout carries JSON
+    Lines records, so the records stay parseable."""
+    return sys.stderr if jsonl_output() else sys.stdout
+
+
+def print_record(record_type, record, stream=None):
+    """
+    Write one JSON Lines record, {"type": record_type, ...record}, and flush
+    it so whatever reads the output sees it straight away.
+
+    :param str record_type: e.g. "outdated", "env_conflict"
+    :param dict record: JSON serialisable fields
+    """
+    stream = stream or sys.stdout
+    line = dict(record, type=record_type)
+    stream.write(json.dumps(line, sort_keys=True) + "\n")
+    stream.flush()
+
+
 def print_col(s, bg=None, fg=None, pretty=False, header=False):
     """Interface for pretty printing in colour"""
     if not (bg or fg):
@@ -83,6 +121,10 @@ def _print_col(s, bg, fg, pretty=False):
     """
     from colorclass import Color  # better at top?
 
+    if jsonl_output():
+        print(s, file=sys.stderr)
+        return
+
     # This looks dense because of escaping; essentially it's to get something
     # that looks like: {bgcolor}{fgcolor}#string_to_print#{/bgcolor}{/fgcolor}
     if pretty:
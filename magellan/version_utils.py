@@ -0,0 +1,267 @@
+"""
+Module containing VersionIndex and VersionIntervals classes.
+
+Releases of a package parsed once, sorted in PEP 440 order and grouped by
+(major, minor) release series, for the outdated and upgrade checks; and
+requirement specs compiled into sets of allowed version intervals that can
+be intersected and looked up by bisection.
+"""
+
+import logging
+import re
+from bisect import bisect_left, bisect_right
+
+from pkg_resources import parse_version
+
+# Logging:
+maglog = logging.getLogger("magellan_logger")
+
+_SERIES_RE = re.compile(r'^(?:\d+!)?(\d+)(?:\.(\d+))?')
+_RELEASE_RE = re.compile(r'^(\d+(?:\.\d+)*)')
+
+
+def release_series(version):
+    """(major, minor) of a version string, e.g. (1, 8) for "1.8.2rc1";
+    minor is 0 if absent and the result None if there is no release number.
+    """
+    m = _SERIES_RE.match(version.strip().lstrip('vV'))
+    if m is None:
+        return None
+    return int(m.group(1)), int(m.group(2) or 0)
+
+
+def _is_prerelease(parsed):
+    return getattr(parsed, 'is_prerelease', False)
+
+
+class VersionIndex(object):
+    """Sorted, pre-parsed releases of one package.
+
+    Pre-releases are indexed but only count as "latest" when a package has
+    nothing else, or when asked about a pre-release series.
+    """
+
+    def __init__(self, versions):
+        parsed = sorted((parse_version(x), x) for x in set(versions or ()))
+        self._keys = [x[0] for x in parsed]
+        self.versions = [x[1] for x in parsed]
+
+        self._series = {}  # (major, minor): ([parsed], [version])
+        for key, version in parsed:
+            series = self._series.setdefault(release_series(version),
+                                             ([], []))
+            series[0].append(key)
+            series[1].append(version)
+
+        finals = [x for x in parsed if not _is_prerelease(x[0])]
+        self._latest = (finals or parsed or [(None, None)])[-1]
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, version):
+        """True if version is one of the releases (PEP 440 equality)."""
+        key = parse_version(version)
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def latest(self):
+        """Latest final release (or pre-release if there are no finals)."""
+        return self._latest[1]
+
+    def latest_in_series(self, version):
+        """
+        Latest release with the same major.minor as version; pre-releases
+        only if version is one. None if there are none.
+        """
+        series = self._series.get(release_series(version))
+        if series is None:
+            return None
+        keys, versions = series
+        if _is_prerelease(parse_version(version)):
+            return versions[-1]
+        for key, v in zip(reversed(keys), reversed(versions)):
+            if not _is_prerelease(key):
+                return v
+        return None
+
+    def is_beyond_latest(self, version):
+        """True if version is later than latest()."""
+        return bool(self._keys) and parse_version(version) > self._latest[0]
+
+    def satisfying(self, intervals, prereleases=False):
+        """
+        Releases inside intervals, in order; pre-releases only if asked
+        for or if nothing else qualifies. One bisection per interval.
+
+        :param VersionIntervals intervals: allowed versions
+        :rtype: list
+        """
+        found = []
+        for lo, lo_inc, hi, hi_inc in intervals.intervals:
+            start = 0 if lo is None else (
+                bisect_left(self._keys, lo) if lo_inc
+                else bisect_right(self._keys, lo))
+            end = len(self._keys) if hi is None else (
+                bisect_right(self._keys, hi) if hi_inc
+                else bisect_left(self._keys, hi))
+            found.extend(zip(self._keys[start:end],
+                             self.versions[start:end]))
+        if not prereleases:
+            finals = [x for x in found if not _is_prerelease(x[0])]
+            found = finals or found
+        return [x[1] for x in found]
+
+
+class VersionIntervals(object):
+    """Union of disjoint version intervals, e.g. the versions allowed by
+    ">=1.4,!=1.5,<2" are [1.4, 1.5) and (1.5, 2).
+
+    Each interval is (low, low inclusive, high, high inclusive) with parsed
+    versions as bounds and None for unbounded. Ordering is plain PEP 440
+    ordering; pre-release exclusion is left to VersionIndex.satisfying.
+    """
+
+    def __init__(self, intervals=None):
+        if intervals is None:
+            intervals = [(None, False, None, False)]
+        self.intervals = intervals
+        first_unbounded = bool(intervals) and intervals[0][0] is None
+        self._offset = 1 if first_unbounded else 0
+        self._lows = [x[0] for x in intervals[self._offset:]]
+
+    @staticmethod
+    def from_specs(specs):
+        """
+        Intervals allowed by all of specs, [(op, version), ..] as in
+        requirements; specs that can't be parsed don't restrict.
+
+        :rtype: VersionIntervals
+        """
+        allowed = VersionIntervals()
+        for op, version in specs:
+            try:
+                spec_intervals = _spec_intervals(op, version)
+            except ValueError as e:
+                spec_intervals = None
+                maglog.debug("Ignoring spec {0}{1}: {2}"
+                             .format(op, version, e))
+            if spec_intervals is not None:
+                allowed = allowed.intersect(VersionIntervals(spec_intervals))
+        return allowed
+
+    def intersect(self, other):
+        """Versions allowed by both self and other."""
+        out = []
+        i = j = 0
+        a, b = self.intervals, other.intervals
+        while i < len(a) and j < len(b):
+            lo, lo_inc = _max_low(a[i][:2], b[j][:2])
+            hi, hi_inc = _min_high(a[i][2:], b[j][2:])
+            if not _is_empty(lo, lo_inc, hi, hi_inc):
+                out.append((lo, lo_inc, hi, hi_inc))
+            # step past whichever interval ends first
+            if _min_high(a[i][2:], b[j][2:]) == tuple(a[i][2:]):
+                i += 1
+            else:
+                j += 1
+        return VersionIntervals(out)
+
+    def is_empty(self):
+        return not self.intervals
+
+    def __contains__(self, version):
+        """True if version is allowed; a bisection over the intervals."""
+        if not self.intervals:
+            return False
+        key = parse_version(version)
+        i = bisect_right(self._lows, key) - 1 + self._offset
+        return any(_interval_contains(self.intervals[x], key)
+                   for x in (i, i - 1) if 0 <= x < len(self.intervals))
+
+    def __repr__(self):
+        return "<VersionIntervals {0}>".format(" | ".join(
+            "{0}{1}, {2}{3}".format('[' if lo_inc else '(',
+                                    '' if lo is None else lo,
+                                    '' if hi is None else hi,
+                                    ']' if hi_inc else ')')
+            for lo, lo_inc, hi, hi_inc in self.intervals) or "empty")
+
+
+def _prefix_interval(prefix):
+    """[prefix.dev0, next prefix.dev0): all versions "==prefix.*" allows."""
+    parts = _RELEASE_RE.match(prefix)
+    if parts is None:
+        raise ValueError("bad version prefix {0}".format(prefix))
+    release = [int(x) for x in parts.group(1).split('.')]
+    upper = release[:-1] + [release[-1] + 1]
+    return (parse_version(parts.group(1) + '.dev0'), True,
+            parse_version('.'.join(str(x) for x in upper) + '.dev0'), False)
+
+
+def _spec_intervals(op, version):
+    """Intervals allowed by one spec; ValueError if it can't be read."""
+    if version.endswith('.*') and op in ('==', '!='):
+        lo, lo_inc, hi, hi_inc = _prefix_interval(version[:-2])
+        if op == '==':
+            return [(lo, lo_inc, hi, hi_inc)]
+        return [(None, False, lo, False), (hi, True, None, False)]
+
+    v = parse_version(version)
+    if op in ('==', '==='):
+        return [(v, True, v, True)]
+    if op == '!=':
+        return [(None, False, v, False), (v, False, None, False)]
+    if op == '>=':
+        return [(v, True, None, False)]
+    if op == '>':
+        return [(v, False, None, False)]
+    if op == '<=':
+        return [(None, False, v, True)]
+    if op == '<':
+        return [(None, False, v, False)]
+    if op == '~=':
+        release = _RELEASE_RE.match(version)
+        if release is None or '.' not in release.group(1):
+            raise ValueError("~= needs at least two release numbers")
+        prefix = release.group(1).rsplit('.', 1)[0]
+        lo, lo_inc, hi, hi_inc = _prefix_interval(prefix)
+        return [(v, True, hi, hi_inc)]
+    raise ValueError("unknown operator {0}".format(op))
+
+
+def _max_low(a, b):
+    """Higher of two (low, inclusive) bounds; None is unbounded."""
+    if a[0] is None:
+        return tuple(b)
+    if b[0] is None or a[0] > b[0]:
+        return tuple(a)
+    if b[0] > a[0]:
+        return tuple(b)
+    return a[0], a[1] and b[1]
+
+
+def _min_high(a, b):
+    """Lower of two (high, inclusive) bounds; None is unbounded."""
+    if a[0] is None:
+        return tuple(b)
+    if b[0] is None or a[0] < b[0]:
+        return tuple(a)
+    if b[0] < a[0]:
+        return tuple(b)
+    return a[0], a[1] and b[1]
+
+
+def _is_empty(lo, lo_inc, hi, hi_inc):
+    if lo is None or hi is None:
+        return False
+    return lo > hi or (lo == hi and not (lo_inc and hi_inc))
+
+
+def _interval_contains(interval, key):
+    lo, lo_inc, hi, hi_inc = interval
+    if lo is not None and (key < lo or (key == lo and not lo_inc)):
+        return False
+    if hi is not None and (key > hi or (key == hi and not hi_inc)):
+        return False
+    return True
@@ -0,0 +1,363 @@
+"""
+Test suite for the cache_utils module.
+
+Tests are for the DepCache SQLite store.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+from magellan.cache_utils import DepCache, SCHEMA_VERSION, _MemoryLRU
+
+
+class TestDepCacheClass(unittest.TestCase):
+    """Base class for testing boilerplate."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.store = DepCache(self.cache_dir)
+        self.django_json = {
+            'info': {'name': 'Django', 'version': '1.8.2'},
+            'releases': {
+                '1.6.8': [{'filename': 'Django-1.6.8.tar.gz',
+                           'packagetype': 'sdist', 'yanked': False}],
+                '1.8.2': [{'filename': 'Django-1.8.2.tar.gz',
+                           'packagetype': 'sdist', 'yanked': False}],
+                '1.8.1': [{'filename': 'Django-1.8.1.tar.gz',
+                           'packagetype': 'sdist', 'yanked': True}],
+            }}
+        self.fab_reqs = {'project_name': 'fabtools', 'version': '0.19.0',
+                         'requires': {'fabric': {
+                             'project_name': 'fabric', 'key': 'fabric',
+                             'specs': [['>=', '1.7.0']]}}}
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.cache_dir)
+
+
+class TestPackages(TestDepCacheClass):
+    """PyPI package documents."""
+
+    def test_round_trip(self):
+        self.store.put_package('Django', self.django_json)
+        self.assertEqual(self.store.get_package('Django'), self.django_json)
+
+    def test_lookups_are_case_insensitive(self):
+        self.store.put_package('Django', self.django_json)
+        self.assertEqual(self.store.get_package('django')['info']['name'],
+                         'Django')
+
+    def test_unknown_package(self):
+        self.assertEqual(self.store.get_package('Django'), None)
+        self.assertEqual(self.store.release_versions('Django'), None)
+        self.assertEqual(self.store.has_release('Django', '1.6.8'), None)
+
+    def test_release_lookups(self):
+        self.store.put_package('Django', self.django_json)
+        self.assertEqual(sorted(self.store.release_versions('Django')),
+                         ['1.6.8', '1.8.1', '1.8.2'])
+        self.assertTrue(self.store.has_release('Django', '1.6.8'))
+        self.assertFalse(self.store.has_release('Django', '0.0.1'))
+
+    def test_replace_drops_old_releases(self):
+        self.store.put_package('Django', self.django_json)
+        self.store.put_package('Django', {'info': {}, 'releases': {
+            '2.0': []}})
+        self.assertEqual(self.store.release_versions('Django'), ['2.0'])
+
+    def test_stores_slim_projection(self):
+        self.django_json['info']['description'] = 'x' * 100000
+        self.django_json['info']['requires_dist'] = None
+        self.django_json['releases']['1.8.2'][0]['digests'] = {'md5': 'x'}
+        self.store.put_package('Django', self.django_json)
+
+        doc = self.store.get_package('Django')
+        self.assertEqual(doc['info'], {'name': 'Django', 'version': '1.8.2',
+                                       'requires_dist': None})
+        self.assertEqual(doc['releases']['1.8.2'], [
+            {'filename': 'Django-1.8.2.tar.gz', 'packagetype': 'sdist',
+             'yanked': False}])
+        self.assertTrue(self.store.stats()['packages']['bytes'] < 1000)
+
+    def test_bulk(self):
+        self.store.put_package('Django', self.django_json)
+        self.store.put_package('six', {'info': {}, 'releases': {'1.9': []}})
+        res = self.store.get_packages_bulk(['Django', 'six', 'missing'])
+        self.assertEqual(sorted(res), ['Django', 'six'])
+
+    def test_bulk_ignores_releases_without_package_row(self):
+        # e.g. written by another process after the packages were read
+        self.store.conn.execute(
+            "INSERT INTO releases (package, version, files) "
+            "VALUES ('ghost', '1.0', '[]')")
+        self.assertEqual(self.store.get_packages_bulk(['ghost']), {})
+
+
+class TestFreshness(TestDepCacheClass):
+    """Validators and TTL of cached documents."""
+
+    def test_validators_and_ttl(self):
+        self.assertFalse(self.store.is_fresh('Django', 60))
+        self.store.put_package('Django', self.django_json,
+                               etag='"abc"', last_modified='Mon')
+        self.assertEqual(self.store.get_validators('django'), ('"abc"', 'Mon'))
+        self.assertTrue(self.store.is_fresh('Django', 60))
+        self.assertFalse(self.store.is_fresh('Django', 0))
+        self.assertTrue(self.store.is_fresh('Django', -1))
+
+    def test_touch(self):
+        self.store.put_package('Django', self.django_json)
+        self.store.conn.execute("UPDATE packages SET fetched_at = 0")
+        self.assertFalse(self.store.is_fresh('Django', 60))
+        self.store.touch_package('Django')
+        self.assertTrue(self.store.is_fresh('Django', 60))
+
+    def test_negative_entries(self):
+        self.assertFalse(self.store.is_known_missing('internal', 60))
+        self.store.put_miss('internal', status=404)
+        self.assertTrue(self.store.is_known_missing('Internal', 60))
+        self.assertFalse(self.store.is_known_missing('internal', 0))
+
+        # a later successful fetch replaces the miss
+        self.store.put_package('internal', self.django_json)
+        self.assertFalse(self.store.is_known_missing('internal', 60))
+
+    def test_miss_keeps_validators(self):
+        self.store.put_package('Django', self.django_json,
+                               etag='"abc"', last_modified='Mon')
+        self.store.put_miss('Django', status=503)
+        self.assertEqual(self.store.get_validators('django'), ('"abc"', 'Mon'))
+        self.assertFalse(self.store.is_known_missing('Django', 60))
+
+    def test_migrate_v2_store(self):
+        self.store.put_package('fabric', {'info': {}, 'releases': {}})
+        self.store.close()
+        conn = sqlite3.connect(os.path.join(self.cache_dir, DepCache.db_name))
+        conn.execute("DROP TABLE fetch_meta")
+        conn.execute("CREATE TABLE fetch_meta (package TEXT PRIMARY KEY, "
+                     "url TEXT, status INTEGER, bytes INTEGER, "
+                     "fetched_at REAL NOT NULL)")
+        conn.execute("UPDATE packages SET info = ?",
+                     (json.dumps({'name': 'fab', 'description': 'long'}),))
+        conn.execute("PRAGMA user_version = 2")
+        conn.commit()
+        conn.close()
+
+        store = DepCache(self.cache_dir)
+        store.put_package('Django', self.django_json, etag='"abc"')
+        self.assertEqual(store.conn.execute(
+            "PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+        self.assertEqual(store.get_package('fabric')['info'], {'name': 'fab'})
+        self.assertEqual(store.get_validators('Django'), ('"abc"', None))
+        store.close()
+
+
+class TestMemoryLayer(TestDepCacheClass):
+    """In-process LRU in front of SQLite."""
+
+    def test_repeat_lookups_hit_memory(self):
+        self.store.put_package('Django', self.django_json)
+        first = self.store.get_package('Django')
+        with patch.object(DepCache, 'conn') as conn:
+            self.assertIs(self.store.get_package('django'), first)
+            self.assertTrue(self.store.has_release('Django', '1.8.2'))
+            self.assertEqual(sorted(self.store.release_versions('Django')),
+                             ['1.6.8', '1.8.1', '1.8.2'])
+            self.assertTrue(self.store.is_fresh('Django', 60))
+            self.assertFalse(conn.execute.called)
+        self.assertEqual(self.store.stats()['memory']['hits'], 1)
+
+    def test_writes_invalidate(self):
+        self.store.put_package('Django', self.django_json)
+        self.store.get_package('Django')
+        self.django_json['releases']['1.9'] = []
+        self.store.put_package('Django', self.django_json)
+        self.assertIn('1.9', self.store.get_package('Django')['releases'])
+
+        self.store.clear()
+        self.assertIsNone(self.store.get_package('Django'))
+
+    def test_size_aware_eviction(self):
+        lru = _MemoryLRU(100)
+        lru.put('a', 1, 40)
+        lru.put('b', 2, 40)
+        lru.get('a')
+        lru.put('c', 3, 40)  # evicts b, the least recently used
+        self.assertEqual((lru.peek('a'), lru.peek('b'), lru.peek('c')),
+                         (1, None, 3))
+        self.assertEqual(lru.n_bytes, 80)
+        lru.put('d', 4, 1000)  # bigger than the whole budget
+        self.assertIsNone(lru.peek('d'))
+
+
+class TestRequirements(TestDepCacheClass):
+    """Per-version requirements."""
+
+    def test_round_trip(self):
+        self.store.put_requirements('fabtools', '0.19.0', self.fab_reqs)
+        self.assertEqual(
+            self.store.get_requirements('fabtools', '0.19.0'), self.fab_reqs)
+        self.assertEqual(
+            self.store.get_requirements('fabtools', '0.18.0'), None)
+
+    def test_bulk(self):
+        self.store.put_requirements('fabtools', '0.19.0', self.fab_reqs)
+        self.store.put_requirements('Fabric', '1.7.0', {'requires': {}})
+        res = self.store.get_requirements_bulk(
+            [('fabtools', '0.19.0'), ('fabric', '1.7.0'), ('x', '1')])
+        self.assertEqual(sorted(res),
+                         [('fabric', '1.7.0'), ('fabtools', '0.19.0')])
+
+    def test_concurrent_writers(self):
+        """Writes from several threads all land."""
+        def writer(i):
+            for j in range(20):
+                self.store.put_requirements(
+                    'p{0}'.format(i), str(j), {'requires': {}})
+
+        threads = [threading.Thread(target=writer, args=(i,))
+                   for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        pairs = [('p{0}'.format(i), str(j))
+                 for i in range(4) for j in range(20)]
+        self.assertEqual(len(self.store.get_requirements_bulk(pairs)), 80)
+
+
+class TestHousekeeping(TestDepCacheClass):
+    """Migration, stats and integrity."""
+
+    def test_migrate_legacy_files(self):
+        with open(os.path.join(self.cache_dir, 'Django.json'), 'w') as f:
+            json.dump(self.django_json, f)
+        with open(os.path.join(self.cache_dir,
+                               'fabtools_0_19_0_req.json'), 'w') as f:
+            json.dump(self.fab_reqs, f)
+
+        self.assertEqual(self.store.migrate_from_dir(self.cache_dir), 2)
+        self.assertEqual(self.store.get_package('Django'), self.django_json)
+        self.assertEqual(
+            self.store.get_requirements('fabtools', '0.19.0'), self.fab_reqs)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.cache_dir, 'Django.json')))
+
+    def test_stats(self):
+        self.store.put_package('Django', self.django_json)
+        self.store.put_requirements('fabtools', '0.19.0', self.fab_reqs)
+        stats = self.store.stats()
+        self.assertEqual(stats['packages']['entries'], 1)
+        self.assertEqual(stats['releases']['entries'], 3)
+        self.assertEqual(stats['requirements']['entries'], 1)
+        self.assertTrue(stats['requirements']['bytes'] > 0)
+        self.assertTrue(stats['file_bytes'] > 0)
+
+    def test_integrity_and_clear(self):
+        self.store.put_package('Django', self.django_json)
+        self.assertTrue(self.store.check_integrity())
+        self.store.clear()
+        self.assertEqual(self.store.get_package('Django'), None)
+
+    def test_counters(self):
+        self.store.add_counters({'cache': 3, 'downloaded': 1})
+        self.store.add_counters({'cache': 2})
+        self.assertEqual(self.store.get_counters(),
+                         {'cache': 5, 'downloaded': 1})
+
+    def test_prune_evicts_least_recently_accessed(self):
+        pip_cache = os.path.join(self.cache_dir, 'http', 'a')
+        os.makedirs(pip_cache)
+        with open(os.path.join(pip_cache, 'blob'), 'wb') as f:
+            f.write(b'x' * 5000)
+        os.utime(os.path.join(pip_cache, 'blob'), (1, 1))  # long ago
+
+        self.store.put_package('Django', self.django_json)
+        self.store.put_package('fabric', {'info': {}, 'releases': {}})
+        self.store.put_requirements('fabtools', '0.19.0', self.fab_reqs)
+        self.store.conn.execute("UPDATE packages SET accessed_at = 10 "
+                                "WHERE package = 'django'")
+
+        # under budget: nothing goes
+        self.assertEqual(self.store.prune(10 ** 9)['entries'], 0)
+
+        # just over budget: the old file and Django go, the rest stay
+        size = self.store._store_bytes() + 5000
+        pruned = self.store.prune(size - 5001)
+        self.assertEqual((pruned['files'], pruned['entries']), (1, 1))
+        self.assertIsNone(self.store.get_package('Django'))
+        self.assertIsNotNone(self.store.get_package('fabric'))
+        self.assertIsNotNone(
+            self.store.get_requirements('fabtools', '0.19.0'))
+
+        pruned = self.store.prune(0)
+        self.assertEqual(pruned['entries'], 2)
+
+    def test_prune_rows_only_leaves_files(self):
+        blob = os.path.join(self.cache_dir, 'http', 'blob')
+        os.makedirs(os.path.dirname(blob))
+        with open(blob, 'wb') as f:
+            f.write(b'x' * 5000)
+        os.utime(blob, (1, 1))
+        self.store.put_package('Django', self.django_json)
+
+        self.assertEqual(self.store.prune(10 ** 9, files=False)['entries'], 0)
+        pruned = self.store.prune(0, files=False)
+        self.assertEqual((pruned['files'], pruned['entries']), (0, 1))
+        self.assertTrue(os.path.exists(blob))
+        self.assertIsNone(self.store.get_package('Django'))
+
+    def test_prune_compacts_only_after_bulk_eviction(self):
+        for i in range(20):
+            self.store.put_requirements('pkg{0}'.format(i), '1.0',
+                                        self.fab_reqs)
+        with patch.object(DepCache, '_compact') as compact:
+            self.store.prune(self.store._store_bytes() - 1)
+        self.assertFalse(compact.called)
+        with patch.object(DepCache, '_compact') as compact:
+            self.store.prune(0)
+        self.assertTrue(compact.called)
+
+    def test_clear_files(self):
+        os.makedirs(os.path.join(self.cache_dir, 'sdists'))
+        with open(os.path.join(self.cache_dir, 'sdists', 'x.tar.gz'),
+                  'w') as f:
+            f.write('x')
+        self.store.put_package('Django', self.django_json)
+        self.store.clear(files=True)
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir,
+                                                     'sdists')))
+        self.assertTrue(os.path.exists(self.store.path))
+        self.assertIsNone(self.store.get_package('Django'))
+
+    def test_clear_files_tolerates_unremovable_files(self):
+        with open(os.path.join(self.cache_dir, 'x.tar.gz'), 'w') as f:
+            f.write('x')
+        with patch('magellan.cache_utils.os.remove',
+                   side_effect=OSError("gone")):
+            self.store.clear(files=True)
+        self.assertIsNone(self.store.get_package('Django'))
+
+    def test_corrupt_store_is_replaced(self):
+        self.store.close()
+        with open(self.store.path, 'w') as f:
+            f.write("this is not a database" * 100)
+        with open(self.store.path + '-wal', 'w') as f:
+            f.write("stale")
+        store = DepCache(self.cache_dir)
+        self.assertEqual(store.get_package('Django'), None)
+        self.assertTrue(os.path.exists(self.store.path + '-wal.corrupt'))
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
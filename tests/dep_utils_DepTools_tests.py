@@ -17,15 +17,26 @@ REQUIRED VERSIONS:
 
 ANCESTOR DEPENDENCIES:
 - check_if_ancestors_still_satisfied
+
+ACQUISITION:
+- acquire_deps_for_package_versions
+- get_deps_for_package_version (metadata provider chain)
+- prefetch
 """
 
 import unittest
 import pickle
 import json
-from mock import MagicMock
-
-from magellan.deps_utils import DepTools
+import shutil
+import tempfile
+from mock import MagicMock, patch
+
+from magellan.cache_utils import DepCache
+from magellan.deps_utils import (DepTools, PyPIHelper, METADATA_PROVIDERS,
+                                 _candidate_versions)
+from magellan.version_utils import VersionIndex
 from magellan.package_utils import Package
+from magellan.utils import MagellanConfig
 
 
 class TestPackageClass(unittest.TestCase):
@@ -634,3 +645,221 @@ class TestAncestorContrivedExamples(unittest.TestCase):
             package, version, ancestors, self.package_requirements)
 
         self.assertIn('z', res['conflicts'])
+
+
+class TestAcquireDepsConcurrently(unittest.TestCase):
+    """
+    Testing the concurrent dependency acquisition scheduler with PyPI and
+    the temporary env installs mocked out.
+    """
+
+    def setUp(self):
+        self.env_names = []
+
+        def fake_get_deps(package, version, vex_options=None,
+                          tmp_env_name=None):
+            self.env_names.append(tmp_env_name)
+            return {'project_name': package, 'version': version,
+                    'requires': {}}
+
+        patchers = [
+            patch('magellan.deps_utils.PyPIHelper.'
+                  'check_package_version_on_pypi',
+                  side_effect=lambda p, v: p != 'missing'),
+            patch('magellan.deps_utils.DepTools.get_deps_without_install',
+                  return_value=None),
+            patch('magellan.deps_utils.DepTools.'
+                  'install_and_get_deps_for_package_version',
+                  side_effect=fake_get_deps),
+            patch('magellan.deps_utils.Environment.vex_remove_virtual_env'),
+        ]
+        self.mocks = [x.start() for x in patchers]
+        for x in patchers:
+            self.addCleanup(x.stop)
+        self.patchers = patchers
+
+    def test_all_targets_returned_once(self):
+        """Duplicates are dropped and every target comes back."""
+        targets = [('A', '1.0'), ('B', '2.0'), ('A', '1.0'), ('C', '3.0')]
+        res = dict(DepTools.acquire_deps_for_package_versions(
+            targets, workers=2))
+        self.assertEqual(set(res), {('A', '1.0'), ('B', '2.0'), ('C', '3.0')})
+        self.assertEqual(res[('B', '2.0')]['version'], '2.0')
+
+    def test_missing_package_is_none(self):
+        """Packages not on PyPI come back as None, not installed."""
+        res = dict(DepTools.acquire_deps_for_package_versions(
+            [('missing', '1.0')], workers=2))
+        self.assertEqual(res, {('missing', '1.0'): None})
+        self.assertEqual(self.env_names, [])
+
+    def test_worker_envs_are_isolated_and_removed(self):
+        """Installs use per-worker temp envs which are removed after."""
+        targets = [('P{}'.format(i), '1.0') for i in range(6)]
+        list(DepTools.acquire_deps_for_package_versions(targets, workers=3))
+
+        used = set(self.env_names)
+        self.assertTrue(1 <= len(used) <= 3)
+        self.assertNotIn('MagellanTmp', used)
+
+        removed = set(x[0][0] for x in self.mocks[-1].call_args_list)
+        self.assertEqual(removed, used)
+
+    def test_providers_asked_once_before_install(self):
+        """Versions that need installing don't go through the providers
+        a second time."""
+        self.patchers[1].stop()  # the real get_deps_without_install
+        self.addCleanup(self.patchers[1].start)
+        providers = [patch.object(DepTools, name, return_value=None)
+                     for _, name in METADATA_PROVIDERS]
+        calls = [x.start() for x in providers]
+        for x in providers:
+            self.addCleanup(x.stop)
+
+        targets = [('A', '1.0'), ('B', '2.0')]
+        with patch('magellan.deps_utils.DepCache.default') as store:
+            store.return_value.get_requirements_bulk.return_value = {}
+            res = dict(DepTools.acquire_deps_for_package_versions(
+                targets, workers=2))
+
+        self.assertEqual(res[('A', '1.0')]['source'], 'install')
+        for provider in calls:
+            self.assertEqual(sorted(x[0] for x in provider.call_args_list),
+                             targets)
+        self.assertEqual(len(self.env_names), 2)
+
+
+class TestMetadataProviderChain(unittest.TestCase):
+    """
+    The requirements provider chain should answer from PyPI JSON before
+    resorting to sdists or installation, and say which source answered.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+        self.package_json = {'info': {'name': 'Foo', 'version': '2.0',
+                                      'requires_dist': ['bar>=1.0']}}
+        patchers = [
+            patch('magellan.deps_utils.MagellanConfig.cache_dir',
+                  self.cache_dir),
+            patch('magellan.deps_utils.PyPIHelper.acquire_package_json_info',
+                  return_value=self.package_json),
+            patch('magellan.deps_utils.PyPIHelper.'
+                  'acquire_package_version_json_info',
+                  return_value={'info': {'name': 'Foo', 'version': '1.0',
+                                         'requires_dist': None}}),
+            patch('magellan.deps_utils.DepTools.get_deps_from_sdist',
+                  return_value=None),
+            patch('magellan.deps_utils.DepTools.'
+                  'install_and_get_deps_for_package_version',
+                  return_value={'project_name': 'Foo', 'version': '1.0',
+                                'requires': {}}),
+        ]
+        self.mocks = [x.start() for x in patchers]
+        for x in patchers:
+            self.addCleanup(x.stop)
+
+    def test_requires_dist_of_latest_version(self):
+        """Latest version answered from the package JSON, then cached."""
+        res = DepTools.get_deps_for_package_version('Foo', '2.0')
+        self.assertEqual(res['source'], 'pypi-json')
+        self.assertEqual(res['requires']['bar']['specs'], [('>=', '1.0')])
+        self.assertFalse(self.mocks[-1].called)
+
+        res = DepTools.get_deps_for_package_version('Foo', '2.0')
+        self.assertEqual(res['source'], 'cache')
+        self.assertEqual(res['requires']['bar']['specs'], [['>=', '1.0']])
+
+    def test_null_requires_dist_falls_back_to_install(self):
+        """No requires_dist for older version; install path is used."""
+        res = DepTools.get_deps_for_package_version('Foo', '1.0')
+        self.assertEqual(res['source'], 'install')
+        self.assertTrue(self.mocks[-1].called)
+
+
+class TestPrefetch(unittest.TestCase):
+    """Cache warm-up for a set of packages and candidate versions."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.store = DepCache.default(self.cache_dir)
+        self.store.put_package('cached', {'info': {}, 'releases': {
+            '1.0': [], '1.1': []}})
+        self.store.put_requirements('cached', '1.1', {'requires': {}})
+
+        self.docs = {'fresh': {'info': {}, 'releases': {
+            '1.0': [], '1.0.1': [], '2.0': [], '3.0a1': []}}}
+
+        def fake_acquire(package, localcache=None):
+            doc = self.docs.get(package, {})
+            if doc:
+                self.store.put_package(package, doc)
+            return doc
+
+        patchers = [
+            patch('magellan.deps_utils.MagellanConfig.cache_dir',
+                  self.cache_dir),
+            patch('magellan.deps_utils.PyPIHelper.acquire_package_json_info',
+                  side_effect=fake_acquire),
+            patch('magellan.deps_utils.DepTools.get_deps_without_install',
+                  return_value={'requires': {}}),
+        ]
+        self.mocks = [x.start() for x in patchers]
+        for x in patchers:
+            self.addCleanup(x.stop)
+        PyPIHelper._version_indexes.clear()
+
+    def test_candidate_versions(self):
+        versions = VersionIndex(['1.0', '1.0.1', '1.1', '2.0', '3.0a1'])
+        self.assertEqual(_candidate_versions('1.0', versions),
+                         ['2.0', '1.0', '1.0.1'])
+        self.assertEqual(_candidate_versions(None, versions), ['2.0'])
+        self.assertEqual(_candidate_versions('1.0', VersionIndex([])), [])
+
+    def test_hits_and_misses(self):
+        res = DepTools.prefetch(
+            [('cached', None), ('fresh', '1.0'), ('missing', '1.0')],
+            workers=2)
+        self.assertEqual(res['documents'], {
+            'hits': 1, 'misses': 2, 'not_found': ['missing']})
+        # cached 1.1 (hit); fresh 2.0, 1.0 and 1.0.1 (misses)
+        self.assertEqual(res['dependencies']['hits'], 1)
+        self.assertEqual(res['dependencies']['misses'], 3)
+        self.assertEqual(res['dependencies']['failed'], [])
+        self.assertEqual(self.mocks[2].call_count, 3)
+
+
+class TestEnvConflictsJsonLines(unittest.TestCase):
+    """-C --format jsonl writes each conflict as a record, no table."""
+
+    def setUp(self):
+        self.config = MagellanConfig
+        self.config.output_format = 'jsonl'
+
+    def tearDown(self):
+        self.config.output_format = 'text'
+
+    def test_records_written_instead_of_table(self):
+        nodes = [('foo', '1.0'), ('bar', '0.9')]
+        package_requirements = {
+            'foo': {'requires': {'bar': {'project_name': 'bar',
+                                         'specs': [('>=', '1.0')]}}},
+            'bar': {'requires': {}},
+        }
+        written = []
+        with patch('magellan.utils.sys.stdout') as stdout, \
+                patch.object(DepTools, 'table_print_cur_env_conflicts') \
+                as table:
+            stdout.write.side_effect = written.append
+            conflicts = DepTools.highlight_conflicts_in_current_env(
+                nodes, package_requirements)
+
+        self.assertEqual(len(conflicts), 1)
+        self.assertFalse(table.called)
+        self.assertEqual([json.loads(x) for x in written], [{
+            'type': 'env_conflict', 'package': 'foo', 'version': '1.0',
+            'dependency': 'bar', 'current_version': '0.9', 'op': '>=',
+            'required': '1.0', 'satisfied': False}])
@@ -0,0 +1,98 @@
+"""
+Test suite for the diff_utils module.
+
+Tests are for EnvDiff: differences between two environments.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.diff_utils import EnvDiff
+from magellan.env_utils import Environment
+from magellan.utils import MagellanConfig
+
+
+def make_env(name, nodes, requires):
+    """Environment as interrogation would load it (JSON lists)."""
+    edges = [[['root', '0.0.0'], list(n)] for n in nodes]
+    versions = {n[0].lower(): n[1] for n in nodes}
+    package_requirements = {}
+    for n in nodes:
+        package_requirements[n[0].lower()] = {
+            'project_name': n[0], 'version': n[1], 'requires': {}}
+        for dep, specs in requires.get(n[0], {}).items():
+            edges.append([list(n), [dep, versions.get(dep, '')],
+                          [list(x) for x in specs]])
+            package_requirements[n[0].lower()]['requires'][dep] = {
+                'project_name': dep, 'specs': specs}
+    venv = Environment(name)
+    venv.load_graph([list(n) for n in nodes], edges, package_requirements)
+    return venv
+
+
+class TestEnvDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.prod = make_env('prod', [('Django', '1.8'), ('six', '1.9'),
+                                      ('celery', '3.1')],
+                             {'celery': {'kombu': [('>=', '3.0')]},
+                              'Django': {'six': []}})
+        self.staging = make_env('staging', [('Django', '1.9'),
+                                            ('six', '1.9'), ('kombu', '3.0')],
+                                {'Django': {'six': [('>=', '1.9')]},
+                                 'kombu': {'amqp': []}})
+
+    def test_diff(self):
+        diff = EnvDiff.diff(self.prod, self.staging)
+        self.assertEqual(diff['removed'], [('celery', '3.1')])
+        self.assertEqual(diff['added'], [('kombu', '3.0')])
+        self.assertEqual(diff['changed'], [('Django', '1.8', '1.9')])
+        self.assertEqual(diff['edges_removed'],
+                         [('celery', 'kombu', [('>=', '3.0')])])
+        self.assertEqual(diff['edges_added'], [('kombu', 'amqp', [])])
+        self.assertEqual(diff['edges_changed'],
+                         [('django', 'six', [], [('>=', '1.9')])])
+
+        self.assertEqual(EnvDiff.diff(self.prod, self.prod), {
+            k: [] for k in diff})
+
+    def test_jsonl_records(self):
+        written = []
+        MagellanConfig.output_format = 'jsonl'
+        self.addCleanup(setattr, MagellanConfig, 'output_format', 'text')
+        with patch('magellan.utils.sys.stdout') as stdout:
+            stdout.write.side_effect = written.append
+            EnvDiff.print_diff(EnvDiff.diff(self.prod, self.staging),
+                               'prod', 'staging')
+        records = [json.loads(x) for x in written]
+        self.assertEqual(sorted(x['change'] for x in records), [
+            'added', 'changed', 'edge_added', 'edge_changed', 'edge_removed',
+            'removed'])
+        self.assertEqual(records[0], {
+            'type': 'env_diff', 'old': 'prod', 'new': 'staging',
+            'change': 'removed', 'package': 'celery', 'old_version': '3.1'})
+
+    def test_env_files_snapshot(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.assertFalse(Environment.has_env_files(tmp))
+        for fn, data in (('nodes.json', self.prod.nodes),
+                         ('edges.json', self.prod.edges),
+                         ('package_requirements.json',
+                          self.prod.package_requirements)):
+            with open(os.path.join(tmp, fn), 'w') as f:
+                json.dump(data, f)
+        self.assertTrue(Environment.has_env_files(tmp))
+
+        loaded = Environment.from_env_files(tmp)
+        self.assertEqual(sorted(loaded.all_packages),
+                         ['celery', 'django', 'six'])
+        self.assertEqual(EnvDiff.diff(self.prod, loaded)['changed'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Test suite for the fetch_utils module.
+
+Tests are for FetchEngine and the bulk PyPI document API built on it.
+"""
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from mock import MagicMock, patch
+
+import requests
+
+from magellan.cache_utils import DepCache
+from magellan.deps_utils import PyPIHelper
+from magellan.fetch_utils import FetchEngine
+from magellan.package_utils import Package
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Concurrent calls for the same key share one call."""
+
+    def test_concurrent_calls_merged(self):
+        engine = FetchEngine(workers=4)
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            engine.single_flight('key', slow))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 4)
+
+    def test_errors_shared_and_not_cached(self):
+        engine = FetchEngine(workers=2)
+
+        def boom():
+            raise ValueError("boom")
+
+        self.assertRaises(ValueError, engine.single_flight, 'key', boom)
+        self.assertEqual(engine.single_flight('key', lambda: 1), 1)
+
+    def test_get_uses_shared_session(self):
+        engine = FetchEngine(workers=2)
+        engine.session = MagicMock()
+        engine.get('https://example.com/a')
+        engine.get('https://example.com/b')
+        self.assertEqual(engine.session.get.call_count, 2)
+
+    def test_imap_keeps_order(self):
+        engine = FetchEngine(workers=3)
+        self.assertEqual(list(engine.imap(lambda x: x * 2, range(10))),
+                         [x * 2 for x in range(10)])
+
+
+class TestBulkAcquire(unittest.TestCase):
+    """PyPIHelper.acquire_package_json_info_bulk"""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        DepCache.default(self.cache_dir).put_package(
+            'cached', {'info': {}, 'releases': {'1.0': []}})
+
+        def fake_get(url, **kwargs):
+            r = MagicMock()
+            r.headers = {}
+            if 'missing' in url:
+                r.status_code = 404
+            else:
+                r.status_code = 200
+                r.content = b'{}'
+                r.json.return_value = {'info': {}, 'releases': {'2.0': []}}
+            return r
+
+        self.engine = FetchEngine(workers=2)
+        self.engine.session = MagicMock()
+        self.engine.session.get.side_effect = fake_get
+
+        patchers = [
+            patch('magellan.deps_utils.MagellanConfig.cache_dir',
+                  self.cache_dir),
+            patch('magellan.deps_utils.FetchEngine.default',
+                  return_value=self.engine),
+        ]
+        for x in patchers:
+            x.start()
+            self.addCleanup(x.stop)
+
+    def test_bulk(self):
+        res = PyPIHelper.acquire_package_json_info_bulk(
+            ['cached', 'fresh', 'missing'])
+        self.assertEqual(list(res['cached']['releases']), ['1.0'])
+        self.assertEqual(list(res['fresh']['releases']), ['2.0'])
+        self.assertEqual(res['missing'], {})
+        self.assertEqual(self.engine.session.get.call_count, 2)
+
+        # now cached
+        PyPIHelper.acquire_package_json_info_bulk(['fresh'])
+        self.assertEqual(self.engine.session.get.call_count, 2)
+
+
+class TestRevalidation(unittest.TestCase):
+    """Expired documents are revalidated with conditional requests."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.store = DepCache.default(self.cache_dir)
+        self.store.put_package('pkg', {'info': {}, 'releases': {'1.0': []}},
+                               etag='"v1"')
+        PyPIHelper._version_indexes.clear()
+
+        self.engine = FetchEngine(workers=2)
+        self.engine.session = MagicMock()
+
+        patchers = [
+            patch('magellan.deps_utils.MagellanConfig.cache_dir',
+                  self.cache_dir),
+            patch('magellan.deps_utils.MagellanConfig.cache_ttl', 60),
+            patch('magellan.deps_utils.FetchEngine.default',
+                  return_value=self.engine),
+        ]
+        for x in patchers:
+            x.start()
+            self.addCleanup(x.stop)
+
+    def expire(self):
+        self.store.conn.execute("UPDATE packages SET fetched_at = 0")
+
+    def test_fresh_entry_not_fetched(self):
+        PyPIHelper.acquire_package_json_info('pkg')
+        self.assertFalse(self.engine.session.get.called)
+
+    def test_not_modified(self):
+        self.expire()
+        self.engine.session.get.return_value = MagicMock(status_code=304)
+        res = PyPIHelper.acquire_package_json_info('pkg')
+        self.assertEqual(list(res['releases']), ['1.0'])
+        headers = self.engine.session.get.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertTrue(self.store.is_fresh('pkg', 60))
+
+    def test_modified(self):
+        self.expire()
+        r = MagicMock(status_code=200, content=b'{}',
+                      headers={'ETag': '"v2"'})
+        r.json.return_value = {'info': {}, 'releases': {'2.0': []}}
+        self.engine.session.get.return_value = r
+        self.assertEqual(PyPIHelper.all_package_versions_on_pypi('pkg'),
+                         ['2.0'])
+        self.assertEqual(self.store.get_validators('pkg'), ('"v2"', None))
+
+    def test_misses_remembered(self):
+        self.engine.session.get.return_value = MagicMock(status_code=404)
+        for _ in range(3):
+            self.assertEqual(
+                PyPIHelper.acquire_package_json_info('internal'), {})
+            self.assertFalse(
+                PyPIHelper.check_package_version_on_pypi('internal', '1.0'))
+        self.assertEqual(self.engine.session.get.call_count, 1)
+
+        with patch('magellan.deps_utils.MagellanConfig.negative_cache_ttl',
+                   0):
+            PyPIHelper.acquire_package_json_info('internal')
+        self.assertEqual(self.engine.session.get.call_count, 2)
+
+    def test_failures_remembered(self):
+        self.engine.session.get.side_effect = requests.Timeout()
+        PyPIHelper.acquire_package_json_info('internal')
+        PyPIHelper.acquire_package_json_info('internal')
+        self.assertEqual(self.engine.session.get.call_count, 1)
+
+    def test_package_versions_share_cache_and_metrics(self):
+        PyPIHelper.metrics.clear()
+        self.expire()
+        self.engine.session.get.return_value = MagicMock(status_code=304)
+        self.assertEqual(Package.get_package_versions_from_pypi('pkg'),
+                         ['1.0'])
+        self.assertEqual(Package.get_package_versions_from_pypi('pkg'),
+                         ['1.0'])
+        self.assertEqual(self.engine.session.get.call_count, 1)
+        self.assertEqual(PyPIHelper.metrics['not_modified'], 1)
+        # second lookup is answered by the memoised version index
+        self.assertIn('pkg', PyPIHelper._version_indexes)
+        self.assertEqual(PyPIHelper.metrics['cache'], 0)
+
+    def test_stale_copy_used_when_offline(self):
+        self.expire()
+        self.engine.session.get.side_effect = requests.ConnectionError()
+        res = PyPIHelper.acquire_package_json_info('pkg')
+        self.assertEqual(list(res['releases']), ['1.0'])
+
+
+if __name__ == '__main__':
+    unittest.main()
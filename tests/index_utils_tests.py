@@ -0,0 +1,144 @@
+"""
+Test suite for the index_utils module.
+
+Tests are for LocalIndex, serving packages from a local wheelhouse.
+"""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from mock import patch
+
+from magellan.cache_utils import DepCache
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.index_utils import LocalIndex, canonical_name
+
+
+class TestLocalIndexClass(unittest.TestCase):
+    """Base class; builds a small wheelhouse."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.wheelhouse = os.path.join(self.tmp_dir, 'wheelhouse')
+        os.mkdir(self.wheelhouse)
+        self.store = DepCache(os.path.join(self.tmp_dir, 'cache'))
+        self.addCleanup(self.store.close)
+
+        self.make_wheel('Foo_Bar', '1.0', ['six>=1.9', 'pytest; extra=="t"'])
+        self.make_wheel('Foo_Bar', '1.2', ['six>=1.10'])
+        self.make_sdist('six', '1.10.0', [])
+
+    def make_wheel(self, name, version, requires):
+        path = os.path.join(self.wheelhouse, '{0}-{1}-py2.py3-none-any.whl'
+                            .format(name, version))
+        metadata = "Metadata-Version: 2.1\nName: {0}\nVersion: {1}\n".format(
+            name.replace('_', '-'), version)
+        metadata += ''.join('Requires-Dist: {0}\n'.format(x)
+                            for x in requires)
+        with zipfile.ZipFile(path, 'w') as whl:
+            whl.writestr('{0}-{1}.dist-info/METADATA'.format(name, version),
+                         metadata)
+        return path
+
+    def make_sdist(self, name, version, requires):
+        path = os.path.join(self.wheelhouse, '{0}-{1}.tar.gz'
+                            .format(name, version))
+        pkg_info = "Metadata-Version: 2.2\nName: {0}\nVersion: {1}\n".format(
+            name, version)
+        pkg_info += ''.join('Requires-Dist: {0}\n'.format(x)
+                            for x in requires)
+        data = pkg_info.encode('utf-8')
+        with tarfile.open(path, 'w:gz') as tar:
+            info = tarfile.TarInfo('{0}-{1}/PKG-INFO'.format(name, version))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        return path
+
+
+class TestLocalIndex(TestLocalIndexClass):
+
+    def test_canonical_name(self):
+        self.assertEqual(canonical_name('Foo_Bar.baz'), 'foo-bar-baz')
+
+    def test_versions(self):
+        idx = LocalIndex([self.wheelhouse], store=self.store)
+        self.assertEqual(sorted(idx.versions('foo-bar')), ['1.0', '1.2'])
+        self.assertEqual(idx.versions('six'), ['1.10.0'])
+        self.assertEqual(idx.versions('missing'), None)
+
+    def test_requirements(self):
+        idx = LocalIndex([self.wheelhouse], store=self.store)
+        reqs = idx.get_requirements('Foo-Bar', '1.0')
+        self.assertEqual(list(reqs['requires']), ['six'])
+        self.assertEqual(reqs['requires']['six']['specs'], [('>=', '1.9')])
+        self.assertEqual(idx.get_requirements('six', '1.10.0')['requires'],
+                         {})
+        self.assertEqual(idx.get_requirements('Foo-Bar', '9.9'), None)
+
+    def test_package_json_latest(self):
+        idx = LocalIndex([self.wheelhouse], store=self.store)
+        doc = idx.package_json('foo_bar')
+        self.assertEqual(doc['info']['version'], '1.2')
+        self.assertEqual(doc['info']['requires_dist'], ['six>=1.10'])
+        self.assertEqual(idx.package_json('missing'), {})
+
+    def test_files_indexed_once(self):
+        LocalIndex([self.wheelhouse], store=self.store)
+        with patch('magellan.index_utils._index_file') as index_file:
+            idx = LocalIndex([self.wheelhouse], store=self.store)
+            self.assertFalse(index_file.called)
+        self.assertEqual(sorted(idx.versions('foo-bar')), ['1.0', '1.2'])
+
+    def test_removed_files_dropped(self):
+        LocalIndex([self.wheelhouse], store=self.store)
+        os.remove(os.path.join(self.wheelhouse, 'six-1.10.0.tar.gz'))
+        idx = LocalIndex([self.wheelhouse], store=self.store)
+        self.assertEqual(idx.versions('six'), None)
+        self.assertEqual(len(self.store.get_local_files(
+            os.path.abspath(self.wheelhouse))), 2)
+
+
+class TestOfflineMode(TestLocalIndexClass):
+    """PyPIHelper and DepTools served by the local index."""
+
+    def setUp(self):
+        super(TestOfflineMode, self).setUp()
+        patchers = [
+            patch('magellan.utils.MagellanConfig.local_index',
+                  [self.wheelhouse]),
+            patch('magellan.utils.MagellanConfig.cache_dir',
+                  os.path.join(self.tmp_dir, 'cache')),
+            patch('magellan.deps_utils.FetchEngine.default'),
+            patch('magellan.deps_utils.DepTools.'
+                  'install_and_get_deps_for_package_version'),
+        ]
+        self.mocks = [x.start() for x in patchers]
+        for x in patchers:
+            self.addCleanup(x.stop)
+
+    def tearDown(self):
+        self.assertFalse(self.mocks[2].called)
+        self.assertFalse(self.mocks[3].called)
+
+    def test_pypi_helper(self):
+        self.assertTrue(
+            PyPIHelper.check_package_version_on_pypi('foo-bar', '1.0'))
+        self.assertFalse(
+            PyPIHelper.check_package_version_on_pypi('foo-bar', '3.0'))
+        self.assertEqual(sorted(PyPIHelper.all_package_versions_on_pypi(
+            'Foo-Bar')), ['1.0', '1.2'])
+
+    def test_deps(self):
+        reqs = DepTools.get_deps_for_package_version('foo-bar', '1.2')
+        self.assertEqual(reqs['source'], 'local-index')
+        self.assertEqual(DepTools.get_deps_for_package_version(
+            'missing', '1.0'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
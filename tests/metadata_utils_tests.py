@@ -0,0 +1,129 @@
+"""
+Test suite for the metadata_utils module.
+
+Tests build small sdists on disk and read their requirements without
+installing them.
+"""
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from mock import patch
+
+from magellan.metadata_utils import (SdistMetadata, requirements_from_strings,
+                                     requirements_from_requires_txt)
+
+
+class TestRequirementsFromStrings(unittest.TestCase):
+    """Conversion of requirement strings to the requirements dict."""
+
+    def test_specs_and_keys(self):
+        res = requirements_from_strings(
+            'Foo', '1.0', ['Bar>=1.0,<2', 'baz'])
+        self.assertEqual(res['project_name'], 'Foo')
+        self.assertEqual(res['version'], '1.0')
+        self.assertEqual(sorted(res['requires']), ['bar', 'baz'])
+        self.assertEqual(res['requires']['bar']['project_name'], 'Bar')
+        self.assertEqual(sorted(res['requires']['bar']['specs']),
+                         [('<', '2'), ('>=', '1.0')])
+        self.assertEqual(res['requires']['baz']['specs'], [])
+
+    def test_extras_and_false_markers_dropped(self):
+        res = requirements_from_strings('Foo', '1.0', [
+            'bar; extra == "test"',
+            'baz; python_version < "2.0"',
+            'qux; python_version >= "2.0"',
+        ])
+        self.assertEqual(list(res['requires']), ['qux'])
+
+    def test_requires_txt_sections(self):
+        text = "bar>=1\n\n[test]\npytest\n\n[:python_version < '2.0']\nold\n"
+        self.assertEqual(requirements_from_requires_txt(text),
+                         ["bar>=1", "old; python_version < '2.0'"])
+
+
+class TestSdistMetadata(unittest.TestCase):
+    """Reading static requirements out of sdist archives."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_sdist(self, files):
+        path = os.path.join(self.tmp_dir, 'foo-1.0.tar.gz')
+        with tarfile.open(path, 'w:gz') as tar:
+            for name, text in files.items():
+                data = text.encode('utf-8')
+                info = tarfile.TarInfo('foo-1.0/' + name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_pkg_info_requires_dist(self):
+        path = self.make_sdist({'PKG-INFO': (
+            "Metadata-Version: 2.1\nName: Foo\nVersion: 1.0\n"
+            "Requires-Dist: bar (>=1.0)\n"
+            "Requires-Dist: pytest; extra == 'test'\n")})
+        res = SdistMetadata.get_requirements(path, 'foo', '1.0')
+        self.assertEqual(res['project_name'], 'Foo')
+        self.assertEqual(list(res['requires']), ['bar'])
+
+    def test_egg_info_requires_txt(self):
+        path = self.make_sdist({
+            'PKG-INFO': "Metadata-Version: 1.1\nName: Foo\nVersion: 1.0\n",
+            'foo.egg-info/PKG-INFO': "Metadata-Version: 1.1\nName: Foo\n",
+            'foo.egg-info/requires.txt': "six\nbar==2.0\n\n[docs]\nsphinx\n",
+        })
+        res = SdistMetadata.get_requirements(path, 'foo', '1.0')
+        self.assertEqual(sorted(res['requires']), ['bar', 'six'])
+        self.assertEqual(res['requires']['bar']['specs'], [('==', '2.0')])
+
+    def test_egg_info_without_requires_txt_has_no_requirements(self):
+        path = self.make_sdist({
+            'PKG-INFO': "Metadata-Version: 1.1\nName: Foo\nVersion: 1.0\n",
+            'foo.egg-info/PKG-INFO': "Metadata-Version: 1.1\nName: Foo\n",
+        })
+        res = SdistMetadata.get_requirements(path, 'foo', '1.0')
+        self.assertEqual(res['requires'], {})
+
+    def test_declarative_setup_cfg(self):
+        path = self.make_sdist({
+            'setup.py': "from setuptools import setup\nsetup()\n",
+            'setup.cfg': ("[metadata]\nname = Foo\n\n[options]\n"
+                          "install_requires =\n    six\n    bar>=1\n"),
+        })
+        res = SdistMetadata.get_requirements(path, 'foo', '1.0')
+        self.assertEqual(res['project_name'], 'foo')
+        self.assertEqual(sorted(res['requires']), ['bar', 'six'])
+
+    def test_undeterminable_returns_none(self):
+        path = self.make_sdist({'README': "nothing to see"})
+        self.assertEqual(
+            SdistMetadata.get_requirements(path, 'foo', '1.0'), None)
+
+    def test_setup_py_only_is_not_run(self):
+        path = self.make_sdist({
+            'setup.py': ("from setuptools import setup\n"
+                         "setup(install_requires=['six'])\n"),
+            'PKG-INFO': "Metadata-Version: 1.1\nName: Foo\nVersion: 1.0\n",
+        })
+        with patch('subprocess.Popen') as popen:
+            res = SdistMetadata.get_requirements(path, 'foo', '1.0')
+        self.assertEqual(res, None)
+        self.assertFalse(popen.called)
+
+    def test_bad_archive_returns_none(self):
+        path = os.path.join(self.tmp_dir, 'foo-1.0.tar.gz')
+        with open(path, 'w') as f:
+            f.write("not an archive")
+        self.assertEqual(
+            SdistMetadata.get_requirements(path, 'foo', '1.0'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
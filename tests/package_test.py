@@ -2,10 +2,20 @@
 Test suite for the package_utils module.
 """
 
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+from collections import OrderedDict
 from mock import MagicMock, mock_open, patch
-from magellan.package_utils import (Package, InvalidEdges)
-import pickle
+from magellan.package_utils import (Package, InvalidEdges, Requirements)
+from magellan.requirements_utils import parse_requirements_text
+from magellan.utils import MagellanConfig
+from magellan.version_utils import VersionIndex
 
 
 class TestPackageSetup(unittest.TestCase):
@@ -118,7 +128,7 @@ class TestPackageCheckVersion(TestPackageClass):
 
         to_patch = "magellan.package_utils.Package"
         with patch(to_patch) as MockClass:
-            MockClass.get_package_versions_from_pypi.return_value = vers
+            MockClass.get_version_index.return_value = VersionIndex(vers)
             return_info = Package.check_latest_major_minor_versions(
                 self.curp, curv)
         return return_info
@@ -532,5 +542,153 @@ class TestPackageGetDirectLinksToAnyPackage(TestPackageClass):
                           Package.get_direct_links_to_any_package, *args)
 
 
+class TestPackageCheckOutdatedConcurrently(unittest.TestCase):
+    """Whole environment outdated checks run on the pool, reported in order.
+    """
+
+    def test_reports_in_input_order(self):
+        packages = OrderedDict(
+            (n, Package(n, '1.0')) for n in ('slow', 'mid', 'fast'))
+        delays = {'slow': 0.2, 'mid': 0.1, 'fast': 0.0}
+        threads = set()
+
+        def fake_check(package, version):
+            threads.add(threading.current_thread().name)
+            time.sleep(delays[package])
+            return package
+
+        reported = []
+        with patch("magellan.package_utils.Package"
+                   ".check_latest_major_minor_versions",
+                   side_effect=fake_check), \
+            patch("magellan.package_utils.Package.detail_version_info",
+                  side_effect=lambda info, *a: reported.append(info)):
+            Package.check_outdated_packages(packages)
+
+        self.assertEqual(reported, ['slow', 'mid', 'fast'])
+        self.assertTrue(len(threads) > 1)
+
+
+class TestPackageOutdatedJsonLines(unittest.TestCase):
+    """--format jsonl: one record per package, written as it is ready."""
+
+    def setUp(self):
+        self.config = MagellanConfig
+        self.config.output_format = 'jsonl'
+
+    def tearDown(self):
+        self.config.output_format = 'text'
+
+    def test_one_record_per_package(self):
+        packages = OrderedDict(
+            (n, Package(n, v)) for n, v in [('a', '1.0'), ('b', '2.1')])
+        index = VersionIndex(['1.0', '1.0.3', '2.0', '2.1'])
+        written = []
+        with patch('magellan.package_utils.PyPIHelper.version_index',
+                   return_value=index), \
+                patch('magellan.utils.sys.stdout') as stdout:
+            stdout.write.side_effect = written.append
+            Package.check_outdated_packages(packages, source='reqs.txt')
+
+        records = [json.loads(x) for x in written]
+        self.assertEqual([(r['type'], r['package'], r['status'])
+                          for r in records],
+                         [('outdated', 'a', 'outdated'),
+                          ('outdated', 'b', 'up_to_date')])
+        self.assertEqual(records[0]['latest'], '2.1')
+        self.assertEqual(records[0]['latest_minor'], '1.0.3')
+        self.assertEqual(records[0]['source'], 'reqs.txt')
+        self.assertEqual(stdout.flush.call_count, 2)
+
+
+class TestRequirementsManyFiles(unittest.TestCase):
+    """-O over several requirements files checks each pair once."""
+
+    @staticmethod
+    def _parsed(*lines):
+        return list(parse_requirements_text("\n".join(lines)))
+
+    def test_expand_req_files(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        for f in ('requirements-b.txt', 'requirements-a.txt', 'other.txt'):
+            open(os.path.join(tmp, f), 'w').close()
+        a, b = [os.path.join(tmp, 'requirements-{}.txt'.format(x))
+                for x in 'ab']
+        missing = os.path.join(tmp, 'missing.txt')
+        self.assertEqual(Requirements.expand_req_files(
+            [os.path.join(tmp, 'requirements*.txt'), b, missing]),
+            [a, b, missing])
+
+    def test_pairs_checked_once_and_reported_per_file(self):
+        files = {
+            'a.txt': self._parsed('django==1.8', 'six==1.9'),
+            'b.txt': self._parsed('six==1.9', 'pbr'),
+        }
+        checked = []
+        reported = []
+
+        def check(p):
+            checked.append((p.name, p.version))
+            return {'code': 0}
+
+        with patch.object(Requirements, 'parse_req_file',
+                          side_effect=lambda f: files[f]), \
+                patch.object(Package, '_check_versions', side_effect=check), \
+                patch.object(Package, 'detail_version_info',
+                             side_effect=lambda i, p, v, *a:
+                             reported.append((p, v))), \
+                patch.object(Requirements, '_print_req_env_comp_list') \
+                as no_version, \
+                patch('magellan.package_utils.print_col'):
+            res = Requirements.check_outdated_requirements_files(
+                ['a.txt', 'b.txt'])
+
+        self.assertEqual(sorted(checked), [('django', '1.8'), ('six', '1.9')])
+        self.assertEqual(reported, [('django', '1.8'), ('six', '1.9'),
+                                    ('six', '1.9')])
+        self.assertEqual(sorted(res), [('django', '1.8'), ('six', '1.9')])
+        self.assertEqual(no_version.call_args[0][1], ['pbr'])
+
+
+class TestRequirementsEnvMatrix(unittest.TestCase):
+    """-R with --compare-env: every file against every environment."""
+
+    @staticmethod
+    def _env(*packages):
+        venv = MagicMock()
+        venv.all_packages = {n: Package(n, v) for n, v in packages}
+        return venv
+
+    def test_matrix(self):
+        files = {
+            'a.txt': parse_requirements_text("django==1.8\nsix==1.9\npbr"),
+            'b.txt': parse_requirements_text("six==1.10"),
+            'empty.txt': [],
+        }
+        envs = [('prod', self._env(('django', '1.8'), ('six', '1.9'))),
+                ('dev', self._env(('six', '1.10'), ('mock', '1.0')))]
+        with patch.object(Requirements, 'parse_req_file',
+                          side_effect=lambda f: list(files[f])) as parse:
+            matrix = Requirements.compare_req_files_to_envs(
+                ['a.txt', 'b.txt', 'empty.txt'], envs)
+
+        self.assertEqual(parse.call_count, 3)
+        self.assertEqual(list(matrix), [('a.txt', 'prod'), ('a.txt', 'dev'),
+                                        ('b.txt', 'prod'), ('b.txt', 'dev')])
+        self.assertEqual(matrix[('a.txt', 'prod')], (
+            [('django', '1.8'), ('six', '1.9')], [], ['pbr'], []))
+        self.assertEqual(matrix[('a.txt', 'dev')], (
+            [], [('six', '1.9', '1.10')], ['django', 'pbr'], ['mock']))
+        self.assertEqual(matrix[('b.txt', 'dev')],
+                         ([('six', '1.10')], [], [], ['mock']))
+
+        with patch('magellan.package_utils.print_col') as printed:
+            Requirements.print_req_env_matrix(matrix)
+        table = printed.call_args[0][0]
+        self.assertIn('2/0/1/0', table)
+        self.assertIn('0/1/2/1', table)
+
+
 if __name__ == '__main__':
     unittest.main()
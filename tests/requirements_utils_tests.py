@@ -0,0 +1,171 @@
+"""
+Test suite for the requirements_utils module: the requirements file parser.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+
+from magellan import requirements_utils
+from magellan.package_utils import Requirements
+from magellan.requirements_utils import (RequirementsFileError,
+                                         logical_lines,
+                                         parse_requirements_file,
+                                         parse_requirements_text)
+
+
+class TestLogicalLines(unittest.TestCase):
+
+    def test_continuations_and_comments(self):
+        text = ("# header\n"
+                "six==1.9  # pinned\n"
+                "\n"
+                "requests>=2 \\\n"
+                "    --hash=sha256:abc\n"
+                "pbr \\\n")
+        self.assertEqual(list(logical_lines(text)), [
+            (2, 'six==1.9'),
+            (4, 'requests>=2     --hash=sha256:abc'),
+            (6, 'pbr')])
+
+
+class TestParseRequirementsText(unittest.TestCase):
+
+    def parse(self, text):
+        return list(parse_requirements_text(text, '/reqs/requirements.txt'))
+
+    def test_extras_markers_hashes(self):
+        r, = self.parse('Foo_Bar[b,a]>=1.0,<2 ; python_version >= "2.6" '
+                        '--hash=sha256:abc --hash sha256:def')
+        self.assertEqual(r.key, 'foo-bar')
+        self.assertEqual(sorted(r.specs), [('<', '2'), ('>=', '1.0')])
+        self.assertEqual(r.extras, ('a', 'b'))
+        self.assertEqual(r.markers, 'python_version >= "2.6"')
+        self.assertTrue(r.markers_apply())
+        self.assertEqual(r.hashes, ['sha256:abc', 'sha256:def'])
+        self.assertEqual(r.comes_from, '/reqs/requirements.txt:1')
+
+    def test_includes_and_options(self):
+        items = self.parse("-r base.txt\n"
+                           "--requirement=sub/more.txt\n"
+                           "-cconstraints.txt\n"
+                           "-r https://example.com/reqs.txt\n"
+                           "--index-url https://pypi.org/simple\n"
+                           "--pre\n")
+        self.assertEqual(items, [
+            ('-r', '/reqs/base.txt'),
+            ('-r', '/reqs/sub/more.txt'),
+            ('-c', '/reqs/constraints.txt'),
+            ('-r', None)])
+
+    def test_editables_and_urls(self):
+        items = self.parse(
+            "-e git+https://github.com/x/y.git#egg=yproj\n"
+            "-e .\n"
+            "https://example.com/z-1.0.tar.gz#egg=zed\n"
+            "django==1.8 --install-option='--prefix=/x'\n")
+        self.assertEqual([(x.key, x.editable, bool(x.link)) for x in items],
+                         [('yproj', True, True), ('zed', False, True),
+                          ('django', False, False)])
+        self.assertEqual(items[2].specs, [('==', '1.8')])
+
+
+class TestParseRequirementsFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_includes_expanded_in_place(self):
+        req = self.write('requirements.txt',
+                         "six==1.9\n-r sub/base.txt\n-c sub/c.txt\npbr\n")
+        self.write('sub/base.txt', "django==1.8\n")
+        self.write('sub/c.txt', "urllib3<2\n")
+        parsed = list(parse_requirements_file(req))
+        self.assertEqual([(x.key, x.constraint) for x in parsed],
+                         [('six', False), ('django', False),
+                          ('urllib3', True), ('pbr', False)])
+
+    def test_requirements_parse_req_file(self):
+        req = self.write('requirements.txt',
+                         "six==1.9\n"
+                         "pywin32==1 ; sys_platform == 'no-such-platform'\n"
+                         "-c c.txt\n")
+        self.write('c.txt', "urllib3<2\n")
+        self.assertEqual([x.key for x in Requirements.parse_req_file(req)],
+                         ['six'])
+        self.assertEqual(
+            [x.key for x in Requirements.parse_req_file(req, True)],
+            ['six', 'urllib3'])
+        self.assertEqual(Requirements.package_versions_from_req_file(req),
+                         [('six', '1.9')])
+
+    def test_cycles_and_diamonds(self):
+        a = self.write('a.txt', "-r b.txt\n-r c.txt\nsix\n")
+        self.write('b.txt', "-r base.txt\n-r a.txt\npbr\n")
+        self.write('c.txt', "-r base.txt\nmock\n")
+        self.write('base.txt', "django\n")
+        with patch.object(requirements_utils.maglog, 'warn') as warn:
+            keys = [x.key for x in parse_requirements_file(a)]
+        self.assertEqual(keys, ['django', 'pbr', 'mock', 'six'])
+        self.assertIn('a.txt -> ', warn.call_args[0][0])
+
+    def test_shared_files_parsed_once(self):
+        base = self.write('base.txt', "django==1.8\n")
+        one = self.write('one.txt', "-r base.txt\nsix\n")
+        two = self.write('two.txt', "-r base.txt\npbr\n")
+        parsed = []
+        real_parse = requirements_utils.parse_requirements_text
+
+        def counting_parse(text, req_file, *args):
+            parsed.append(os.path.basename(req_file))
+            return real_parse(text, req_file, *args)
+
+        with patch.object(requirements_utils, 'parse_requirements_text',
+                          side_effect=counting_parse):
+            for req_file in (one, two, one):
+                list(parse_requirements_file(req_file))
+            self.assertEqual(parsed, ['one.txt', 'base.txt', 'two.txt'])
+
+            self.write('base.txt', "django==1.9\n")  # contents changed
+            res = list(parse_requirements_file(two))
+        self.assertEqual(parsed[3:], ['base.txt'])
+        self.assertEqual(res[0].specs, [('==', '1.9')])
+
+    def test_reparsed_when_path_or_env_vars_change(self):
+        req = self.write('a/requirements.txt',
+                         "six==${SIX_VERSION}\n-r base.txt\n")
+        self.write('a/base.txt', "django\n")
+        self.write('b/base.txt', "pbr\n")
+        link = os.path.join(self.tmp, 'b', 'requirements.txt')
+        os.symlink(req, link)
+
+        with patch.dict(os.environ, {'SIX_VERSION': '1.9'}):
+            first = [(x.key, x.specs) for x in parse_requirements_file(req)]
+        with patch.dict(os.environ, {'SIX_VERSION': '1.10'}):
+            second = [(x.key, x.specs) for x in parse_requirements_file(req)]
+            linked = [x.key for x in parse_requirements_file(link)]
+        self.assertEqual(first, [('six', [('==', '1.9')]), ('django', [])])
+        self.assertEqual(second, [('six', [('==', '1.10')]), ('django', [])])
+        # includes are relative to the path the file was read through
+        self.assertEqual(linked, ['six', 'pbr'])
+
+    def test_missing_file(self):
+        with self.assertRaises(RequirementsFileError):
+            list(parse_requirements_file(os.path.join(self.tmp, 'nope.txt')))
+        self.assertEqual(Requirements.parse_req_file(
+            os.path.join(self.tmp, 'nope.txt')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
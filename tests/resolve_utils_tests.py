@@ -0,0 +1,154 @@
+"""
+Test suite for the resolve_utils module.
+
+Tests are for Resolver: environments built from requirements files using
+package metadata only.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock, patch
+
+from magellan.deps_utils import DepTools
+from magellan.metadata_utils import requirements_from_strings
+from magellan.requirements_utils import parse_requirements_text
+from magellan.resolve_utils import Resolver, environment_from_freeze
+from magellan.version_utils import VersionIndex
+
+VERSIONS = {
+    'app': ['1.0', '2.0'],
+    'lib': ['1.0', '1.5', '2.0', '3.0b1'],
+    'util': ['0.9', '1.0'],
+    'old': ['1.0'],
+}
+
+REQUIRES = {
+    ('app', '1.0'): ['lib>=1.0,<2', 'util'],
+    ('lib', '1.5'): ['util>=0.9'],
+    ('util', '0.9'): [],
+    ('util', '1.0'): [],
+    ('old', '1.0'): ['lib<1.5'],
+}
+
+
+def fake_deps(package, version):
+    if (package, version) not in REQUIRES:
+        return None
+    return requirements_from_strings(package, version,
+                                     REQUIRES[(package, version)])
+
+
+class TestResolver(unittest.TestCase):
+
+    def setUp(self):
+        patchers = [
+            patch('magellan.resolve_utils.PyPIHelper.version_index',
+                  side_effect=lambda p: VersionIndex(VERSIONS.get(p, []))),
+            patch.object(DepTools, 'get_deps_without_install',
+                         side_effect=fake_deps),
+        ]
+        for p in patchers:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def resolve(self, text):
+        return Resolver().resolve(list(parse_requirements_text(text)))
+
+    def test_transitive_closure(self):
+        resolver = self.resolve("app==1.0\n")
+        self.assertEqual(dict(resolver.pins), {
+            'app': ('app', '1.0'), 'lib': ('lib', '1.5'),
+            'util': ('util', '1.0')})
+        self.assertEqual(resolver.conflicts, [])
+
+    def test_constraints_unresolved_and_conflicts(self):
+        # both requirements of lib arrive at the same level: satisfied
+        resolver = self.resolve("app==1.0\nold\nmissing\n")
+        self.assertEqual(resolver.pins['lib'], ('lib', '1.0'))
+        self.assertEqual(list(resolver.unresolved), ['missing'])
+        self.assertEqual(resolver.conflicts, [])
+
+        # lib pinned at the top level, before old's requirement is seen
+        resolver = self.resolve("lib\nold\n")
+        self.assertEqual(resolver.pins['lib'], ('lib', '2.0'))
+        self.assertEqual(resolver.conflicts,
+                         [('lib', '2.0', 'lib<1.5', 'old')])
+
+        resolver = Resolver().resolve(
+            list(parse_requirements_text("app==1.0\n")) +
+            list(parse_requirements_text("util<1", constraint=True)))
+        self.assertEqual(resolver.pins['util'], ('util', '0.9'))
+
+    def test_best_version(self):
+        self.assertEqual(self.resolve("lib!=2.0\n").pins['lib'],
+                         ('lib', '1.5'))
+        # only a pre-release qualifies
+        self.assertEqual(self.resolve("lib>2.0\n").pins['lib'],
+                         ('lib', '3.0b1'))
+
+    def test_requirements_without_requires(self):
+        with patch.object(DepTools, 'get_deps_without_install',
+                          return_value={'project_name': 'util',
+                                        'version': '1.0', 'requires': None}):
+            resolver = self.resolve("util\n")
+        self.assertEqual(dict(resolver.pins), {'util': ('util', '1.0')})
+
+    def test_environment_and_lock_file(self):
+        # lib is pinned (to 2.0) before old's "lib<1.5" is seen.
+        resolver = self.resolve("lib\nold\n")
+        venv = resolver.environment('requirements.txt')
+
+        self.assertEqual(sorted(venv.all_packages), ['lib', 'old'])
+        self.assertIn([('old', '1.0'), ('lib', '2.0'), [('<', '1.5')]],
+                      venv.edges)
+        self.assertEqual(
+            venv.package_requirements['old']['requires']['lib']['specs'],
+            [('<', '1.5')])
+        conflicts = DepTools.highlight_conflicts_in_current_env(
+            venv.nodes, venv.package_requirements)
+        self.assertEqual([(x[0][0], x[1]) for x in conflicts],
+                         [('old', 'lib')])
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        lock = os.path.join(tmp, 'requirements.lock')
+        resolver.write_lock_file(lock, 'requirements.txt')
+        with open(lock) as f:
+            self.assertEqual(f.read().splitlines(), [
+                "# Pinned by magellan from requirements.txt",
+                "lib==2.0", "old==1.0"])
+
+
+class TestEnvironmentFromFreeze(unittest.TestCase):
+
+    def test_freeze_snapshot(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        freeze = os.path.join(tmp, 'freeze.txt')
+        with open(freeze, 'w') as f:
+            f.write("app==1.0\nlib==1.5\nutil==0.9\n"
+                    "local @ file:///tmp/local-1.0.whl\n")
+
+        store = MagicMock()
+        store.get_requirements_bulk.return_value = {
+            ('util', '0.9'): fake_deps('util', '0.9')}
+        with patch('magellan.resolve_utils.DepCache.default',
+                   return_value=store), \
+                patch.object(DepTools, 'get_deps_without_install',
+                             side_effect=fake_deps) as deps:
+            venv = environment_from_freeze(freeze)
+
+        self.assertEqual(sorted(x[0] for x in deps.call_args_list),
+                         [('app', '1.0'), ('lib', '1.5')])
+        self.assertEqual(venv.nodes, [('app', '1.0'), ('lib', '1.5'),
+                                      ('util', '0.9')])
+        self.assertIn([('app', '1.0'), ('util', '0.9'), []], venv.edges)
+        self.assertEqual(venv.package_in_env('lib'), (True, ('lib', '1.5')))
+        self.assertEqual(DepTools.highlight_conflicts_in_current_env(
+            venv.nodes, venv.package_requirements), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+Test suite for the simple_utils module.
+
+Tests are for SimpleIndex, the PEP 503/691 index backend.
+"""
+
+import hashlib
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock, patch
+
+from magellan.deps_utils import DepTools, PyPIHelper
+from magellan.fetch_utils import FetchEngine
+from magellan.simple_utils import SimpleIndex, SIMPLE_JSON
+
+INDEX = 'https://mirror.example.com/simple'
+
+HTML_PAGE = """<!DOCTYPE html>
+<html><body>
+<a href="../../files/foo_bar-1.0.tar.gz#sha256=abc">foo_bar-1.0.tar.gz</a>
+<a href="../../files/foo_bar-1.0-py3-none-any.whl#sha256=def"
+   data-dist-info-metadata="true">foo_bar-1.0-py3-none-any.whl</a>
+<a href="../../files/foo_bar-1.1-py3-none-any.whl"
+   data-yanked="broken">foo_bar-1.1-py3-none-any.whl</a>
+<a href="../../files/foo_bar-2.0b1.tar.gz">foo_bar-2.0b1.tar.gz</a>
+</body></html>
+"""
+
+METADATA = (b"Metadata-Version: 2.1\nName: foo-bar\nVersion: 1.0\n"
+            b"Requires-Dist: six>=1.9\n"
+            b"Requires-Dist: pytest; extra == 'test'\n")
+
+
+def _response(status_code=200, url='', content_type='text/html', text='',
+              json=None, content=b''):
+    r = MagicMock(status_code=status_code, url=url, text=text,
+                  content=content, headers={'Content-Type': content_type})
+    r.json.return_value = json
+    return r
+
+
+class TestParseProjectPage(unittest.TestCase):
+
+    def test_html(self):
+        doc = SimpleIndex.parse_project_page('Foo.Bar', _response(
+            url=INDEX + '/foo-bar/', text=HTML_PAGE))
+
+        self.assertEqual(sorted(doc['releases']), ['1.0', '1.1', '2.0b1'])
+        self.assertEqual(doc['info']['version'], '1.1')
+        whl, = [x for x in doc['releases']['1.0']
+                if x['packagetype'] == 'bdist_wheel']
+        self.assertEqual(
+            whl['url'],
+            'https://mirror.example.com/files/foo_bar-1.0-py3-none-any.whl')
+        self.assertTrue(whl['core_metadata'])
+        self.assertFalse(whl['yanked'])
+        self.assertTrue(doc['releases']['1.1'][0]['yanked'])
+        self.assertEqual(doc['releases']['1.0'][0]['packagetype'], 'sdist')
+
+    def test_json(self):
+        page = {'meta': {'api-version': '1.1'}, 'name': 'foo-bar', 'files': [
+            {'filename': 'foo_bar-1.0-py3-none-any.whl',
+             'url': '/files/foo_bar-1.0-py3-none-any.whl',
+             'hashes': {}, 'core-metadata': {'sha256': 'abc'}},
+            {'filename': 'foo-bar-1.0.zip', 'url': '/files/foo-bar-1.0.zip',
+             'hashes': {}, 'yanked': 'reason'},
+        ]}
+        doc = SimpleIndex.parse_project_page('foo-bar', _response(
+            url=INDEX + '/foo-bar/', content_type=SIMPLE_JSON, json=page))
+
+        files = doc['releases']['1.0']
+        self.assertEqual(files[0]['core_metadata'], {'sha256': 'abc'})
+        self.assertEqual(files[1]['core_metadata'], False)
+        self.assertTrue(files[1]['yanked'])
+        self.assertEqual(files[1]['packagetype'], 'sdist')
+
+
+class TestIndexBackend(unittest.TestCase):
+    """PyPIHelper and DepTools using an --index-url."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+        def fake_get(url, **kwargs):
+            if url == INDEX + '/foo-bar/':
+                return _response(url=url, text=HTML_PAGE)
+            if url.endswith('-1.0-py3-none-any.whl.metadata'):
+                return _response(content=METADATA)
+            return _response(status_code=404)
+
+        self.engine = FetchEngine(workers=2)
+        self.engine.session = MagicMock()
+        self.engine.session.get.side_effect = fake_get
+
+        patchers = [
+            patch('magellan.deps_utils.MagellanConfig.cache_dir',
+                  self.cache_dir),
+            patch('magellan.deps_utils.MagellanConfig.index_url', INDEX),
+            patch('magellan.deps_utils.FetchEngine.default',
+                  return_value=self.engine),
+        ]
+        for x in patchers:
+            x.start()
+            self.addCleanup(x.stop)
+
+    def test_versions(self):
+        self.assertEqual(
+            sorted(PyPIHelper.all_package_versions_on_pypi('foo-bar')),
+            ['1.0', '1.1', '2.0b1'])
+        self.assertTrue(PyPIHelper.check_package_version_on_pypi(
+            'foo-bar', '1.0'))
+        self.assertFalse(PyPIHelper.check_package_version_on_pypi(
+            'foo-bar', '3.0'))
+        self.assertEqual(self.engine.session.get.call_count, 1)
+
+    def test_requirements_from_metadata_file(self):
+        reqs = DepTools.get_deps_without_install('foo-bar', '1.0')
+        self.assertEqual(reqs['source'], 'index-metadata')
+        self.assertEqual(list(reqs['requires']), ['six'])
+
+    def test_metadata_hash_checked(self):
+        files = [{'url': INDEX + '/foo_bar-1.0-py3-none-any.whl',
+                  'packagetype': 'bdist_wheel',
+                  'core_metadata': {'sha256': 'wrong'}}]
+        self.assertIsNone(
+            SimpleIndex.get_requirements('foo-bar', '1.0', files))
+        files[0]['core_metadata']['sha256'] = \
+            hashlib.sha256(METADATA).hexdigest()
+        self.assertIsNotNone(
+            SimpleIndex.get_requirements('foo-bar', '1.0', files))
+
+
+if __name__ == '__main__':
+    unittest.main()
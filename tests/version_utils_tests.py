@@ -0,0 +1,182 @@
+"""
+Test suite for the version_utils module.
+
+Tests are for VersionIndex and the outdated checks built on it, and for
+VersionIntervals and the per-environment allowed versions compiled from them.
+"""
+
+import unittest
+from mock import patch
+
+from magellan.deps_utils import DepTools
+from magellan.env_utils import Environment
+from magellan.package_utils import Package
+from magellan.version_utils import (VersionIndex, VersionIntervals,
+                                    release_series)
+
+
+class TestVersionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = VersionIndex([
+            '1.10.0', '1.9.2', '1.9.10', '1.9', '2.0rc1', '1.10.1b1',
+            '0.9'])
+
+    def test_pep440_order(self):
+        # natsort would put 1.9 after 1.9.10 and 2.0rc1 after 1.10.0 is fine,
+        # but PEP 440 also orders pre-releases before their final.
+        self.assertEqual(self.index.versions, [
+            '0.9', '1.9', '1.9.2', '1.9.10', '1.10.0', '1.10.1b1', '2.0rc1'])
+
+    def test_latest_skips_prereleases(self):
+        self.assertEqual(self.index.latest(), '1.10.0')
+        self.assertEqual(VersionIndex(['1.0a1', '1.0a2']).latest(), '1.0a2')
+        self.assertEqual(VersionIndex([]).latest(), None)
+
+    def test_latest_in_series(self):
+        self.assertEqual(self.index.latest_in_series('1.9.2'), '1.9.10')
+        self.assertEqual(self.index.latest_in_series('1.10'), '1.10.0')
+        self.assertEqual(self.index.latest_in_series('1.10.1b1'), '1.10.1b1')
+        self.assertEqual(self.index.latest_in_series('3.1'), None)
+
+    def test_bisect_lookups(self):
+        self.assertIn('1.9.0', self.index)  # PEP 440 equal to 1.9
+        self.assertNotIn('1.9.3', self.index)
+        self.assertTrue(self.index.is_beyond_latest('1.11'))
+        self.assertFalse(self.index.is_beyond_latest('1.10.0'))
+
+    def test_release_series(self):
+        self.assertEqual(release_series('1.8.2rc1'), (1, 8))
+        self.assertEqual(release_series('2'), (2, 0))
+        self.assertEqual(release_series('1!3.4'), (3, 4))
+        self.assertEqual(release_series('dev'), None)
+
+    def test_outdated_check_uses_pep440(self):
+        with patch('magellan.package_utils.PyPIHelper.version_index',
+                   return_value=self.index):
+            info = Package.check_latest_major_minor_versions('foo', '1.9.2')
+        self.assertEqual(info['code'], 1)
+        self.assertEqual(info['major_version']['latest'], '1.10.0')
+        self.assertEqual(info['minor_version']['latest'], '1.9.10')
+        self.assertTrue(info['minor_version']['outdated'])
+
+
+class TestVersionIntervals(unittest.TestCase):
+
+    def test_specs_compile_to_intervals(self):
+        allowed = VersionIntervals.from_specs(
+            [('>=', '1.4'), ('!=', '1.5'), ('<', '2')])
+        self.assertEqual(len(allowed.intervals), 2)
+        self.assertIn('1.4', allowed)
+        self.assertIn('1.5.1', allowed)
+        self.assertNotIn('1.5', allowed)
+        self.assertNotIn('2.0', allowed)
+        self.assertNotIn('1.3', allowed)
+
+    def test_compatible_release_and_wildcards(self):
+        compatible = VersionIntervals.from_specs([('~=', '1.4.2')])
+        self.assertIn('1.4.9', compatible)
+        self.assertNotIn('1.5', compatible)
+        self.assertNotIn('1.4.1', compatible)
+        wildcard = VersionIntervals.from_specs([('==', '1.4.*')])
+        self.assertIn('1.4.0', wildcard)
+        self.assertNotIn('1.5.0', wildcard)
+        excluded = VersionIntervals.from_specs([('!=', '1.*')])
+        self.assertIn('0.9', excluded)
+        self.assertIn('2.0', excluded)
+        self.assertNotIn('1.3', excluded)
+
+    def test_intersection(self):
+        a = VersionIntervals.from_specs([('>=', '1.0'), ('!=', '1.5')])
+        b = VersionIntervals.from_specs([('<=', '1.5')])
+        both = a.intersect(b)
+        self.assertIn('1.0', both)
+        self.assertIn('1.4.9', both)
+        self.assertNotIn('1.5', both)
+        self.assertTrue(both.intersect(
+            VersionIntervals.from_specs([('>', '1.5')])).is_empty())
+        self.assertFalse(VersionIntervals().is_empty())  # no specs: any
+
+    def test_unreadable_spec_does_not_restrict(self):
+        allowed = VersionIntervals.from_specs([('~=', '1'), ('<', '2')])
+        self.assertIn('1.9', allowed)
+        self.assertNotIn('2.0', allowed)
+
+    def test_satisfying_releases(self):
+        index = VersionIndex(['1.3', '1.4', '1.4.3', '1.5', '1.5.1', '1.6rc1',
+                              '2.0'])
+        allowed = VersionIntervals.from_specs(
+            [('>=', '1.4'), ('!=', '1.5'), ('<', '2')])
+        self.assertEqual(index.satisfying(allowed), ['1.4', '1.4.3', '1.5.1'])
+        self.assertEqual(index.satisfying(allowed, prereleases=True),
+                         ['1.4', '1.4.3', '1.5.1', '1.6rc1'])
+        self.assertEqual(
+            index.satisfying(VersionIntervals.from_specs([('>', '1.5.1'),
+                                                          ('<', '2')])),
+            ['1.6rc1'])  # only a pre-release qualifies
+        self.assertEqual(index.satisfying(
+            VersionIntervals.from_specs([('>', '2')])), [])
+
+
+class TestEnvironmentAllowedVersions(unittest.TestCase):
+
+    def setUp(self):
+        nodes = [['app', '1.0'], ['lib', '2.0'], ['six', '1.9']]
+        edges = [[['root', '0.0.0'], n] for n in nodes] + [
+            [['app', '1.0'], ['six', '1.9'], [['>=', '1.5']]],
+            [['lib', '2.0'], ['six', '1.9'], [['<', '1.11'], ['!=', '1.10']]],
+        ]
+        package_requirements = {
+            'app': {'project_name': 'app', 'version': '1.0', 'requires': {
+                'six': {'project_name': 'six', 'specs': [['>=', '1.5']]}}},
+            'lib': {'project_name': 'lib', 'version': '2.0', 'requires': {
+                'six': {'project_name': 'six',
+                        'specs': [['<', '1.11'], ['!=', '1.10']]}}},
+            'six': {'project_name': 'six', 'version': '1.9', 'requires': {}},
+        }
+        self.venv = Environment('env')
+        self.venv.load_graph(nodes, edges, package_requirements)
+        self.index = VersionIndex(['1.4', '1.5', '1.9', '1.10', '1.10.1',
+                                   '1.11', '1.12'])
+
+    def test_intersection_of_all_dependents(self):
+        allowed = self.venv.allowed_versions()
+        self.assertEqual(sorted(allowed), ['six'])
+        self.assertEqual(self.index.satisfying(allowed['six']),
+                         ['1.5', '1.9', '1.10.1'])
+        self.assertIs(self.venv.allowed_versions(), allowed)  # built once
+
+    def test_reloading_graph_recompiles(self):
+        allowed = self.venv.allowed_versions()
+        self.venv.load_graph(self.venv.nodes, self.venv.edges, {})
+        self.assertIsNot(self.venv.allowed_versions(), allowed)
+        self.assertEqual(self.venv.allowed_versions(), {})
+
+    def test_upgrade_check_within_allowed_versions(self):
+        ancestors = self.venv.all_packages['six'].ancestors(self.venv.edges)
+        allowed = self.venv.allowed_versions()['six']
+        with patch.object(DepTools, 'check_requirement_satisfied') as check:
+            res = DepTools.check_if_ancestors_still_satisfied(
+                'six', '1.10.1', ancestors, self.venv.package_requirements,
+                allowed)
+        self.assertFalse(check.called)
+        self.assertEqual(res['conflicts'], {})
+        self.assertEqual(sorted(res['checks']), ['app', 'lib'])
+
+        res = DepTools.check_if_ancestors_still_satisfied(
+            'six', '1.11', ancestors, self.venv.package_requirements, allowed)
+        self.assertEqual(list(res['conflicts']), ['lib'])
+
+    def test_show_allowed_versions(self):
+        with patch('magellan.deps_utils.PyPIHelper.version_index',
+                   return_value=self.index), \
+                patch('magellan.deps_utils.print_col'):
+            found = DepTools.show_allowed_versions(
+                [['six'], ['app'], ['missing']], self.venv)
+        self.assertEqual(found['six'], ['1.5', '1.9', '1.10.1'])
+        self.assertEqual(found['app'], self.index.versions)  # no dependents
+        self.assertIsNone(found['missing'])
+
+
+if __name__ == '__main__':
+    unittest.main()